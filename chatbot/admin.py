@@ -41,10 +41,12 @@ class AgentAdmin(admin.ModelAdmin):
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ('title_display', 'agent', 'session_id_short', 'user_id', 'is_active', 'message_count', 'created_at')
+    list_display = ('title_display', 'agent', 'session_id_short', 'user_id', 'is_active', 'message_count', 'last_message_at', 'created_at')
     list_filter = ('agent', 'is_active', 'created_at')
     search_fields = ('title', 'user_id', 'session_id')
-    readonly_fields = ('session_id', 'created_at', 'updated_at', 'message_count')
+    list_select_related = ('agent',)
+    readonly_fields = ('session_id', 'created_at', 'updated_at', 'message_count', 'last_message_at', 'last_message_preview',
+                       'summarized_through_at', 'summarized_through_id')
     inlines = [MessageInline]
     
     fieldsets = (
@@ -52,7 +54,8 @@ class ConversationAdmin(admin.ModelAdmin):
             'fields': ('agent', 'user_id', 'title', 'is_active')
         }),
         ('Szczegóły', {
-            'fields': ('session_id', 'summary', 'metadata')
+            'fields': ('session_id', 'summary', 'summarized_through_at', 'summarized_through_id', 'metadata',
+                       'message_count', 'last_message_at', 'last_message_preview')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -67,10 +70,6 @@ class ConversationAdmin(admin.ModelAdmin):
     def session_id_short(self, obj):
         return str(obj.session_id)[:8] + "..."
     session_id_short.short_description = 'Session ID'
-    
-    def message_count(self, obj):
-        return obj.messages.count()
-    message_count.short_description = 'Wiadomości'
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
@@ -77,16 +77,8 @@ class ChatMessageAPIView(APIView):
                 session_id = validated_data['session_id']
                 message = validated_data['message']
                 
-                # Add user message to conversation
-                await conversation_manager.add_message(
-                    session_id=session_id,
-                    role='user',
-                    content=message,
-                    metadata={'timestamp': 'auto'}
-                )
-                
-                # Get conversation context
-                context = await conversation_manager.get_conversation_context(session_id)
+                # Get conversation, agent and recent messages
+                context = await conversation_manager.load_turn_context(session_id)
                 if not context:
                     return Response({
                         'success': False, 
@@ -105,20 +97,25 @@ class ChatMessageAPIView(APIView):
                     'history': context['recent_messages'],
                     'session_id': session_id,
                     'user_id': context['conversation']['user_id'],
+                    'conversation_summary': context['conversation']['summary'],
                     'current_datetime': current_datetime_str
                 }
                 
                 response = await agent.safe_process(agent_input)
+                user_message = {'role': 'user', 'content': message, 'metadata': {'timestamp': 'auto'}}
                 
                 if response.success:
                     agent_message = response.data.get('response', 'No response generated')
                     
-                    # Add agent response to conversation
-                    await conversation_manager.add_message(
-                        session_id=session_id,
-                        role='assistant',
-                        content=agent_message,
-                        metadata=response.metadata or {}
+                    # Store user message and agent response together
+                    turn = [
+                        user_message,
+                        {'role': 'assistant', 'content': agent_message, 'metadata': response.metadata or {}},
+                    ]
+                    await conversation_manager.save_turn(context['conversation']['id'], turn)
+                    await conversation_manager.schedule_summary(
+                        context['conversation'], context['recent_messages'], turn,
+                        history_budget=getattr(agent, 'history_token_budget', None)
                     )
                     
                     return Response({
@@ -128,6 +125,7 @@ class ChatMessageAPIView(APIView):
                         'metadata': response.metadata
                     }, status=status.HTTP_200_OK)
                 else:
+                    await conversation_manager.save_turn(context['conversation']['id'], [user_message])
                     return Response({
                         'success': False, 
                         'error': response.error, 
@@ -148,20 +146,33 @@ class ChatMessageAPIView(APIView):
 
 
 class ConversationHistoryAPIView(APIView):
-    """API view for getting conversation history"""
+    """API view for paging through conversation history with before/after cursors"""
     permission_classes = [AllowAny]
     
     async def get(self, request, session_id):
         try:
-            limit = int(request.GET.get('limit', 50))
-            history = await conversation_manager.get_conversation_history(
+            page = await conversation_manager.get_conversation_history_page(
                 session_id=session_id,
-                limit=limit
+                limit=int(request.GET.get('limit', 50)),
+                before=request.GET.get('before'),
+                after=request.GET.get('after')
             )
+            if page is None:
+                return Response({
+                    'success': False,
+                    'error': 'Conversation not found'
+                }, status=status.HTTP_404_NOT_FOUND)
             return Response({
                 'success': True, 
-                'history': history
+                'history': page['messages'],
+                'has_more': page['has_more'],
+                'cursors': {'before': page['before'], 'after': page['after']}
             }, status=status.HTTP_200_OK)
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error getting conversation history: {str(e)}")
             return Response({
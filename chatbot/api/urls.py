@@ -14,6 +14,7 @@ urlpatterns = [
     
     # Chat endpoints
     path('chat/message/', views.ChatMessageView.as_view(), name='chat-message'),
+    path('chat/stream/', views.ChatStreamView.as_view(), name='chat-stream'),
     
     # Receipt processing endpoints
     path('receipts/<int:receipt_id>/status/', views.ReceiptProcessingStatusAPIView.as_view(), name='receipt-status'),
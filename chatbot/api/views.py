@@ -1,7 +1,8 @@
 import json
 import logging
+import time
 
-from django.http import JsonResponse, HttpRequest
+from django.http import JsonResponse, HttpRequest, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 from django.views import View
@@ -74,13 +75,7 @@ class ChatMessageView(View):
             message = data.get('message')
             if not session_id or not message:
                 return JsonResponse({'success': False, 'error': 'Session ID and message are required'}, status=400)
-            await conversation_manager.add_message(
-                session_id=session_id,
-                role='user',
-                content=message,
-                metadata={'timestamp': 'auto'}
-            )
-            context = await conversation_manager.get_conversation_context(session_id)
+            context = await conversation_manager.load_turn_context(session_id)
             if not context:
                 return JsonResponse({'success': False, 'error': 'Conversation not found'}, status=404)
             agent_name = context['conversation']['agent_name']
@@ -92,33 +87,128 @@ class ChatMessageView(View):
                 'history': context['recent_messages'],
                 'session_id': session_id,
                 'user_id': context['conversation']['user_id'],
+                'conversation_summary': context['conversation']['summary'],
                 'current_datetime': current_datetime_str
             }
             response = await agent.safe_process(agent_input)
+            # User and assistant messages of the turn are written together
+            user_message = {'role': 'user', 'content': message, 'metadata': {'timestamp': 'auto'}}
             if response.success:
                 agent_message = response.data.get('response', 'No response generated')
-                await conversation_manager.add_message(
-                    session_id=session_id,
-                    role='assistant',
-                    content=agent_message,
-                    metadata=response.metadata or {}
+                turn = [user_message, {'role': 'assistant', 'content': agent_message, 'metadata': response.metadata or {}}]
+                await conversation_manager.save_turn(context['conversation']['id'], turn)
+                await conversation_manager.schedule_summary(
+                    context['conversation'], context['recent_messages'], turn,
+                    history_budget=getattr(agent, 'history_token_budget', None)
                 )
                 return JsonResponse({'success': True, 'response': agent_message, 'agent': agent_name, 'metadata': response.metadata})
             else:
+                await conversation_manager.save_turn(context['conversation']['id'], [user_message])
                 return JsonResponse({'success': False, 'error': response.error, 'agent': agent_name})
         except Exception as e:
             logger.error(f"Error processing chat message: {str(e)}")
             return JsonResponse({'success': False, 'error': 'Internal server error'}, status=500)
 
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatStreamView(View):
+    """API view streaming the agent's answer token by token as server-sent events"""
+    async def post(self, request: HttpRequest):
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+        session_id = data.get('session_id')
+        message = data.get('message')
+        if not session_id or not message:
+            return JsonResponse({'success': False, 'error': 'Session ID and message are required'}, status=400)
+        try:
+            context = await conversation_manager.load_turn_context(session_id)
+            if not context:
+                return JsonResponse({'success': False, 'error': 'Conversation not found'}, status=404)
+            agent_name = context['conversation']['agent_name']
+            agent = await agent_factory.create_agent_from_db(agent_name)
+        except Exception as e:
+            logger.error(f"Error preparing chat stream: {str(e)}")
+            return JsonResponse({'success': False, 'error': 'Internal server error'}, status=500)
+
+        agent_input = {
+            'message': message,
+            'history': context['recent_messages'],
+            'session_id': session_id,
+            'user_id': context['conversation']['user_id'],
+            'conversation_summary': context['conversation']['summary'],
+            'current_datetime': timezone.now().strftime("%A, %Y-%m-%d %H:%M:%S")
+        }
+        response = StreamingHttpResponse(
+            self._event_stream(agent, agent_name, context['conversation'], agent_input),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # keep nginx from buffering the stream
+        return response
+
+    async def _event_stream(self, agent, agent_name, conversation, agent_input):
+        conversation_id = conversation['id']
+        session_id = agent_input['session_id']
+        user_message = {'role': 'user', 'content': agent_input['message'], 'metadata': {'timestamp': 'auto'}}
+        started = time.perf_counter()
+        time_to_first_token = None
+        parts = []
+        try:
+            async for token in agent.stream(agent_input):
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                parts.append(token)
+                yield _sse_event('token', {'content': token})
+        except Exception as e:
+            logger.error(f"Error streaming chat message: {str(e)}")
+            try:
+                await conversation_manager.save_turn(conversation_id, [user_message])
+            except Exception as save_error:
+                logger.error(f"Error saving chat message for {session_id}: {str(save_error)}")
+            yield _sse_event('error', {'error': 'Internal server error', 'agent': agent_name})
+            return
+
+        metadata = {
+            'streamed': True,
+            'time_to_first_token_ms': round(time_to_first_token * 1000) if time_to_first_token is not None else None,
+            'total_time_ms': round((time.perf_counter() - started) * 1000),
+        }
+        logger.info(f"Streamed response for {session_id}: TTFT {metadata['time_to_first_token_ms']} ms")
+        try:
+            turn = [user_message, {'role': 'assistant', 'content': ''.join(parts), 'metadata': metadata}]
+            await conversation_manager.save_turn(conversation_id, turn)
+            await conversation_manager.schedule_summary(
+                conversation, agent_input['history'], turn,
+                history_budget=getattr(agent, 'history_token_budget', None)
+            )
+        except Exception as e:
+            logger.error(f"Error saving streamed messages for {session_id}: {str(e)}")
+        yield _sse_event('done', {'agent': agent_name, 'metadata': metadata})
+
 class ConversationHistoryView(View):
-    """API view for getting conversation history"""
+    """API view for paging through conversation history with before/after cursors"""
     async def get(self, request: HttpRequest, session_id: str):
         try:
-            history = await conversation_manager.get_conversation_history(
+            page = await conversation_manager.get_conversation_history_page(
                 session_id=session_id,
-                limit=int(request.GET.get('limit', 50))
+                limit=int(request.GET.get('limit', 50)),
+                before=request.GET.get('before'),
+                after=request.GET.get('after')
             )
-            return JsonResponse({'success': True, 'history': history})
+            if page is None:
+                return JsonResponse({'success': False, 'error': 'Conversation not found'}, status=404)
+            return JsonResponse({
+                'success': True,
+                'history': page['messages'],
+                'has_more': page['has_more'],
+                'cursors': {'before': page['before'], 'after': page['after']}
+            })
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
         except Exception as e:
             logger.error(f"Error getting conversation history: {str(e)}")
             return JsonResponse({'success': False, 'error': 'Internal server error'}, status=500)
@@ -6,10 +6,16 @@ import logging
 import uuid
 from typing import Any, Dict, List, Optional
 
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 from .interfaces import ConversationManagerInterface
 from .models import Agent, Conversation, Message
 from .services.async_services import AsyncConversationService
+from .services.context_builder import HISTORY_TOKEN_BUDGET, needs_summary
+from .services.history_buffer import history_buffer
+from .services.message_writer import message_write_behind
 
 logger = logging.getLogger(__name__)
 
@@ -44,14 +50,28 @@ class ConversationManager(ConversationManagerInterface):
             format_for_ai=False
         )
     
+    async def get_conversation_history_page(
+        self,
+        session_id: str,
+        limit: int = 50,
+        before: Optional[str] = None,
+        after: Optional[str] = None
+    ) -> Optional[Dict]:
+        """Get one cursor-paginated page of conversation history"""
+        return await AsyncConversationService.get_conversation_messages_page(
+            session_id=session_id,
+            limit=limit,
+            before=before,
+            after=after
+        )
+    
     async def get_conversation_info(self, session_id: str) -> Optional[Dict]:
         """Get conversation information"""
         try:
             conversation = await Conversation.objects.select_related('agent').aget(session_id=session_id)
             
-            message_count = await Message.objects.filter(conversation=conversation).acount()
-            
             return {
+                'id': conversation.pk,
                 'session_id': str(conversation.session_id),
                 'agent_name': conversation.agent.name,
                 'agent_type': conversation.agent.agent_type,
@@ -59,7 +79,8 @@ class ConversationManager(ConversationManagerInterface):
                 'user_id': conversation.user_id,
                 'summary': conversation.summary,
                 'is_active': conversation.is_active,
-                'message_count': message_count,
+                'message_count': conversation.message_count,
+                'last_message_at': conversation.last_message_at.isoformat() if conversation.last_message_at else None,
                 'created_at': conversation.created_at.isoformat(),
                 'updated_at': conversation.updated_at.isoformat(),
                 'metadata': conversation.metadata
@@ -78,7 +99,7 @@ class ConversationManager(ConversationManagerInterface):
             conversation = await Conversation.objects.aget(session_id=session_id)
             conversation.summary = summary
             conversation.updated_at = timezone.now()
-            await conversation.asave()
+            await conversation.asave(update_fields=['summary', 'updated_at'])
             
             logger.info(f"Updated summary for conversation {session_id}")
             
@@ -95,7 +116,7 @@ class ConversationManager(ConversationManagerInterface):
             conversation = await Conversation.objects.aget(session_id=session_id)
             conversation.title = title
             conversation.updated_at = timezone.now()
-            await conversation.asave()
+            await conversation.asave(update_fields=['title', 'updated_at'])
             
             logger.info(f"Updated title for conversation {session_id}")
             
@@ -112,7 +133,7 @@ class ConversationManager(ConversationManagerInterface):
             conversation = await Conversation.objects.aget(session_id=session_id)
             conversation.is_active = False
             conversation.updated_at = timezone.now()
-            await conversation.asave()
+            await conversation.asave(update_fields=['is_active', 'updated_at'])
             
             logger.info(f"Deactivated conversation {session_id}")
             
@@ -124,27 +145,25 @@ class ConversationManager(ConversationManagerInterface):
             raise
     
     async def list_user_conversations(self, user_id: str, limit: int = 20) -> List[Dict]:
-        """List conversations for a user"""
+        """List conversations for a user (one query over the user_id/is_active/updated_at index)"""
         try:
-            conversations = []
-            async for conv in Conversation.objects.select_related('agent').filter(
-                user_id=user_id, 
-                is_active=True
-            ).order_by('-updated_at')[:limit]:
-                
-                message_count = await Message.objects.filter(conversation=conv).acount()
-                
-                conversations.append({
+            return [
+                {
                     'session_id': str(conv.session_id),
                     'agent_name': conv.agent.name,
                     'title': conv.title,
                     'summary': conv.summary,
-                    'message_count': message_count,
+                    'message_count': conv.message_count,
+                    'last_message_at': conv.last_message_at.isoformat() if conv.last_message_at else None,
+                    'last_message_preview': conv.last_message_preview,
                     'created_at': conv.created_at.isoformat(),
                     'updated_at': conv.updated_at.isoformat()
-                })
-            
-            return conversations
+                }
+                async for conv in Conversation.objects.select_related('agent').filter(
+                    user_id=user_id,
+                    is_active=True
+                ).order_by('-updated_at')[:limit]
+            ]
             
         except Exception as e:
             logger.error(f"Error listing user conversations: {str(e)}")
@@ -157,12 +176,8 @@ class ConversationManager(ConversationManagerInterface):
             if not conversation_info:
                 return {}
             
-            # Get recent messages formatted for AI
-            recent_messages = await AsyncConversationService.get_conversation_messages(
-                session_id=session_id,
-                limit=context_window,
-                format_for_ai=True
-            )
+            # Get recent messages formatted for AI (hot history buffer first)
+            recent_messages = await self.get_recent_messages(conversation_info['id'], context_window)
             
             return {
                 'conversation': conversation_info,
@@ -175,6 +190,108 @@ class ConversationManager(ConversationManagerInterface):
             logger.error(f"Error getting conversation context: {str(e)}")
             return {}
 
+    async def load_turn_context(self, session_id: str, context_window: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Everything a chat turn needs before calling the agent, in two queries:
+        the conversation with its agent (and its counts of stored and
+        unsummarized messages), then the last context_window messages formatted
+        for the LLM. The second query is skipped while the conversation's
+        history buffer is warm. By default the whole buffer is loaded; the
+        agent trims it to its token budget. Messages already folded into the
+        summary are left out, since the summary is sent instead of them.
+        """
+        if context_window is None:
+            context_window = history_buffer.size
+        try:
+            conversation = await Conversation.objects.select_related('agent').annotate(
+                unsummarized_count=Conversation.unsummarized_count()
+            ).aget(session_id=session_id)
+        except (Conversation.DoesNotExist, ValidationError):
+            logger.error(f"Conversation not found: {session_id}")
+            return {}
+
+        recent_messages = await self.get_recent_messages(conversation.pk, context_window)
+        unsummarized = conversation.unsummarized_count
+        if message_write_behind.enabled:
+            # Queued messages are not counted in the table yet, and are never summarized
+            unsummarized += len(message_write_behind.pending(conversation.pk))
+        if unsummarized < len(recent_messages):
+            recent_messages = recent_messages[len(recent_messages) - unsummarized:]
+
+        return {
+            'conversation': {
+                'id': conversation.pk,
+                'session_id': str(conversation.session_id),
+                'agent_name': conversation.agent.name,
+                'agent_type': conversation.agent.agent_type,
+                'title': conversation.title,
+                'user_id': conversation.user_id,
+                'summary': conversation.summary,
+                'is_active': conversation.is_active,
+                'message_count': conversation.message_count,
+                'unsummarized_count': unsummarized,
+                'last_message_at': conversation.last_message_at.isoformat() if conversation.last_message_at else None,
+                'created_at': conversation.created_at.isoformat(),
+                'updated_at': conversation.updated_at.isoformat(),
+                'metadata': conversation.metadata
+            },
+            'recent_messages': recent_messages,
+            'message_count': len(recent_messages),
+            'context_window': context_window
+        }
+
+    async def get_recent_messages(self, conversation_id: int, limit: int) -> List[Dict[str, str]]:
+        """Last `limit` messages as role/content dicts, from the history buffer or the database."""
+        buffered = await history_buffer.aget(conversation_id, limit)
+        if buffered is not None:
+            return buffered
+
+        # Read before the query, so a write racing with it keeps the seed from being served
+        generation = await history_buffer.ageneration(conversation_id)
+        # Load a full buffer's worth so the seeded buffer can answer later reads
+        recent_messages = [
+            message async for message in Message.objects.filter(
+                conversation_id=conversation_id
+            ).order_by('-created_at', '-id').values('role', 'content')[:max(limit, history_buffer.size)]
+        ]
+        recent_messages.reverse()
+        if message_write_behind.enabled:
+            recent_messages.extend(message_write_behind.pending(conversation_id))
+        await history_buffer.aset(conversation_id, recent_messages, generation)
+        return recent_messages[-limit:] if limit else []
+
+    async def save_turn(self, conversation_id: int, messages: List[Dict[str, Any]]) -> List[Message]:
+        """
+        Store the messages of one chat turn (typically user + assistant) with a
+        single bulk insert, or queue them when write-behind is enabled.
+        """
+        return await AsyncConversationService.save_messages(conversation_id, messages)
+
+    async def schedule_summary(self, conversation: Dict[str, Any], history: List[Dict[str, Any]],
+                               new_messages: List[Dict[str, Any]], history_budget: Optional[int] = None) -> bool:
+        """
+        Queue a background refresh of the rolling summary once the unsummarized
+        messages outgrow their share of the agent's history token budget.
+        `conversation` is the dict returned by load_turn_context, `history` the
+        messages sent to the agent and new_messages those saved since.
+        """
+        budget = history_budget or HISTORY_TOKEN_BUDGET
+        pending = conversation.get('unsummarized_count', conversation['message_count']) + len(new_messages)
+        if not needs_summary(list(history) + list(new_messages), pending, budget):
+            return False
+        try:
+            # One pending summary per conversation; the task clears the flag when done
+            if not await cache.aadd(f"conversation_summary_pending:{conversation['id']}", True, timeout=300):
+                return False
+            from .tasks import summarize_conversation_task
+            await sync_to_async(summarize_conversation_task.delay, thread_sensitive=False)(
+                conversation['id'], history_budget=budget
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Failed to schedule summary for conversation {conversation['id']}: {e}")
+            return False
+
 
 # Global conversation manager instance
 conversation_manager = ConversationManager()
\ No newline at end of file
@@ -0,0 +1,159 @@
+# chatbot/hybrid_retriever.py
+"""
+Lexical (BM25) side of RAG retrieval.
+
+Keeps a persistent inverted index over chunk texts in SQLite, next to the
+Chroma vector store, and fuses its ranking with the vector ranking using
+reciprocal rank fusion. Exact terms such as Polish product names, receipt
+vocabulary or document titles are found even when embeddings miss them, and
+the index alone still answers queries when Ollama is unavailable.
+"""
+import logging
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Polish is heavily inflected ("mleko", "mleka", "mlekiem"); a short prefix is a cheap stem
+STEM_LENGTH = 6
+RRF_K = 60
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens truncated to a prefix stem; single characters are dropped."""
+    return [token[:STEM_LENGTH] for token in TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = RRF_K) -> List[str]:
+    """Merge several rankings of ids into one, scoring each id by sum(1 / (k + rank))."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda item_id: scores[item_id], reverse=True)
+
+
+class BM25Index:
+    """Persistent BM25 inverted index over RAG chunks"""
+
+    def __init__(self, path, k1: float = 1.5, b: float = 0.75):
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                document_id INTEGER,
+                length INTEGER NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk_id)
+            );
+            CREATE INDEX IF NOT EXISTS postings_chunk_id ON postings (chunk_id);
+            """
+        )
+        self._conn.commit()
+
+    def add_chunks(self, ids: Sequence[str], texts: Sequence[str], document_id: int = None):
+        """Index (or re-index) chunks under the given ids."""
+        if not ids:
+            return
+        with self._lock:
+            self._delete(ids)
+            chunk_rows, posting_rows = [], []
+            for chunk_id, text in zip(ids, texts):
+                terms = Counter(tokenize(text))
+                chunk_rows.append((chunk_id, document_id, sum(terms.values()), text))
+                posting_rows.extend((term, chunk_id, tf) for term, tf in terms.items())
+            self._conn.executemany(
+                "INSERT INTO chunks (chunk_id, document_id, length, text) VALUES (?, ?, ?, ?)", chunk_rows
+            )
+            self._conn.executemany("INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", posting_rows)
+            self._conn.commit()
+
+    def delete_chunks(self, ids: Sequence[str]):
+        if not ids:
+            return
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def _delete(self, ids: Sequence[str]):
+        rows = [(chunk_id,) for chunk_id in ids]
+        self._conn.executemany("DELETE FROM postings WHERE chunk_id = ?", rows)
+        self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", rows)
+
+    def search(self, query: str, n_results: int = 10) -> List[Tuple[str, str, float]]:
+        """Return up to n_results (chunk_id, text, score) tuples, best first."""
+        terms = list(set(tokenize(query)))
+        if not terms:
+            return []
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            total_chunks, total_length = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks"
+            ).fetchone()
+            if not total_chunks:
+                return []
+            document_frequency = dict(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms
+            ).fetchall())
+            postings = self._conn.execute(
+                f"SELECT p.chunk_id, p.term, p.tf, c.length FROM postings p "
+                f"JOIN chunks c ON c.chunk_id = p.chunk_id WHERE p.term IN ({placeholders})", terms
+            ).fetchall()
+
+            average_length = total_length / total_chunks or 1.0
+            scores: Dict[str, float] = {}
+            for chunk_id, term, tf, length in postings:
+                df = document_frequency[term]
+                idf = math.log(1 + (total_chunks - df + 0.5) / (df + 0.5))
+                norm = tf + self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+            texts = dict(self._conn.execute(
+                f"SELECT chunk_id, text FROM chunks WHERE chunk_id IN ({','.join('?' * len(best))})",
+                [chunk_id for chunk_id, _ in best]
+            ).fetchall()) if best else {}
+        return [(chunk_id, texts[chunk_id], score) for chunk_id, score in best]
+
+    def rebuild_from_collection(self, collection, batch_size: int = 500) -> int:
+        """Re-create the index from every chunk stored in a Chroma collection."""
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+        indexed = 0
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            ids = page.get('ids', [])
+            if not ids:
+                break
+            by_document: Dict[int, Tuple[List[str], List[str]]] = {}
+            for chunk_id, text, metadata in zip(ids, page['documents'], page['metadatas']):
+                group = by_document.setdefault((metadata or {}).get('document_id'), ([], []))
+                group[0].append(chunk_id)
+                group[1].append(text)
+            for document_id, (group_ids, group_texts) in by_document.items():
+                self.add_chunks(group_ids, group_texts, document_id)
+            indexed += len(ids)
+            offset += batch_size
+        logger.info(f"Rebuilt lexical index with {indexed} chunks")
+        return indexed
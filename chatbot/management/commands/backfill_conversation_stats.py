@@ -0,0 +1,48 @@
+"""
+Management command to recompute the denormalized message counters on Conversation.
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, OuterRef, Subquery
+
+from chatbot.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = 'Recompute message_count, last_message_at and last_message_preview for every conversation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Conversations updated per bulk_update')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_message = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id')
+        conversations = Conversation.objects.annotate(
+            counted=Count('messages'),
+            last_at=Max('messages__created_at'),
+            last_content=Subquery(last_message.values('content')[:1]),
+        ).only('pk', 'message_count', 'last_message_at', 'last_message_preview')
+
+        batch = []
+        updated = 0
+        for conversation in conversations.iterator(chunk_size=batch_size):
+            preview = (conversation.last_content or '')[:Conversation.PREVIEW_LENGTH]
+            if (conversation.message_count, conversation.last_message_at, conversation.last_message_preview) == (
+                conversation.counted, conversation.last_at, preview
+            ):
+                continue
+            conversation.message_count = conversation.counted
+            conversation.last_message_at = conversation.last_at
+            conversation.last_message_preview = preview
+            batch.append(conversation)
+            if len(batch) >= batch_size:
+                updated += self._flush(batch)
+        updated += self._flush(batch)
+        self.stdout.write(self.style.SUCCESS(f'✅ Updated message stats for {updated} conversations'))
+
+    @staticmethod
+    def _flush(batch):
+        # updated_at is left alone so conversation ordering does not change
+        Conversation.objects.bulk_update(batch, ['message_count', 'last_message_at', 'last_message_preview'])
+        count = len(batch)
+        batch.clear()
+        return count
@@ -0,0 +1,98 @@
+"""
+Management command to benchmark per-receipt OCR latency across image sizes.
+"""
+import io
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageDraw, ImageFont
+
+from chatbot.services.ocr_pool import OCR_DEVICES, OCRConfig, OCRPool, resolve_device
+
+RECEIPT_LINES = [
+    "BIEDRONKA SKLEP NR 1234",
+    "PARAGON FISKALNY",
+    "MLEKO UHT 3,2% 1L      1 x 3,49   3,49 C",
+    "CHLEB ZYTNI 500G       1 x 5,99   5,99 C",
+    "JABLKA LUZ             0,85 x 4,99 4,24 C",
+    "MASLO EKSTRA 200G      2 x 7,99  15,98 C",
+    "JOGURT NATURALNY       3 x 1,89   5,67 C",
+    "SUMA PLN                         35,37",
+    "2025-08-14 18:42",
+]
+
+
+def synthetic_receipt(width: int = 600) -> Image.Image:
+    """A plain black-on-white receipt rendered at a base width of 600 px."""
+    try:
+        font = ImageFont.truetype('DejaVuSansMono.ttf', 18)
+    except OSError:
+        font = ImageFont.load_default()
+    image = Image.new('L', (width, 40 + 32 * len(RECEIPT_LINES)), 255)
+    draw = ImageDraw.Draw(image)
+    for index, line in enumerate(RECEIPT_LINES):
+        draw.text((20, 20 + 32 * index), line, fill=0, font=font)
+    return image
+
+
+def encode_at_size(image: Image.Image, longest_side: int) -> bytes:
+    scale = longest_side / max(image.size)
+    resized = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Measure OCR latency per receipt image on the configured device at several image sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', help='Receipt image to use instead of a synthetic one')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[800, 1200, 1600, 2400],
+                            help='Longest image side in pixels')
+        parser.add_argument('--runs', type=int, default=5, help='Timed runs per size (after one warm-up)')
+        parser.add_argument('--device', choices=OCR_DEVICES, default='cpu')
+        parser.add_argument('--threads', type=int, default=0, help='Torch threads (0 = all cores)')
+        parser.add_argument('--no-quantize', action='store_true', help='Use the full-precision models')
+        parser.add_argument('--preprocess', action='store_true',
+                            help='Downscale/crop each image with the receipt preprocessing pipeline before OCR')
+
+    def handle(self, *args, **options):
+        image = Image.open(options['image']).convert('RGB') if options['image'] else synthetic_receipt()
+        config = OCRConfig(device=options['device'], quantize=not options['no_quantize'],
+                           torch_threads=options['threads'])
+        # Inline pool: measures OCR itself, without process start-up or IPC
+        pool = OCRPool(workers=0, config=config)
+
+        started = time.perf_counter()
+        try:
+            pool.readtext(encode_at_size(image, options['sizes'][0]))
+        except Exception as e:
+            raise CommandError(f'OCR reader could not be loaded: {e}')
+        self.stdout.write(
+            f'Reader on {resolve_device(config.device)} with {pool.config.torch_threads} torch threads, '
+            f'quantize={config.quantize}; load + first run {time.perf_counter() - started:.1f} s'
+        )
+
+        for size in options['sizes']:
+            encoded = encode_at_size(image, size)
+            preprocessing = ''
+            if options['preprocess']:
+                from chatbot.image_preprocessing import preprocess_receipt
+
+                prepared = preprocess_receipt(encoded)
+                encoded = prepared.pixels
+                preprocessing = (f', preprocessing {prepared.timings["total"] * 1000:.0f} ms '
+                                 f'to {prepared.size[0]}x{prepared.size[1]}')
+            pool.readtext(encoded)  # warm-up at this size
+            timings = []
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                lines = pool.readtext(encoded)
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f'{size:>5} px: median {statistics.median(timings) * 1000:.0f} ms, '
+                f'min {min(timings) * 1000:.0f} ms, {len(lines)} lines{preprocessing}'
+            )
+        self.stdout.write(self.style.SUCCESS('✅ OCR benchmark finished'))
@@ -0,0 +1,72 @@
+"""
+Management command to benchmark RouterAgent's rule-based routing throughput.
+"""
+import re
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbot.services.routing_matcher import (
+    DEFAULT_GREETINGS, DEFAULT_ROUTING_PATTERNS, GREETING_TOOL, RoutingMatcher
+)
+
+SAMPLE_MESSAGES = [
+    "Jaka jest pogoda w Krakowie?",
+    "Czy jutro będzie padać?",
+    "Wyszukaj informacje o nowym iPhone",
+    "Co nowego w polityce?",
+    "Co mam w lodówce?",
+    "Czy mam jeszcze mleko?",
+    "Opowiedz o dokumencie ABC.pdf",
+    "Przeczytaj mój plik z notatkami",
+    "Cześć, jak się masz?",
+    "Dzień dobry!",
+    "Przypomnij mi ustalenia z ostatniego spotkania",
+    "Ile kalorii ma banan?",
+    "Napisz wiersz o jesieni w górach, najlepiej z rymami i refrenem",
+]
+
+
+def legacy_route(message, patterns=DEFAULT_ROUTING_PATTERNS, greetings=DEFAULT_GREETINGS):
+    """The previous implementation: re.search per pattern, then a greeting scan."""
+    message_lower = message.lower()
+    for tool, tool_patterns in patterns.items():
+        for pattern in tool_patterns:
+            if re.search(pattern, message_lower):
+                return tool
+    if any(greeting in message_lower for greeting in greetings):
+        return GREETING_TOOL
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Measure rule-based router throughput: per-pattern re.search loop vs the compiled matcher'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help='Passes over the sample messages')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        matcher = RoutingMatcher.from_config({})
+
+        mismatches = [m for m in SAMPLE_MESSAGES if legacy_route(m) != matcher.best(m)]
+        for message in mismatches:
+            self.stdout.write(self.style.WARNING(
+                f'⚠️ Different route for {message!r}: {legacy_route(message)} vs {matcher.best(message)}'
+            ))
+
+        total = iterations * len(SAMPLE_MESSAGES)
+        results = {}
+        for label, route in [('re.search loop', legacy_route), ('compiled matcher', matcher.best)]:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                for message in SAMPLE_MESSAGES:
+                    route(message)
+            elapsed = time.perf_counter() - started
+            results[label] = elapsed
+            self.stdout.write(
+                f'{label}: {total / elapsed:,.0f} messages/s ({elapsed / total * 1e6:.1f} µs per message)'
+            )
+
+        speedup = results['re.search loop'] / results['compiled matcher']
+        self.stdout.write(self.style.SUCCESS(f'✅ Compiled matcher is {speedup:.1f}x the legacy throughput'))
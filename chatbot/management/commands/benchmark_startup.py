@@ -0,0 +1,57 @@
+"""
+Management command to benchmark how long a fresh process takes to import chatbot.views.
+"""
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+IMPORT_SCRIPT = """
+import os, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+import django
+django.setup()
+started = time.perf_counter()
+import chatbot.views
+if {eager}:
+    from chatbot.rag_processor import rag_processor
+    from chatbot.receipt_processor import receipt_processor
+    rag_processor.get_instance()
+    receipt_processor.get_instance()
+print(time.perf_counter() - started)
+"""
+
+
+class Command(BaseCommand):
+    help = 'Measure import time of chatbot.views in fresh processes (lazy singletons vs eager construction)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh processes per mode')
+        parser.add_argument('--skip-eager', action='store_true',
+                            help='Only measure the lazy import (eager mode builds the processors and Chroma)')
+
+    def handle(self, *args, **options):
+        modes = [('lazy (import only)', False)]
+        if not options['skip_eager']:
+            modes.append(('eager (import + build receipt processor and Chroma client)', True))
+
+        for label, eager in modes:
+            timings = []
+            for _ in range(options['runs']):
+                script = IMPORT_SCRIPT.format(settings_module=settings.SETTINGS_MODULE, eager=eager)
+                result = subprocess.run(
+                    [sys.executable, '-c', script],
+                    cwd=settings.BASE_DIR, capture_output=True, text=True
+                )
+                if result.returncode != 0:
+                    self.stdout.write(self.style.ERROR(f'❌ {label}: {result.stderr.strip().splitlines()[-1]}'))
+                    break
+                timings.append(float(result.stdout.strip().splitlines()[-1]))
+            if timings:
+                self.stdout.write(
+                    f'{label}: median {statistics.median(timings) * 1000:.0f} ms, '
+                    f'min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms '
+                    f'over {len(timings)} runs'
+                )
@@ -0,0 +1,14 @@
+"""
+Management command to rebuild the BM25 lexical index from the Chroma collection.
+"""
+from django.core.management.base import BaseCommand
+from chatbot.rag_processor import rag_processor
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the BM25 lexical index used by hybrid RAG retrieval from stored chunks'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding lexical index from Chroma collection...')
+        indexed = rag_processor.lexical_index.rebuild_from_collection(rag_processor.collection)
+        self.stdout.write(self.style.SUCCESS(f'✅ Indexed {indexed} chunks'))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-16 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0012_document_chatbot_doc_status_cd3d3d_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, help_text='Czas ostatniej wiadomości', null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, help_text='Początek ostatniej wiadomości', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, help_text='Liczba wiadomości'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user_id', 'is_active', '-updated_at'], name='chatbot_con_user_id_930478_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Fills the counters added in 0013 for conversations that existed before them.
+# Without this, message_count stays 0 for old conversations, so they are never
+# summarized. The backfill_conversation_stats command does the same and can be
+# re-run at any time.
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Substr
+
+PREVIEW_LENGTH = 200
+
+
+def backfill_message_stats(apps, schema_editor):
+    Conversation = apps.get_model('chatbot', 'Conversation')
+    Message = apps.get_model('chatbot', 'Message')
+    messages = Message.objects.filter(conversation=models.OuterRef('pk')).order_by()
+    last_message = messages.order_by('-created_at', '-id')
+    Conversation.objects.update(
+        message_count=Coalesce(
+            models.Subquery(messages.values('conversation').annotate(count=models.Count('pk')).values('count')),
+            0
+        ),
+        last_message_at=models.Subquery(last_message.values('created_at')[:1]),
+        last_message_preview=Coalesce(
+            Substr(models.Subquery(last_message.values('content')[:1]), 1, PREVIEW_LENGTH),
+            models.Value('')
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0013_conversation_message_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_message_stats, migrations.RunPython.noop),
+    ]
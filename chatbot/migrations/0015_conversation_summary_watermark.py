@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-16 19:47
+# The summary position used to be a message count in metadata, which shifts when
+# messages are deleted; it becomes a (created_at, id) watermark here.
+
+from django.db import migrations, models
+
+
+def offsets_to_watermarks(apps, schema_editor):
+    """Replace metadata['summarized_message_count'] with the (created_at, id) of that message."""
+    Conversation = apps.get_model('chatbot', 'Conversation')
+    Message = apps.get_model('chatbot', 'Message')
+    for conversation in Conversation.objects.filter(metadata__has_key='summarized_message_count'):
+        summarized = conversation.metadata.pop('summarized_message_count') or 0
+        if summarized > 0:
+            last = list(Message.objects.filter(conversation=conversation).order_by(
+                'created_at', 'id'
+            ).values('created_at', 'id')[summarized - 1:summarized])
+            if last:
+                conversation.summarized_through_at = last[0]['created_at']
+                conversation.summarized_through_id = last[0]['id']
+        conversation.save(update_fields=['metadata', 'summarized_through_at', 'summarized_through_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0014_backfill_conversation_message_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='summarized_through_at',
+            field=models.DateTimeField(blank=True, help_text='Czas ostatniej podsumowanej wiadomości', null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summarized_through_id',
+            field=models.PositiveBigIntegerField(blank=True, help_text='ID ostatniej podsumowanej wiadomości', null=True),
+        ),
+        migrations.RunPython(offsets_to_watermarks, migrations.RunPython.noop),
+    ]
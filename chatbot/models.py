@@ -1,5 +1,7 @@
 
 from django.db import models
+from django.db.models.functions import Coalesce, Substr
+from django.dispatch import Signal
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.urls import reverse
@@ -394,21 +396,113 @@ class Conversation(models.Model):
     summary = models.TextField(blank=True, help_text="Podsumowanie konwersacji")
     metadata = models.JSONField(default=dict, help_text="Dodatkowe dane konwersacji")
     is_active = models.BooleanField(default=True)
+    # Maintained by the message write path (see record_messages); rebuilt by backfill_conversation_stats
+    message_count = models.PositiveIntegerField(default=0, help_text="Liczba wiadomości")
+    last_message_at = models.DateTimeField(null=True, blank=True, help_text="Czas ostatniej wiadomości")
+    last_message_preview = models.CharField(max_length=200, blank=True, help_text="Początek ostatniej wiadomości")
+    # (created_at, id) of the last message folded into summary; set by summarize_conversation_task.
+    # A watermark rather than a count, so deleting messages does not shift it.
+    summarized_through_at = models.DateTimeField(null=True, blank=True, help_text="Czas ostatniej podsumowanej wiadomości")
+    summarized_through_id = models.PositiveBigIntegerField(null=True, blank=True, help_text="ID ostatniej podsumowanej wiadomości")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    PREVIEW_LENGTH = 200
+
     class Meta:
         ordering = ['-updated_at']
         indexes = [
             models.Index(fields=['session_id']),
             models.Index(fields=['agent', 'is_active']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['user_id', 'is_active', '-updated_at']),
         ]
 
     def __str__(self):
         title = self.title or f"Konwersacja z {self.agent.name}"
         return f"{title} ({self.created_at.strftime('%Y-%m-%d %H:%M')})"
 
+    @classmethod
+    def message_stats_update(cls, added: int, last_message: 'Message') -> Dict:
+        """Update kwargs bumping the counters for `added` new messages ending with last_message."""
+        return {
+            'message_count': models.F('message_count') + added,
+            'last_message_at': last_message.created_at,
+            'last_message_preview': last_message.content[:cls.PREVIEW_LENGTH],
+            'updated_at': timezone.now(),
+        }
+
+    @classmethod
+    def record_messages(cls, conversation_id: int, messages: List['Message']):
+        """Atomically count stored messages against their conversation (single UPDATE)."""
+        if messages:
+            cls.objects.filter(pk=conversation_id).update(**cls.message_stats_update(len(messages), messages[-1]))
+
+    @classmethod
+    async def arecord_messages(cls, conversation_id: int, messages: List['Message']):
+        if messages:
+            await cls.objects.filter(pk=conversation_id).aupdate(**cls.message_stats_update(len(messages), messages[-1]))
+
+    @classmethod
+    def unsummarized_count(cls) -> models.Expression:
+        """Annotation counting the conversation's messages newer than its summary watermark."""
+        messages = Message.objects.filter(conversation=models.OuterRef('pk')).filter(
+            models.Q(created_at__gt=models.OuterRef('summarized_through_at'))
+            | models.Q(created_at=models.OuterRef('summarized_through_at'), pk__gt=models.OuterRef('summarized_through_id'))
+        ).order_by()
+        return models.Case(
+            models.When(summarized_through_at__isnull=True, then=models.F('message_count')),
+            default=Coalesce(
+                models.Subquery(messages.values('conversation').annotate(count=models.Count('pk')).values('count')),
+                0
+            ),
+        )
+
+    @classmethod
+    def refresh_message_stats(cls, conversation_ids):
+        """Recompute the counters and last-message fields from the Message table (one UPDATE)."""
+        messages = Message.objects.filter(conversation=models.OuterRef('pk')).order_by()
+        last_message = messages.order_by('-created_at', '-id')
+        cls.objects.filter(pk__in=conversation_ids).update(
+            message_count=Coalesce(
+                models.Subquery(messages.values('conversation').annotate(count=models.Count('pk')).values('count')),
+                0
+            ),
+            last_message_at=models.Subquery(last_message.values('created_at')[:1]),
+            last_message_preview=Coalesce(
+                Substr(models.Subquery(last_message.values('content')[:1]), 1, cls.PREVIEW_LENGTH),
+                models.Value('')
+            ),
+        )
+
+
+# Sent after Message.delete() or a Message queryset delete with the affected conversation ids.
+# Message has no pre/post_delete receivers, so Django can fast-delete messages when a whole
+# conversation or agent is removed; cascades therefore do not send this either.
+messages_deleted = Signal()
+
+
+def _after_messages_deleted(conversation_ids):
+    Conversation.refresh_message_stats(conversation_ids)
+    messages_deleted.send(sender=Message, conversation_ids=conversation_ids)
+
+
+class MessageQuerySet(models.QuerySet):
+    def after(self, created_at, message_id):
+        """Messages ordered after (created_at, message_id); all of them when created_at is None."""
+        if created_at is None:
+            return self
+        return self.filter(
+            models.Q(created_at__gt=created_at) | models.Q(created_at=created_at, pk__gt=message_id)
+        )
+
+    def delete(self):
+        conversation_ids = set(self.values_list('conversation_id', flat=True).order_by().distinct())
+        result = super().delete()
+        _after_messages_deleted(conversation_ids)
+        return result
+
+
 class Message(models.Model):
     ROLE_CHOICES = [
         ('user', 'Użytkownik'),
@@ -421,6 +515,8 @@ class Message(models.Model):
     content = models.TextField()
     metadata = models.JSONField(default=dict, help_text="Metadata wiadomości (tokeny, model, itp.)")
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MessageQuerySet.as_manager()
     
     class Meta:
         ordering = ['created_at']
@@ -433,3 +529,8 @@ class Message(models.Model):
         self,
     ):
         return f"[{self.created_at.strftime('%Y-%m-%d %H:%M')}] {self.get_role_display()}: {self.content[:50]}..."
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        _after_messages_deleted({self.conversation_id})
+        return result
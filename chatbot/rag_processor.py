@@ -1,14 +1,18 @@
 # chatbot/rag_processor.py
+import hashlib
 import logging
-import ollama
-import chromadb
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from .hybrid_retriever import BM25Index, reciprocal_rank_fusion
 from .models import Document
+from .services.ollama_client import DEFAULT_OLLAMA_URL, aembed
+from .utils.embedding_cache import EmbeddingCache
+from .utils.lazy import LazyInstance
 
 logger = logging.getLogger(__name__)
 
@@ -16,13 +20,30 @@ logger = logging.getLogger(__name__)
 CHROMA_PATH = settings.BASE_DIR / "chroma_db"
 EMBEDDING_MODEL = 'mxbai-embed-large' # Recommended model for embeddings
 COLLECTION_NAME = "rag_documents"
+# Batched ingestion: chunks per embedding request and number of requests in flight
+EMBEDDING_BATCH_SIZE = getattr(settings, 'RAG_EMBEDDING_BATCH_SIZE', 32)
+EMBEDDING_CONCURRENCY = getattr(settings, 'RAG_EMBEDDING_CONCURRENCY', 2)
+# Content-addressed embedding cache shared by ingestion and retrieval
+EMBEDDING_CACHE_PATH = getattr(settings, 'RAG_EMBEDDING_CACHE_PATH', settings.BASE_DIR / "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = getattr(settings, 'RAG_EMBEDDING_CACHE_MAX_ENTRIES', 100_000)
+# Hybrid retrieval: persistent BM25 index fused with vector results
+LEXICAL_INDEX_PATH = getattr(settings, 'RAG_LEXICAL_INDEX_PATH', settings.BASE_DIR / "lexical_index.sqlite3")
+HYBRID_SEARCH = getattr(settings, 'RAG_HYBRID_SEARCH', True)
+HYBRID_CANDIDATES = getattr(settings, 'RAG_HYBRID_CANDIDATES', 10)  # per retriever, before fusion
 
 class RagProcessor:
     def __init__(self):
+        # Heavy imports, deferred until the processor is first used
+        import chromadb
+        import ollama
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
         self.client = chromadb.PersistentClient(path=str(CHROMA_PATH))
-        self.ollama_client = ollama.Client()
+        self.ollama_client = ollama.Client(host=DEFAULT_OLLAMA_URL)
         self.collection = self.client.get_or_create_collection(name=COLLECTION_NAME)
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        self.embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+        self.lexical_index = BM25Index(LEXICAL_INDEX_PATH)
 
     def process_document(self, document_id: int):
         """Loads, splits, embeds, and stores a document in the vector DB."""
@@ -36,6 +57,7 @@ class RagProcessor:
                 raise FileNotFoundError(f"Document file not found at {file_path}")
 
             # 1. Load Document
+            from langchain_community.document_loaders import PyPDFLoader, TextLoader
             if file_path.suffix.lower() == '.pdf':
                 loader = PyPDFLoader(str(file_path))
             elif file_path.suffix.lower() == '.txt':
@@ -49,23 +71,23 @@ class RagProcessor:
             chunks = self.text_splitter.split_documents(docs_from_file)
             logger.info(f"Split {file_path.name} into {len(chunks)} chunks.")
 
-            # 3. Embed and Store
-            for i, chunk in enumerate(chunks):
-                embedding = self.ollama_client.embeddings(
-                    model=EMBEDDING_MODEL,
-                    prompt=chunk.page_content
-                )['embedding']
-                
-                self.collection.add(
-                    ids=[f"{document_id}_{i}"],
-                    embeddings=[embedding],
-                    documents=[chunk.page_content],
-                    metadatas=[{"source": file_path.name, "document_id": document_id}]
-                )
+            # 3. Embed and Store only what changed since the last run
+            stats = self.reindex_document(
+                document_id,
+                texts=[chunk.page_content for chunk in chunks],
+                source=file_path.name,
+            )
 
             doc.status = 'ready'
             doc.save()
-            logger.info(f"Successfully processed and stored document: {doc.title}")
+            logger.info(
+                f"Successfully processed and stored document: {doc.title} "
+                f"({stats['added']} added, {stats['moved']} moved, {stats['removed']} removed, "
+                f"{stats['unchanged']} unchanged; {stats['chunks']} chunks embedded in {stats['seconds']:.2f}s, "
+                f"{stats['chunks_per_second']:.1f} chunks/s, "
+                f"embedding cache: {self.embedding_cache.stats()})"
+            )
+            return stats
 
         except Exception as e:
             logger.error(f"Error processing document {document_id}: {e}", exc_info=True)
@@ -73,23 +95,186 @@ class RagProcessor:
                 doc.status = 'error'
                 doc.save()
 
+    @staticmethod
+    def _chunk_ids(document_id: int, texts: list[str]) -> list[tuple[str, str]]:
+        """
+        Content-addressed chunk ids: '{document_id}_{sha256[:16]}', with an
+        occurrence suffix for repeated chunks. Returns (id, full hash) pairs.
+        """
+        seen: dict[str, int] = {}
+        result = []
+        for text in texts:
+            chunk_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            occurrence = seen.get(chunk_hash, 0)
+            seen[chunk_hash] = occurrence + 1
+            chunk_id = f"{document_id}_{chunk_hash[:16]}"
+            if occurrence:
+                chunk_id += f"_{occurrence}"
+            result.append((chunk_id, chunk_hash))
+        return result
+
+    def reindex_document(self, document_id: int, texts: list[str], source: str) -> dict:
+        """
+        Brings the stored chunks of a document in line with `texts`.
+
+        Only chunks whose content is new are embedded and upserted; chunks that
+        merely moved get a metadata update, and ids no longer produced by the
+        document (stale or edited chunks) are deleted.
+        """
+        existing = self.collection.get(where={"document_id": document_id}, include=["metadatas"])
+        existing_metadata = dict(zip(existing.get('ids', []), existing.get('metadatas') or []))
+
+        new_ids, new_texts, new_metadatas = [], [], []
+        moved_ids, moved_metadatas = [], []
+        wanted = set()
+        for index, ((chunk_id, chunk_hash), text) in enumerate(zip(self._chunk_ids(document_id, texts), texts)):
+            wanted.add(chunk_id)
+            metadata = {"source": source, "document_id": document_id, "chunk_index": index, "chunk_hash": chunk_hash}
+            if chunk_id not in existing_metadata:
+                new_ids.append(chunk_id)
+                new_texts.append(text)
+                new_metadatas.append(metadata)
+            elif existing_metadata[chunk_id] != metadata:
+                moved_ids.append(chunk_id)
+                moved_metadatas.append(metadata)
+
+        orphaned_ids = [chunk_id for chunk_id in existing_metadata if chunk_id not in wanted]
+        if orphaned_ids:
+            self.collection.delete(ids=orphaned_ids)
+            self.lexical_index.delete_chunks(orphaned_ids)
+        if moved_ids:
+            self.collection.update(ids=moved_ids, metadatas=moved_metadatas)
+        stats = self._embed_and_store(new_ids, new_texts, new_metadatas)
+        self.lexical_index.add_chunks(new_ids, new_texts, document_id)
+
+        stats.update({
+            'added': len(new_ids),
+            'moved': len(moved_ids),
+            'removed': len(orphaned_ids),
+            'unchanged': len(wanted) - len(new_ids) - len(moved_ids),
+        })
+        return stats
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds a list of texts, serving unchanged texts from the embedding cache
+        and sending only the misses to Ollama in a single request.
+        """
+        embeddings = self.embedding_cache.get_many(EMBEDDING_MODEL, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            fresh = self.ollama_client.embed(model=EMBEDDING_MODEL, input=missing_texts)['embeddings']
+            self.embedding_cache.set_many(EMBEDDING_MODEL, missing_texts, fresh)
+            for i, embedding in zip(missing, fresh):
+                embeddings[i] = embedding
+        return embeddings
+
+    def _embed_and_store(self, ids: list[str], texts: list[str], metadatas: list[dict],
+                         batch_size: int = None, concurrency: int = None) -> dict:
+        """
+        Embeds texts in batches (several requests in flight) and writes each
+        batch to Chroma with a single upsert. Returns throughput statistics.
+        """
+        batch_size = max(1, batch_size or EMBEDDING_BATCH_SIZE)
+        concurrency = max(1, concurrency or EMBEDDING_CONCURRENCY)
+        batches = [
+            (ids[start:start + batch_size], texts[start:start + batch_size], metadatas[start:start + batch_size])
+            for start in range(0, len(texts), batch_size)
+        ]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # map() keeps batch order, so writes happen as soon as the next batch is embedded
+            embedded = executor.map(lambda batch: self._embed_batch(batch[1]), batches)
+            for (batch_ids, batch_texts, batch_metadatas), embeddings in zip(batches, embedded):
+                self.collection.upsert(
+                    ids=batch_ids,
+                    embeddings=embeddings,
+                    documents=batch_texts,
+                    metadatas=batch_metadatas
+                )
+        elapsed = time.perf_counter() - started
+
+        return {
+            'chunks': len(texts),
+            'batches': len(batches),
+            'seconds': elapsed,
+            'chunks_per_second': len(texts) / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def _query_collection(self, embedding: list[float], n_results: int) -> list[tuple[str, str]]:
+        """Vector search; returns (chunk_id, text) pairs, best first."""
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=n_results
+        )
+        return list(zip(results.get('ids', [[]])[0], results.get('documents', [[]])[0]))
+
+    def _fuse(self, query: str, vector_hits: list[tuple[str, str]], n_results: int) -> list[str]:
+        """Combines vector hits with BM25 hits by reciprocal rank fusion."""
+        if not HYBRID_SEARCH:
+            return [text for _, text in vector_hits[:n_results]]
+        lexical_hits = [(chunk_id, text) for chunk_id, text, _ in self.lexical_index.search(query, HYBRID_CANDIDATES)]
+        texts = dict(lexical_hits)
+        texts.update(vector_hits)
+        fused = reciprocal_rank_fusion([
+            [chunk_id for chunk_id, _ in vector_hits],
+            [chunk_id for chunk_id, _ in lexical_hits],
+        ])
+        return [texts[chunk_id] for chunk_id in fused[:n_results]]
+
     def retrieve_context(self, query: str, n_results: int = 3) -> list[str]:
-        """Retrieves relevant context for a given query from the vector DB."""
+        """
+        Retrieves relevant context for a given query: vector search fused with
+        the BM25 index, or the BM25 index alone when embedding fails.
+        """
         try:
-            embedding = self.ollama_client.embeddings(
-                model=EMBEDDING_MODEL,
-                prompt=query
-            )['embedding']
-
-            results = self.collection.query(
-                query_embeddings=[embedding],
-                n_results=n_results
-            )
-            
-            return results.get('documents', [[]])[0]
+            candidates = max(n_results, HYBRID_CANDIDATES) if HYBRID_SEARCH else n_results
+            try:
+                # Same endpoint as ingestion so query and chunk vectors are comparable
+                embedding = self._embed_batch([query])[0]
+                vector_hits = self._query_collection(embedding, candidates)
+            except Exception as e:
+                if not HYBRID_SEARCH:
+                    raise
+                logger.warning(f"Vector search unavailable, using lexical index only: {e}")
+                vector_hits = []
+            return self._fuse(query, vector_hits, n_results)
+        except Exception as e:
+            logger.error(f"Error retrieving context for query '{query}': {e}")
+            return []
+
+    async def _aembed_query(self, query: str) -> list[float]:
+        """Embeds a query without blocking the event loop (cache first, then the pooled Ollama client)."""
+        cached = await sync_to_async(self.embedding_cache.get, thread_sensitive=False)(EMBEDDING_MODEL, query)
+        if cached is not None:
+            return cached
+        embedding = (await aembed([query], model=EMBEDDING_MODEL))[0]
+        await sync_to_async(self.embedding_cache.set, thread_sensitive=False)(EMBEDDING_MODEL, query, embedding)
+        return embedding
+
+    async def aretrieve_context(self, query: str, n_results: int = 3) -> list[str]:
+        """
+        Async counterpart of retrieve_context for use from coroutines: the
+        embedding request goes through the shared async Ollama pool and the
+        Chroma and BM25 lookups run in worker threads, so concurrent sessions
+        can overlap their RAG lookups.
+        """
+        try:
+            candidates = max(n_results, HYBRID_CANDIDATES) if HYBRID_SEARCH else n_results
+            try:
+                embedding = await self._aembed_query(query)
+                vector_hits = await sync_to_async(self._query_collection, thread_sensitive=False)(embedding, candidates)
+            except Exception as e:
+                if not HYBRID_SEARCH:
+                    raise
+                logger.warning(f"Vector search unavailable, using lexical index only: {e}")
+                vector_hits = []
+            return await sync_to_async(self._fuse, thread_sensitive=False)(query, vector_hits, n_results)
         except Exception as e:
             logger.error(f"Error retrieving context for query '{query}': {e}")
             return []
 
-# Global instance
-rag_processor = RagProcessor()
+# Global instance, built on first use so importing this module stays cheap
+rag_processor = LazyInstance(RagProcessor)
@@ -1,53 +1,121 @@
-import easyocr
 import logging
 import json
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import dataclass
 import fitz  # PyMuPDF
 from PIL import Image
-import tempfile
 from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
 from asgiref.sync import sync_to_async
 from .models import PantryItem, ReceiptProcessing
 from .services.agents import OllamaAgent # Assuming OllamaAgent can be used for extraction
+from .services.ocr_pool import OCR_TIMEOUT, ocr_pool
 from .validators import get_file_type
+from .utils.lazy import LazyInstance
 
 logger = logging.getLogger(__name__)
 
+# Downscale, grayscale and crop receipt photos before OCR (see image_preprocessing)
+OCR_PREPROCESS = getattr(settings, 'OCR_PREPROCESS', True)
+
+def pixmap_to_array(pix):
+    """
+    View a PyMuPDF pixmap as an HxWxN uint8 array without copying its samples.
+    The array borrows the pixmap's buffer, so the pixmap must outlive it.
+    """
+    import numpy as np  # deferred like the OCR stack; only scanned PDFs need it
+
+    samples = pix.samples_mv if hasattr(pix, 'samples_mv') else pix.samples
+    rows = np.frombuffer(samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return rows[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+
+@dataclass
+class PageText:
+    """Text of one PDF page, how it was obtained and how long that took"""
+    page: int
+    text: str
+    method: str  # 'text' (text layer) or 'ocr'
+    seconds: float
+
 class ReceiptProcessor:
     def __init__(self):
-        # Initialize EasyOCR reader. This can be slow, so do it once.
-        # Specify languages, e.g., ['en', 'pl'] for English and Polish
-        self.reader = easyocr.Reader(['pl', 'en'], gpu=True) # GPU enabled for faster processing
+        # OCR runs in a shared process pool that loads the EasyOCR model once per pool process
+        self.ocr_pool = ocr_pool
+
+    def _extract_pdf_pages(self, pdf_path):
+        """
+        Extract every page of a PDF, in page order. Pages with a text layer are
+        read directly; the others are rasterized and submitted to the OCR pool
+        all at once, so scanned pages are recognised in parallel. Each page is
+        timed from its start until its OCR result is seen here. When the pool
+        runs inline (OCR_POOL_WORKERS = 0 or a daemonic process), submit() does
+        the OCR itself, so the pages are recognised one after another.
+        """
+        doc = fitz.open(pdf_path)
+        pages = []
+        # future -> (page result, start time, pixmap); arrays borrow their pixmap's buffer,
+        # so each pixmap is kept until its OCR is done
+        in_flight = {}
+
+        def collect(future, started):
+            result, _, _ = in_flight.pop(future)
+            result.seconds = time.perf_counter() - started
+            try:
+                result.text = " ".join(line.text for line in self.ocr_pool.result(future))
+            except Exception as e:
+                logger.error(f"Error during OCR of PDF page {result.page}: {e}")
 
-    def _extract_text_from_pdf(self, pdf_path):
-        """Extract text from PDF file using PyMuPDF."""
         try:
-            doc = fitz.open(pdf_path)
-            text = ""
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                # First try to extract text directly
+            for page_num, page in enumerate(doc):
+                started = time.perf_counter()
                 page_text = page.get_text()
-                
                 if page_text.strip():
-                    text += page_text + "\n"
-                else:
-                    # If no text, convert page to image and use OCR
-                    logger.info(f"PDF page {page_num} has no text, using OCR")
-                    pix = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0))  # 2x scale for better OCR
-                    
-                    # Save to temporary file for OCR
-                    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-                        pix.save(temp_file.name)
-                        ocr_text = self._extract_text_from_image(temp_file.name)
-                        if ocr_text:
-                            text += ocr_text + "\n"
-                        os.unlink(temp_file.name)  # Clean up temp file
-            
+                    pages.append(PageText(page_num, page_text, 'text', time.perf_counter() - started))
+                    continue
+
+                logger.info(f"PDF page {page_num} has no text, using OCR")
+                pix = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0), alpha=False)  # 2x scale for better OCR
+                result = PageText(page_num, '', 'ocr', 0.0)
+                pages.append(result)
+                # Hand the raw pixels to OCR in memory; no PNG encode or temp file
+                future = self.ocr_pool.submit(pixmap_to_array(pix))
+                in_flight[future] = (result, started, pix)
+                if future.done():
+                    # Inline OCR finished inside submit()
+                    collect(future, started)
+
+            while in_flight:
+                # Wait for whichever page finishes next, so each one is timed when it actually completes
+                done, _ = wait(list(in_flight), timeout=OCR_TIMEOUT, return_when=FIRST_COMPLETED)
+                if not done:
+                    for future, (result, _, _) in in_flight.items():
+                        future.cancel()
+                        logger.error(f"OCR of PDF page {result.page} timed out after {OCR_TIMEOUT} s")
+                    break
+                for future in done:
+                    collect(future, in_flight[future][1])
+        finally:
             doc.close()
+        return pages
+
+    def _extract_text_from_pdf(self, pdf_path):
+        """Extract text from PDF file using PyMuPDF, logging throughput per page."""
+        try:
+            started = time.perf_counter()
+            pages = self._extract_pdf_pages(pdf_path)
+            elapsed = time.perf_counter() - started
+
+            for page in pages:
+                logger.info(f"PDF page {page.page}: {page.method} in {page.seconds * 1000:.0f} ms")
+            ocr_pages = sum(1 for page in pages if page.method == 'ocr')
+            logger.info(
+                f"Extracted {len(pages)} PDF pages ({ocr_pages} with OCR) in {elapsed:.2f} s, "
+                f"{len(pages) / max(elapsed, 1e-9):.1f} pages/s"
+            )
+            text = "".join(page.text + "\n" for page in pages if page.text)
             logger.info(f"PDF text extracted: {text}")
             return text.strip()
             
@@ -55,11 +123,35 @@ class ReceiptProcessor:
             logger.error(f"Error during PDF text extraction from {pdf_path}: {e}")
             return None
 
+    def _extract_lines_from_image(self, image_path):
+        """OCR an image file in the OCR pool; returns lines with bounding boxes."""
+        if OCR_PREPROCESS:
+            try:
+                prepared = self._preprocess_image(image_path)
+                return self.ocr_pool.readtext(prepared.pixels)
+            except OSError as e:
+                # Formats Pillow cannot decode still go to OCR unchanged
+                logger.warning(f"Preprocessing {image_path} failed, using the original image: {e}")
+        with open(image_path, 'rb') as image_file:
+            return self.ocr_pool.readtext(image_file.read())
+
+    def _preprocess_image(self, image_path):
+        from .image_preprocessing import preprocess_receipt  # NumPy pipeline, loaded with the first photo
+
+        prepared = preprocess_receipt(image_path)
+        width, height = prepared.original_size
+        steps = ", ".join(f"{step} {seconds * 1000:.0f} ms" for step, seconds in prepared.timings.items())
+        logger.info(
+            f"Preprocessed {image_path}: {width}x{height} -> {prepared.size[0]}x{prepared.size[1]} "
+            f"({width * height / max(prepared.pixels.size, 1):.1f}x fewer pixels; {steps})"
+        )
+        return prepared
+
     def _extract_text_from_image(self, image_path):
         try:
-            result = self.reader.readtext(image_path)
+            lines = self._extract_lines_from_image(image_path)
             # Concatenate all detected text into a single string
-            extracted_text = " ".join([text for (bbox, text, prob) in result])
+            extracted_text = " ".join(line.text for line in lines)
             logger.info(f"OCR extracted text: {extracted_text}")
             return extracted_text
         except Exception as e:
@@ -225,5 +317,5 @@ class ReceiptProcessor:
             logger.error(f"Error updating pantry: {e}")
             return False
 
-# Instantiate the processor once to load OCR models
-receipt_processor = ReceiptProcessor()
\ No newline at end of file
+# Single processor instance; OCR models are loaded on first use, not on import
+receipt_processor = LazyInstance(ReceiptProcessor)
\ No newline at end of file
@@ -2,8 +2,12 @@
 Agent factory for creating and managing agent instances.
 Inspired by FoodSave AI's AgentFactory pattern.
 """
+import hashlib
 import logging
-from typing import Any, Dict, List, Optional, Type
+import uuid
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from django.core.cache import cache
 
 from ..interfaces import AgentFactoryInterface, BaseAgentInterface
 from .agents import OllamaAgent, RouterAgent
@@ -12,6 +16,11 @@ from ..models import Agent
 logger = logging.getLogger(__name__)
 
 
+def _version_key(agent_name: str) -> str:
+    # Agent names contain spaces and non-ASCII characters, which some cache backends reject
+    return f"agent_config_version:{hashlib.sha1(agent_name.encode('utf-8')).hexdigest()}"
+
+
 class AgentFactory(AgentFactoryInterface):
     """
     Factory for creating agent instances with database integration.
@@ -25,6 +34,8 @@ class AgentFactory(AgentFactoryInterface):
     
     def __init__(self):
         self._instances: Dict[str, BaseAgentInterface] = {}
+        # Agents built from the database: name -> (config version, Agent pk, instance)
+        self._db_agents: Dict[str, Tuple[Optional[str], int, BaseAgentInterface]] = {}
     
     def register_agent(self, agent_type: str, agent_class: Type[BaseAgentInterface]):
         """Register new agent type"""
@@ -48,6 +59,25 @@ class AgentFactory(AgentFactoryInterface):
             raise
     
     async def create_agent_from_db(self, agent_name: str) -> BaseAgentInterface:
+        """
+        Return the agent configured in the database under agent_name.
+
+        Instances are cached per process and reused across chat turns. The
+        config version lives in the shared cache and is bumped whenever the
+        Agent row is saved or deleted (see chatbot.signals), so every worker
+        rebuilds its instance after a change without querying the database on
+        each message.
+        """
+        version = await self._aget_config_version(agent_name)
+        cached = self._db_agents.get(agent_name)
+        if cached is not None and (version is None or cached[0] == version):
+            return cached[2]
+
+        agent_instance, agent_pk = await self._build_agent_from_db(agent_name)
+        self._db_agents[agent_name] = (version, agent_pk, agent_instance)
+        return agent_instance
+
+    async def _build_agent_from_db(self, agent_name: str) -> Tuple[BaseAgentInterface, int]:
         """Create agent instance from database configuration"""
         try:
             from .async_services import AsyncAgentService
@@ -74,11 +104,39 @@ class AgentFactory(AgentFactoryInterface):
             agent_instance.persona_prompt = agent_config.persona_prompt
             agent_instance.system_prompt = agent_config.system_prompt
             
-            return agent_instance
+            return agent_instance, agent_config.pk
             
         except Exception as e:
             logger.error(f"Error creating agent from database: {str(e)}")
             raise
+
+    async def _aget_config_version(self, agent_name: str) -> Optional[str]:
+        """Shared config version for agent_name; None if the cache is unreachable."""
+        key = _version_key(agent_name)
+        try:
+            version = await cache.aget(key)
+            if version is None:
+                # A missing key may mean it was evicted after a change, so start a new version
+                await cache.aadd(key, uuid.uuid4().hex, timeout=None)
+                version = await cache.aget(key)
+            return version
+        except Exception as e:
+            logger.warning(f"Agent config version lookup failed for {agent_name}: {e}")
+            return None
+
+    def invalidate_agent(self, agent_name: str, agent_pk: Optional[int] = None):
+        """Drop cached instances of an agent and bump its shared config version."""
+        names = {agent_name}
+        if agent_pk is not None:
+            # Also catch the old name of a renamed agent
+            names.update(name for name, (_, pk, _) in self._db_agents.items() if pk == agent_pk)
+        for name in names:
+            self._db_agents.pop(name, None)
+            try:
+                cache.set(_version_key(name), uuid.uuid4().hex, timeout=None)
+            except Exception as e:
+                logger.warning(f"Could not bump config version for agent {name}: {e}")
+        logger.info(f"Invalidated cached agent instances: {', '.join(sorted(names))}")
     
     def list_available_agents(self) -> List[str]:
         """List all available agent types"""
@@ -105,6 +163,7 @@ class AgentFactory(AgentFactoryInterface):
     def clear_instances(self):
         """Clear all cached instances"""
         self._instances.clear()
+        self._db_agents.clear()
         logger.info("Cleared all agent instances")
 
 
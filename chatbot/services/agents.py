@@ -1,19 +1,28 @@
 """
 Agent implementations for Django Agent system.
 """
+import json
 import logging
-import httpx
 import re
-from typing import Any, Dict, Optional, List
+import httpx
+from typing import Any, AsyncIterator, Dict, Optional, List, Tuple
+from django.conf import settings
 from abc import ABC, abstractmethod
 from ..interfaces import BaseAgentInterface, AgentResponse, ErrorSeverity
 from ..rag_processor import rag_processor
 from ..web_search import ddg_search
 from ..weather_service import get_weather
 from .async_services import AsyncPantryService
+from .context_builder import HISTORY_TOKEN_BUDGET, estimate_tokens, summary_message, trim_history
+from .ollama_client import DEFAULT_OLLAMA_URL, get_ollama_client
+from .ollama_health import CircuitState, get_ollama_health
+from .routing_cache import routing_cache
+from .routing_matcher import RoutingMatcher
 
 logger = logging.getLogger(__name__)
 
+ROUTER_INTENT_CLASSIFIER = getattr(settings, 'ROUTER_INTENT_CLASSIFIER', True)
+
 
 class BaseAgent(BaseAgentInterface, ABC):
     """
@@ -42,6 +51,13 @@ class BaseAgent(BaseAgentInterface, ABC):
             logger.error(f"Error in {self.name}.process: {str(e)}", exc_info=True)
             return AgentResponse(success=False, error=str(e), severity=ErrorSeverity.HIGH.value)
 
+    async def stream(self, input_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Yield the response text in chunks. Agents without a streaming backend yield it whole."""
+        response = await self.process(input_data)
+        if not response.success:
+            raise RuntimeError(response.error or "Agent failed to respond")
+        yield response.data.get('response', '')
+
 
 class OllamaAgent(BaseAgent):
     """
@@ -51,21 +67,41 @@ class OllamaAgent(BaseAgent):
         kwargs.setdefault('name', 'OllamaAgent')
         super().__init__(**kwargs)
         self.capabilities = ["llm_chat", "dynamic_response_generation"]
-        self.ollama_url = self.config.get('ollama_url', 'http://localhost:11434')
+        self.ollama_url = self.config.get('ollama_url', DEFAULT_OLLAMA_URL)
         self.model = self.config.get('model', 'llama3')
+        self.history_token_budget = self.config.get('history_token_budget', HISTORY_TOKEN_BUDGET)
+        # Shared per endpoint, so every agent learns from every request's outcome
+        self.health = get_ollama_health(self.ollama_url)
         self.fallback_models = [
             'ollama',
             'simple_rules'
         ]
     
+    def is_healthy(self) -> bool:
+        return self.health.state != CircuitState.OPEN
+
     async def health_check_ollama(self) -> bool:
-        """Check if Ollama server is available."""
+        """Check if Ollama server is available (result cached for OLLAMA_HEALTH_TTL seconds)."""
+        cached = self.health.cached_health()
+        if cached is not None:
+            return cached
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{self.ollama_url}/api/tags")
-                return response.status_code == 200
+            response = await get_ollama_client(self.ollama_url).get("/api/tags", timeout=5.0)
+            healthy = response.status_code == 200
         except Exception:
-            return False
+            healthy = False
+        if healthy:
+            self.health.record_success()
+        else:
+            self.health.record_failure()
+        return healthy
+
+    def _record_ollama_error(self, error: Exception):
+        """Feed a failed request into the circuit breaker; client errors mean the server is up."""
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code < 500:
+            self.health.record_success()
+        else:
+            self.health.record_failure()
     
     async def process(self, input_data: Dict[str, Any]) -> AgentResponse:
         user_message = input_data.get('message', '')
@@ -75,11 +111,11 @@ class OllamaAgent(BaseAgent):
         for model in self.fallback_models:
             try:
                 if model == 'ollama':
-                    # Check Ollama health first
-                    if not await self.health_check_ollama():
-                        logger.warning("Ollama server not available, trying next fallback")
+                    # The circuit breaker answers from past request outcomes, no extra round-trip
+                    if not self.health.allow_request():
+                        logger.warning("Ollama circuit is open, trying next fallback")
                         continue
-                        
+                    
                     return await self.process_with_ollama(input_data)
                 elif model == 'simple_rules':
                     return await self.rule_based_fallback(input_data)
@@ -89,7 +125,7 @@ class OllamaAgent(BaseAgent):
         
         return AgentResponse(success=False, error="All fallback models failed", severity=ErrorSeverity.CRITICAL.value)
     
-    async def process_with_ollama(self, input_data: Dict[str, Any]) -> AgentResponse:
+    def _build_chat_payload(self, input_data: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
         user_message = input_data.get('message', '')
         history = input_data.get('history', [])
         
@@ -98,17 +134,77 @@ class OllamaAgent(BaseAgent):
         if current_datetime:
             formatted_messages.append({"role": "system", "content": f"Current date and time: {current_datetime}"})
 
-        formatted_messages.extend([{"role": msg["role"], "content": msg["content"]} for msg in history])
+        # Older turns arrive as a rolling summary; recent ones are trimmed to the token budget
+        summary = summary_message(input_data.get('conversation_summary'))
+        budget = self.history_token_budget - estimate_tokens(user_message)
+        if summary:
+            formatted_messages.append(summary)
+            budget -= estimate_tokens(summary['content'])
+        formatted_messages.extend(
+            [{"role": msg["role"], "content": msg["content"]} for msg in trim_history(history, budget)]
+        )
         formatted_messages.append({"role": "user", "content": user_message})
         
-        payload = {"model": self.model, "messages": formatted_messages, "stream": False}
+        payload = {"model": self.model, "messages": formatted_messages, "stream": stream}
+        # Structured output: 'json' or a JSON schema
+        if input_data.get('format'):
+            payload["format"] = input_data['format']
+        return payload
+
+    async def process_with_ollama(self, input_data: Dict[str, Any]) -> AgentResponse:
+        payload = self._build_chat_payload(input_data)
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(f"{self.ollama_url}/api/chat", json=payload)
+        try:
+            response = await get_ollama_client(self.ollama_url).post("/api/chat", json=payload, timeout=60.0)
             response.raise_for_status()
-            ollama_response = response.json()
-            response_text = ollama_response.get('message', {}).get('content', '')
-            return AgentResponse(success=True, data={"response": response_text, "agent": self.name, "response_type": "llm_chat"}, metadata=ollama_response.get('metadata', {}))
+        except Exception as e:
+            self._record_ollama_error(e)
+            raise
+        self.health.record_success()
+        ollama_response = response.json()
+        response_text = ollama_response.get('message', {}).get('content', '')
+        return AgentResponse(success=True, data={"response": response_text, "agent": self.name, "response_type": "llm_chat"}, metadata=ollama_response.get('metadata', {}))
+
+    async def stream_with_ollama(self, input_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Yield content tokens from Ollama's NDJSON chat stream as they are generated."""
+        payload = self._build_chat_payload(input_data, stream=True)
+        try:
+            async with get_ollama_client(self.ollama_url).stream("POST", "/api/chat", json=payload, timeout=60.0) as response:
+                response.raise_for_status()
+                self.health.record_success()
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise RuntimeError(f"Ollama stream error: {chunk['error']}")
+                    content = chunk.get('message', {}).get('content', '')
+                    if content:
+                        yield content
+                    if chunk.get('done'):
+                        break
+        except Exception as e:
+            self._record_ollama_error(e)
+            raise
+
+    async def stream(self, input_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Stream from Ollama, falling back to rule-based text if it fails before the first token."""
+        if self.health.allow_request():
+            started = False
+            try:
+                async for token in self.stream_with_ollama(input_data):
+                    started = True
+                    yield token
+                return
+            except Exception as e:
+                # Once tokens reached the client there is nothing sensible to fall back to
+                if started:
+                    raise
+                logger.warning(f"Ollama streaming failed before the first token: {e}")
+        else:
+            logger.warning("Ollama circuit is open, streaming rule-based fallback")
+        fallback = await self.rule_based_fallback(input_data)
+        yield fallback.data['response']
     
     async def rule_based_fallback(self, input_data: Dict[str, Any]) -> AgentResponse:
         """Simple rule-based fallback when LLM is not available."""
@@ -137,6 +233,11 @@ class RouterAgent(OllamaAgent):
         kwargs.setdefault('name', 'RouterAgent')
         super().__init__(**kwargs)
         self.capabilities.extend(["router", "tool_user", "autonomous_reasoning"])
+        self.intent_classifier = None
+        if ROUTER_INTENT_CLASSIFIER:
+            # Deferred so importing the agents module does not pull in numpy
+            from .intent_classifier import intent_classifier
+            self.intent_classifier = intent_classifier
         
         # Few-shot examples for better routing
         self.router_examples = """
@@ -158,47 +259,36 @@ Wiadomość: "Jak się masz?"
 Narzędzie: general_conversation
 """
         
-        # Rule-based patterns for immediate routing
-        self.routing_patterns = {
-            'weather_service': [
-                r'\b(pogoda|temperatur[ae]|deszcz|słońce|chłodno|ciepło|wiatr|śnieg)\b',
-                r'\b(jaka.*pogoda|jak.*pogoda|czy.*pada|czy.*świeci)\b'
-            ],
-            'web_search': [
-                r'\b(wyszukaj|znajdź|poszukaj|sprawdź w internecie|googluj)\b',
-                r'\b(najnowsze|aktualn[ey]|co nowego|informacj[ae])\b'
-            ],
-            'pantry_management': [
-                r'\b(spiżarni[ae]|lodówc[ae]|produkty|jedzeni[ae]|co mam)\b',
-                r'\b(ile mam|czy mam|lista produktów)\b'
-            ],
-            'rag_search': [
-                r'\b(dokument|plik|pdf|tekst|treść|przeczytaj)\b',
-                r'\b(co jest w|opowiedz o|znajdź w dokumencie)\b'
-            ]
-        }
+        # Rule-based patterns for immediate routing, compiled once (overridable via config)
+        self.routing_matcher = RoutingMatcher.from_config(self.config)
 
     async def process(self, input_data: Dict[str, Any]) -> AgentResponse:
+        prepared = await self._prepare_input(input_data)
+        response = await super().process(prepared)
+        response.metadata = {**(response.metadata or {}), 'routing': prepared.get('routing')}
+        return response
+
+    async def stream(self, input_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Route and run tools up front, then stream only the final answer."""
+        async for token in super().stream(await self._prepare_input(input_data)):
+            yield token
+
+    async def _prepare_input(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Pick a tool for the message and return the input augmented with its results."""
         user_message = input_data.get('message', '')
-        history = input_data.get('history', [])
 
         # Hardcoded rule for simple greetings
         greetings = ['cześć', 'hej', 'witam', 'dzień dobry', 'hi', 'hello']
         if user_message.strip().lower() in greetings:
             logger.info("Greeting detected, skipping router.")
-            return await super().process(input_data)
+            input_data['routing'] = {'tool': 'general_conversation', 'source': 'rule'}
+            return input_data
 
-        # 1. Try rule-based routing first (faster and more reliable)
-        chosen_tool = self._rule_based_routing(user_message)
-        
-        if chosen_tool:
-            logger.info(f"Rule-based routing selected: '{chosen_tool}'")
-        else:
-            # 2. Fallback to LLM-based routing with few-shot examples
-            chosen_tool = await self._llm_based_routing(user_message)
-            logger.info(f"LLM-based routing selected: '{chosen_tool}'")
+        chosen_tool, source = await self._route(user_message)
+        logger.info(f"Routing selected '{chosen_tool}' (source: {source})")
+        input_data['routing'] = {'tool': chosen_tool, 'source': source}
 
-        # 3. Execute the chosen tool's logic
+        # Execute the chosen tool's logic
         if chosen_tool == 'web_search':
             return await self._execute_web_search(input_data)
         elif chosen_tool == 'weather_service':
@@ -208,24 +298,36 @@ Narzędzie: general_conversation
         elif chosen_tool == 'pantry_management':
             return await self._execute_pantry_management(input_data)
         else: # general_conversation
-            return await super().process(input_data)
+            return input_data
+
+    async def _route(self, user_message: str) -> Tuple[str, str]:
+        """Return (tool, source) where source is 'rule', 'cache', 'embedding' or 'llm'."""
+        # 1. Try rule-based routing first (faster and more reliable)
+        chosen_tool = self._rule_based_routing(user_message)
+        if chosen_tool:
+            return chosen_tool, 'rule'
+
+        # 2. Reuse an earlier LLM decision for the same (normalized) message
+        chosen_tool = await routing_cache.aget(user_message, self.model)
+        if chosen_tool:
+            return chosen_tool, 'cache'
+
+        # 3. Nearest intent centroid in embedding space, if it is confident
+        if self.intent_classifier is not None:
+            try:
+                intent = await self.intent_classifier.classify(user_message)
+            except Exception as e:
+                logger.warning(f"Intent classifier unavailable: {e}")
+                intent = None
+            if intent:
+                return intent.intent, 'embedding'
+
+        # 4. Fallback to LLM-based routing with few-shot examples
+        return await self._llm_based_routing(user_message), 'llm'
         
     def _rule_based_routing(self, user_message: str) -> Optional[str]:
         """Fast rule-based routing for common patterns."""
-        message_lower = user_message.lower()
-        
-        # Check each tool pattern
-        for tool, patterns in self.routing_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, message_lower):
-                    return tool
-        
-        # Check for simple greetings
-        greetings = ['cześć', 'hej', 'witam', 'dzień dobry', 'hi', 'hello', 'jak się masz']
-        if any(greeting in message_lower for greeting in greetings):
-            return 'general_conversation'
-            
-        return None
+        return self.routing_matcher.best(user_message)
     
     async def _llm_based_routing(self, user_message: str) -> str:
         """LLM-based routing with few-shot examples."""
@@ -250,6 +352,8 @@ Narzędzie: general_conversation
             decision_response = await super().process(routing_input)
             if not decision_response.success:
                 return 'general_conversation'
+            # A rule-based fallback answer says nothing about the message, so don't cache it
+            cacheable = not (decision_response.metadata or {}).get('fallback_used')
                 
             response_text = decision_response.data.get('response', 'general_conversation').strip()
             
@@ -257,31 +361,35 @@ Narzędzie: general_conversation
             response_text = re.sub(r'[^a-z_]', '', response_text.lower())
             
             # Find exact match
+            chosen_tool = 'general_conversation'
             for tool_name in ['web_search', 'weather_service', 'rag_search', 'pantry_management', 'general_conversation']:
                 if tool_name in response_text:
-                    return tool_name
-                    
-            return 'general_conversation'
+                    chosen_tool = tool_name
+                    break
+
+            if cacheable:
+                await routing_cache.aset(user_message, self.model, chosen_tool)
+            return chosen_tool
         except Exception as e:
             logger.error(f"LLM routing failed: {e}")
             return 'general_conversation'
 
     async def _execute_rag_search(self, input_data):
         user_message = input_data.get('message', '')
-        retrieved_context = rag_processor.retrieve_context(user_message, n_results=3)
+        retrieved_context = await rag_processor.aretrieve_context(user_message, n_results=3)
         if not retrieved_context:
-            return await super().process(input_data)
+            return input_data
         context_str = "\n\n---\n\n".join(retrieved_context)
         augmented_prompt = f"Na podstawie kontekstu z dokumentów: '{context_str}', odpowiedz na pytanie: '{user_message}'"
         input_data['message'] = augmented_prompt
-        return await super().process(input_data)
+        return input_data
 
     async def _execute_web_search(self, input_data):
         user_message = input_data.get('message', '')
         search_results = ddg_search(user_message)
         augmented_prompt = f"Na podstawie wyników wyszukiwania: '{search_results}', odpowiedz na pytanie: '{user_message}'"
         input_data['message'] = augmented_prompt
-        return await super().process(input_data)
+        return input_data
 
     async def _execute_weather_service(self, input_data):
         user_message = input_data.get('message', '')
@@ -293,33 +401,112 @@ Narzędzie: general_conversation
             weather_data = get_weather(city)
             augmented_prompt = f"Oto dane pogodowe: {weather_data}. Odpowiedz na pytanie użytkownika."
             input_data['message'] = augmented_prompt
-            return await super().process(input_data)
-        return await super().process(input_data) # Fallback if no city
+        return input_data # Unchanged if no city
 
-    async def _execute_pantry_management(self, input_data):
-        user_message = input_data.get('message', '')
-        
-        # Determine if user is asking about a specific item or general pantry content
-        # This requires another LLM call to classify the query type
-        classification_prompt = f"""
-        Użytkownik pyta o spiżarnię. Zdecyduj, czy pyta o konkretny produkt, czy o ogólną zawartość spiżarni.
-        Odpowiedz tylko jednym słowem: 'specific' lub 'general'.
+    # Questions about one product: "czy mam mleko?", "ile mam jajek"
+    PANTRY_SPECIFIC_PATTERN = re.compile(
+        r'\b(?:czy mam|ile mam|czy jest|ile jest|czy zostało|ile zostało|czy są|ile jeszcze mam)\s+'
+        r'(?:jeszcze\s+)?(?P<product>[\w\s,.-]+?)\s*(?:w (?:lodówce|spiżarni|domu))?\s*\??$'
+    )
+    # Questions about the whole pantry
+    PANTRY_GENERAL_PATTERN = re.compile(
+        r'\b(?:co mam|lista produktów|co jest w (?:lodówce|spiżarni)|zawartość (?:lodówki|spiżarni)|pokaż (?:spiżarnię|produkty))\b'
+    )
+    # Dropped before the product: "czy są jakieś jajka?" -> "jajka"
+    PANTRY_DETERMINERS = frozenset({
+        'jakieś', 'jakiś', 'jakie', 'jakiegoś', 'jakichś', 'jakaś', 'jakąś', 'jakiekolwiek', 'jakikolwiek',
+        'jakichkolwiek', 'któreś', 'jeszcze', 'może', 'wciąż', 'nadal',
+    })
+    # "czy jest coś w lodówce?", "ile jest produktów?" ask about the pantry, not an item
+    PANTRY_GENERIC_WORDS = frozenset({
+        'co', 'coś', 'cokolwiek', 'czegoś', 'nic', 'wszystko', 'tam', 'tu', 'tutaj',
+        'produkt', 'produkty', 'produktów', 'rzeczy', 'jedzenie', 'jedzenia', 'zapasy', 'zapasów',
+    })
+    # Leading amounts and units are dropped: "2 litry mleka" -> "mleka"
+    PANTRY_QUANTITY_PATTERN = re.compile(
+        r'^(?:\d+(?:[.,]\d+)?\s*|pół\s+|dużo\s+|trochę\s+|kilka\s+)?'
+        r'(?:(?:litr|kilogram|gram|opakowa|paczk|puszk|butel|słoik|sztuk|szt\b|kg\b|g\b|l\b|ml\b)\w*\.?\s+)?'
+    )
+    # Several products in one question are left to the LLM parser
+    PANTRY_MULTI_ITEM_PATTERN = re.compile(r',|\b(?:i|oraz|lub|albo|czy|a)\b')
+
+    def _parse_pantry_query_rules(self, user_message: str) -> Optional[Dict[str, Optional[str]]]:
+        """
+        Classify the pantry question with regexes, or None if unsure. A
+        'specific' result only names a one-word candidate ("ile mam czasu?"
+        yields 'czasu'); _parse_pantry_query checks it against the pantry.
+        """
+        message_lower = user_message.strip().lower()
+        match = self.PANTRY_SPECIFIC_PATTERN.search(message_lower)
+        if match:
+            words = match.group('product').split()
+            while words and words[0] in self.PANTRY_DETERMINERS:
+                words = words[1:]
+            product = self.PANTRY_QUANTITY_PATTERN.sub('', ' '.join(words)).strip(' .-')
+            words = [word for word in product.split() if word not in self.PANTRY_GENERIC_WORDS]
+            if not words:
+                return {'query_type': 'general', 'product': None}
+            if self.PANTRY_MULTI_ITEM_PATTERN.search(product) or len(words) > 1:
+                # Several products or a phrase ("czy mam iść do sklepu?") are left to the LLM parser
+                return None
+            if words[0].isdigit() or words[0].endswith('ć'):
+                # An amount without a product, or an infinitive
+                return None
+            return {'query_type': 'specific', 'product': words[0]}
+        if self.PANTRY_GENERAL_PATTERN.search(message_lower):
+            return {'query_type': 'general', 'product': None}
+        return None
+
+    async def _parse_pantry_query(self, user_message: str) -> Dict[str, Any]:
+        """
+        Classify the pantry question and extract the product in at most one LLM
+        call. A rule-based product is trusted only if it is in the pantry; the
+        found item is returned under 'item' so it is not looked up twice.
+        """
+        parsed = self._parse_pantry_query_rules(user_message)
+        if parsed and parsed['query_type'] == 'specific':
+            item = await AsyncPantryService.find_item_by_name(parsed['product'])
+            if item:
+                logger.info(f"Rule-based pantry query parsing: {parsed}")
+                return {**parsed, 'item': item}
+            # Not a stored product, so possibly not a product at all ("czy jest ciepło w lodówce?")
+            parsed = None
+        if parsed:
+            logger.info(f"Rule-based pantry query parsing: {parsed}")
+            return parsed
+
+        extraction_prompt = f"""
+        Użytkownik pyta o spiżarnię. Zdecyduj, czy pyta o konkretny produkt, czy o ogólną zawartość spiżarni,
+        i jeśli pyta o konkretny produkt, podaj jego nazwę.
+        Odpowiedz wyłącznie obiektem JSON: {{"query_type": "specific" lub "general", "product": nazwa produktu lub null}}
         Pytanie użytkownika: {user_message}
         """
-        classification_input = {'message': classification_prompt, 'history': []}
-        classification_response = await super().process(classification_input)
-        query_type = classification_response.data.get('response', 'general').strip().lower()
+        extraction_input = {'message': extraction_prompt, 'history': [], 'format': 'json'}
+        try:
+            extraction_response = await super().process(extraction_input)
+            result = json.loads(extraction_response.data.get('response', '') or '{}')
+        except Exception as e:
+            logger.warning(f"Structured pantry query parsing failed: {e}")
+            return {'query_type': 'general', 'product': None}
 
-        pantry_info = ""
-        if query_type == 'specific':
-            # Extract product name for specific query
-            product_name_prompt = f"Z pytania: '{user_message}' wyekstrahuj tylko nazwę produktu, o który pyta użytkownik. Odpowiedz tylko nazwą produktu."
-            product_name_input = {'message': product_name_prompt, 'history': []}
-            product_name_response = await super().process(product_name_input)
-            product_name = product_name_response.data.get('response', '').strip()
+        if not isinstance(result, dict):
+            return {'query_type': 'general', 'product': None}
+        query_type = str(result.get('query_type', 'general')).strip().lower()
+        product = result.get('product')
+        product = str(product).strip() if product else None
+        if query_type != 'specific':
+            return {'query_type': 'general', 'product': None}
+        return {'query_type': 'specific', 'product': product}
 
+    async def _execute_pantry_management(self, input_data):
+        user_message = input_data.get('message', '')
+        parsed = await self._parse_pantry_query(user_message)
+
+        pantry_info = ""
+        if parsed['query_type'] == 'specific':
+            product_name = parsed['product']
             if product_name:
-                item = await AsyncPantryService.find_item_by_name(product_name)
+                item = parsed.get('item') or await AsyncPantryService.find_item_by_name(product_name)
                 if item:
                     pantry_info = f"W spiżarni masz {item['quantity']} {item['unit']} {item['name']}."
                 else:
@@ -337,4 +524,4 @@ Narzędzie: general_conversation
         
         augmented_prompt = f"Oto informacje o spiżarni: '{pantry_info}'. Odpowiedz na pytanie użytkownika: '{user_message}'"
         input_data['message'] = augmented_prompt
-        return await super().process(input_data)
+        return input_data
@@ -5,12 +5,35 @@ Provides async-first database operations and business logic.
 import logging
 from typing import Any, Dict, List, Optional
 from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 
 from ..models import Agent, Conversation, Message, PantryItem, ReceiptProcessing
 from ..interfaces import BaseAgentInterface
+from ..utils.cursors import decode_cursor, encode_cursor
+from .history_buffer import history_buffer
+from .message_writer import message_write_behind
 
 logger = logging.getLogger(__name__)
 
+HISTORY_PAGE_MAX = 200
+
+# Inflectional endings stripped from product names, longest first: "jajek" / "jajka" -> "jaj"
+PRODUCT_NAME_ENDINGS = ('ami', 'ach', 'ów', 'om', 'em', 'ek', 'a', 'e', 'i', 'o', 'u', 'y', 'ę', 'ą')
+MIN_STEM_LENGTH = 3
+
+
+def product_name_stems(product_name: str) -> List[str]:
+    """Crude Polish stems of each word, so "mleka" finds "Mleko" and "ziemniaków" finds "Ziemniaki"."""
+    stems = []
+    for word in product_name.lower().split():
+        for ending in PRODUCT_NAME_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+                word = word[:-len(ending)]
+                break
+        stems.append(word)
+    return stems
+
 
 class AsyncAgentService:
     """Async service for agent-related operations"""
@@ -84,6 +107,7 @@ class AsyncConversationService:
         try:
             conversation = await Conversation.objects.aget(session_id=session_id)
             
+            started = await history_buffer.abegin_write(conversation.pk)
             message = await Message.objects.acreate(
                 conversation=conversation,
                 role=role,
@@ -91,10 +115,8 @@ class AsyncConversationService:
                 metadata=metadata or {}
             )
             
-            # Update conversation timestamp
-            from django.utils import timezone
-            conversation.updated_at = timezone.now()
-            await conversation.asave()
+            # Counters, preview and updated_at are bumped by the Message post_save signal
+            await history_buffer.aappend(conversation.pk, [{'role': role, 'content': content}], started)
             
             logger.info(f"Added {role} message to conversation {session_id}")
             return message
@@ -103,6 +125,38 @@ class AsyncConversationService:
             logger.error(f"Conversation not found: {session_id}")
             raise ValueError(f"Conversation not found: {session_id}")
     
+    @staticmethod
+    async def save_messages(conversation_id: int, messages: List[Dict[str, Any]]) -> List[Message]:
+        """
+        Store several messages of one conversation in a single bulk insert and
+        one counter UPDATE. With write-behind enabled they are queued instead
+        and an empty list is returned; see services.message_writer.
+        """
+        started = await history_buffer.abegin_write(conversation_id)
+        if message_write_behind.enabled:
+            await message_write_behind.enqueue(conversation_id, messages)
+            await history_buffer.aappend(conversation_id, [
+                {'role': message['role'], 'content': message['content']} for message in messages
+            ], started)
+            return []
+
+        created = await Message.objects.abulk_create([
+            Message(
+                conversation_id=conversation_id,
+                role=message['role'],
+                content=message['content'],
+                metadata=message.get('metadata') or {}
+            )
+            for message in messages
+        ])
+        # bulk_create sends no post_save, so the counters are bumped here rather than by the signal
+        await Conversation.arecord_messages(conversation_id, created)
+        await history_buffer.aappend(conversation_id, [
+            {'role': message.role, 'content': message.content} for message in created
+        ], started)
+        logger.info(f"Saved {len(created)} messages to conversation {conversation_id}")
+        return created
+
     @staticmethod
     async def get_conversation_messages(
         session_id: str, 
@@ -140,6 +194,63 @@ class AsyncConversationService:
             logger.error(f"Conversation not found: {session_id}")
             return []
 
+    @staticmethod
+    async def get_conversation_messages_page(
+        session_id: str,
+        limit: int = 50,
+        before: Optional[str] = None,
+        after: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        One page of messages in chronological order using (created_at, id)
+        keyset cursors. Without cursors the newest page is returned; `before`
+        pages back to older messages, `after` forward to newer ones. Returns
+        None for unknown conversations; malformed cursors raise ValueError.
+        """
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+        try:
+            conversation = await Conversation.objects.aget(session_id=session_id)
+        except (Conversation.DoesNotExist, ValidationError):
+            logger.error(f"Conversation not found: {session_id}")
+            return None
+
+        queryset = Message.objects.filter(conversation=conversation)
+        if after:
+            created_at, pk = decode_cursor(after)
+            queryset = queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            ).order_by('created_at', 'id')
+        else:
+            if before:
+                created_at, pk = decode_cursor(before)
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            queryset = queryset.order_by('-created_at', '-id')
+
+        # One extra row tells whether another page exists in this direction
+        page = [message async for message in queryset[:limit + 1]]
+        has_more = len(page) > limit
+        page = page[:limit]
+        if not after:
+            page.reverse()
+
+        messages = [
+            {
+                'id': message.id,
+                'role': message.role,
+                'content': message.content,
+                'created_at': message.created_at.isoformat(),
+                'metadata': message.metadata
+            }
+            for message in page
+        ]
+        older_exist = bool(after) or has_more
+        return {
+            'messages': messages,
+            'has_more': has_more,
+            'before': encode_cursor(page[0].created_at, page[0].id) if page and older_exist else None,
+            'after': encode_cursor(page[-1].created_at, page[-1].id) if page else after,
+        }
+
 
 class AsyncPantryService:
     """Async service for pantry management operations"""
@@ -161,11 +272,18 @@ class AsyncPantryService:
     
     @staticmethod
     async def find_item_by_name(product_name: str) -> Optional[Dict[str, Any]]:
-        """Find pantry item by name (partial match)"""
+        """Find pantry item by name (partial match, then by shared word stems)"""
         try:
             item = await PantryItem.objects.filter(
                 name__icontains=product_name
             ).afirst()
+            if item is None:
+                stems = product_name_stems(product_name)
+                if stems:
+                    stem_filter = Q()
+                    for stem in stems:
+                        stem_filter &= Q(name__icontains=stem)
+                    item = await PantryItem.objects.filter(stem_filter).order_by('name').afirst()
             
             if item:
                 return {
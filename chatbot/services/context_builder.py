@@ -0,0 +1,111 @@
+"""
+Token-budgeted prompt history and rolling conversation summaries.
+
+The LLM no longer receives a fixed number of past messages. History is
+filled newest-first until ``CHAT_HISTORY_TOKEN_BUDGET`` (estimated) tokens are
+used, so a few long messages cannot blow up the prompt and many short ones
+still fit. Older turns are folded into ``Conversation.summary`` by a
+background task. The summary is sent as a system message, so long
+conversations keep their gist at a bounded prompt size.
+
+Summarisation is measured in the same tokens as the prompt budget, so every
+message stays either in the summary or in the trimmed history. Once the
+not-yet-summarized messages exceed ``CHAT_SUMMARY_TRIGGER_RATIO`` of the
+budget, a task folds all but the newest ``CHAT_SUMMARY_KEEP_RATIO`` of the
+budget into the summary, well before ``trim_history`` has to drop them.
+"""
+import logging
+import math
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = getattr(settings, 'CHAT_HISTORY_TOKEN_BUDGET', 2048)
+# Rough average for Polish text with llama-family tokenizers; errs on the generous side
+CHARS_PER_TOKEN = getattr(settings, 'CHAT_CHARS_PER_TOKEN', 3.5)
+MESSAGE_OVERHEAD_TOKENS = 4  # role and separators added by the chat template
+
+# Shares of the history budget: unsummarized messages kept after a summary, and the level that triggers one.
+# The gap between trigger and budget leaves room for the summary itself and the next user message.
+SUMMARY_KEEP_RATIO = getattr(settings, 'CHAT_SUMMARY_KEEP_RATIO', 0.4)
+SUMMARY_TRIGGER_RATIO = getattr(settings, 'CHAT_SUMMARY_TRIGGER_RATIO', 0.6)
+SUMMARY_MAX_BATCH = getattr(settings, 'CHAT_SUMMARY_MAX_BATCH', 50)  # messages folded per summarization call
+
+SUMMARY_PROMPT = (
+    "Poniżej jest dotychczasowe podsumowanie rozmowy oraz kolejne wiadomości. "
+    "Zaktualizuj podsumowanie tak, aby zawierało wszystkie istotne fakty, ustalenia, "
+    "preferencje użytkownika i otwarte sprawy. Pisz zwięźle, maksymalnie 200 słów, "
+    "i odpowiedz wyłącznie nowym podsumowaniem.\n\n"
+    "Dotychczasowe podsumowanie:\n{summary}\n\n"
+    "Nowe wiadomości:\n{messages}"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate from character count (no tokenizer round-trip)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+def trim_history(history: Sequence[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+    """Newest messages that fit in `budget` tokens, in chronological order."""
+    kept = []
+    used = 0
+    for message in reversed(history):
+        cost = message_tokens(message)
+        if used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+    if len(kept) < len(history):
+        logger.debug(f"Trimmed history from {len(history)} to {len(kept)} messages ({used}/{budget} tokens)")
+    return kept
+
+
+def summary_message(summary: Optional[str]) -> Optional[Dict[str, str]]:
+    if not summary:
+        return None
+    return {"role": "system", "content": f"Podsumowanie wcześniejszej części rozmowy: {summary}"}
+
+
+def needs_summary(tail: Sequence[Dict[str, str]], pending: int, budget: int = HISTORY_TOKEN_BUDGET) -> bool:
+    """
+    Whether the not-yet-summarized messages outgrew the trigger share of the
+    history budget. `tail` is the newest messages (as sent to the agent plus
+    the turn just saved), `pending` how many messages the summary lacks.
+    """
+    if pending <= 0:
+        return False
+    if pending > len(tail):
+        # Unsummarized messages older than the loaded tail never reach the prompt
+        return True
+    return sum(message_tokens(message) for message in tail[-pending:]) > budget * SUMMARY_TRIGGER_RATIO
+
+
+def messages_to_summarize(messages: Sequence[Dict[str, str]], budget: int = HISTORY_TOKEN_BUDGET) -> int:
+    """How many of the oldest unsummarized `messages` to fold, keeping the keep share of the budget."""
+    keep = len(trim_history(messages, int(budget * SUMMARY_KEEP_RATIO)))
+    return min(len(messages) - keep, SUMMARY_MAX_BATCH)
+
+
+def summarize_messages(previous_summary: str, messages: Sequence[Dict[str, str]], model: str,
+                       base_url: Optional[str] = None) -> str:
+    """Fold messages into the running summary with one blocking Ollama call (for Celery workers)."""
+    from .ollama_client import DEFAULT_OLLAMA_URL
+
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    prompt = SUMMARY_PROMPT.format(summary=previous_summary or "(brak)", messages=transcript)
+    response = httpx.post(
+        f"{(base_url or DEFAULT_OLLAMA_URL).rstrip('/')}/api/chat",
+        json={"model": model, "messages": [{"role": "user", "content": prompt}], "stream": False},
+        timeout=120.0,
+    )
+    response.raise_for_status()
+    return response.json().get('message', {}).get('content', '').strip()
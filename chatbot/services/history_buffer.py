@@ -0,0 +1,156 @@
+"""
+Hot chat history kept in the cache, one ring buffer per conversation.
+
+Each active conversation keeps its last ``CHAT_HISTORY_BUFFER_SIZE`` messages,
+already formatted for the LLM, under one cache key. Message writes go to the
+database first and are then appended to the buffer. Reads try the buffer
+first and fall back to the ``Message`` table on a miss, seeding the buffer on
+the way.
+
+Concurrent turns and cache-miss reads must not leave a buffer that silently
+lacks (or repeats) a message, and the cache API has no compare-and-set. So
+every conversation also has an atomically incremented generation counter, and
+a buffer is only served while it is tagged with the current generation:
+
+* A writer increments the generation before and after its database write
+  (``abegin_write`` / ``aappend``). It extends the buffer only when the two
+  increments were adjacent and the buffer was current just before the first
+  one, i.e. nothing else can have written in between. Otherwise the buffer is
+  simply left stale and the next read reloads it.
+* A reader seeding on a miss reads the generation before its database query
+  and stores the buffer only if the generation has not moved since, so a seed
+  that raced with a write is never served.
+"""
+import logging
+import random
+from typing import Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+HISTORY_BUFFER_SIZE = getattr(settings, 'CHAT_HISTORY_BUFFER_SIZE', 20)
+HISTORY_BUFFER_TTL = getattr(settings, 'CHAT_HISTORY_BUFFER_TTL', 3600)
+
+
+class HistoryBuffer:
+    """Per-conversation ring buffer of recent messages in the Django cache"""
+
+    key_prefix = 'chat_history'
+
+    def __init__(self, size: int = HISTORY_BUFFER_SIZE, ttl: int = HISTORY_BUFFER_TTL):
+        self.size = size
+        self.ttl = ttl
+
+    def _key(self, conversation_id: int) -> str:
+        return f"{self.key_prefix}:{conversation_id}"
+
+    def _generation_key(self, conversation_id: int) -> str:
+        return f"{self.key_prefix}:generation:{conversation_id}"
+
+    def _incr_generation(self, conversation_id: int) -> int:
+        """Atomically bump the generation (backend incr), starting from a random value if it expired."""
+        key = self._generation_key(conversation_id)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # A random start keeps buffers tagged before the counter expired from matching again
+            cache.add(key, random.getrandbits(48), timeout=self.ttl)
+            return cache.incr(key)
+
+    async def ageneration(self, conversation_id: int) -> Optional[int]:
+        """Current generation, read by a cache-miss reader before it queries the database."""
+        key = self._generation_key(conversation_id)
+        try:
+            generation = await cache.aget(key)
+            if generation is None:
+                await cache.aadd(key, random.getrandbits(48), timeout=self.ttl)
+                generation = await cache.aget(key)
+            return generation
+        except Exception as e:
+            logger.warning(f"History buffer generation read failed for conversation {conversation_id}: {e}")
+            return None
+
+    async def aget(self, conversation_id: int, limit: int) -> Optional[List[Dict]]:
+        """Last `limit` messages, or None if the buffer is missing, stale or too short to answer."""
+        if limit > self.size:
+            return None
+        key, generation_key = self._key(conversation_id), self._generation_key(conversation_id)
+        try:
+            found = await cache.aget_many([key, generation_key])
+        except Exception as e:
+            logger.warning(f"History buffer read failed for conversation {conversation_id}: {e}")
+            return None
+        buffered = found.get(key)
+        if buffered is None or buffered['generation'] != found.get(generation_key):
+            return None
+        messages = buffered['messages']
+        return messages[-limit:] if limit else []
+
+    async def aset(self, conversation_id: int, messages: List[Dict], generation: Optional[int]):
+        """
+        Seed the buffer with the conversation's most recent messages (oldest
+        first), loaded after `generation` was read. Skipped if a write bumped
+        the generation in the meantime, since the messages may then miss it.
+        """
+        if generation is None:
+            return
+        try:
+            if await cache.aget(self._generation_key(conversation_id)) != generation:
+                return
+            await cache.aset(
+                self._key(conversation_id),
+                {'generation': generation, 'messages': list(messages[-self.size:])},
+                timeout=self.ttl
+            )
+        except Exception as e:
+            logger.warning(f"History buffer write failed for conversation {conversation_id}: {e}")
+
+    async def abegin_write(self, conversation_id: int) -> Optional[int]:
+        """Announce a message write; pass the result to aappend once the write is done."""
+        try:
+            return await sync_to_async(self._incr_generation, thread_sensitive=False)(conversation_id)
+        except Exception as e:
+            logger.warning(f"History buffer generation bump failed for conversation {conversation_id}: {e}")
+            return None
+
+    async def aappend(self, conversation_id: int, messages: List[Dict], started: Optional[int]):
+        """Append newly stored messages, dropping the oldest beyond the buffer size."""
+        key = self._key(conversation_id)
+        try:
+            finished = await sync_to_async(self._incr_generation, thread_sensitive=False)(conversation_id)
+            if started is None or finished != started + 1:
+                # Another write overlapped this one; the buffer is now stale and reloads on the next read
+                return
+            buffered = await cache.aget(key)
+            if buffered is None or buffered['generation'] != started - 1:
+                # Not seeded (or already stale); the next read loads the tail from the database
+                return
+            await cache.aset(
+                key,
+                {'generation': finished, 'messages': (buffered['messages'] + list(messages))[-self.size:]},
+                timeout=self.ttl
+            )
+        except Exception as e:
+            logger.warning(f"History buffer append failed for conversation {conversation_id}: {e}")
+            await self.adelete(conversation_id)
+
+    async def adelete(self, conversation_id: int):
+        try:
+            await cache.adelete(self._key(conversation_id))
+        except Exception as e:
+            logger.warning(f"History buffer delete failed for conversation {conversation_id}: {e}")
+
+    def delete(self, conversation_id: int):
+        """Drop the buffer (used from signal handlers when messages change outside a chat turn)."""
+        try:
+            # Bumping the generation also stops a concurrent cache-miss read from seeding the old tail
+            self._incr_generation(conversation_id)
+            cache.delete(self._key(conversation_id))
+        except Exception as e:
+            logger.warning(f"History buffer delete failed for conversation {conversation_id}: {e}")
+
+
+history_buffer = HistoryBuffer()
@@ -0,0 +1,183 @@
+"""
+Embedding-based intent classifier used as the middle RouterAgent tier.
+
+Messages the regex rules miss are embedded once and compared with one
+centroid per tool, built from the labelled examples below. Only when the
+best match is weak (low similarity, or too close to the runner-up) does the
+router fall through to the slow few-shot LLM call.
+
+Example embeddings are computed lazily on first use and, like query
+embeddings, go through the shared SQLite embedding cache, so after the first
+run fitting costs no Ollama calls. Embedding requests respect the Ollama
+circuit breaker: while it is open, uncached messages fail fast and the router
+moves on without waiting for a timeout.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from ..interfaces import IntentData
+from ..rag_processor import EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_PATH, EMBEDDING_MODEL
+from ..utils.embedding_cache import EmbeddingCache
+from .ollama_client import DEFAULT_OLLAMA_URL, aembed
+from .ollama_health import OllamaHealth, get_ollama_health
+
+logger = logging.getLogger(__name__)
+
+INTENT_MIN_CONFIDENCE = getattr(settings, 'ROUTER_INTENT_MIN_CONFIDENCE', 0.6)
+INTENT_MIN_MARGIN = getattr(settings, 'ROUTER_INTENT_MIN_MARGIN', 0.03)
+
+INTENT_EXAMPLES: Dict[str, List[str]] = {
+    'weather_service': [
+        "Jaka jest pogoda w Krakowie?",
+        "Czy jutro będzie padać w Warszawie?",
+        "Ile stopni jest teraz w Gdańsku?",
+        "Potrzebuję parasola dzisiaj?",
+        "Jaka prognoza na weekend?",
+        "Czy będzie mróz w nocy?",
+    ],
+    'web_search': [
+        "Wyszukaj informacje o nowym iPhone",
+        "Kto wygrał wczoraj mecz?",
+        "Jaki jest kurs euro?",
+        "Co się dzieje na świecie?",
+        "Kiedy premiera nowego filmu Nolana?",
+        "Ile kosztuje bilet do Berlina?",
+    ],
+    'pantry_management': [
+        "Co mam w lodówce?",
+        "Czy zostało mi jeszcze mleko?",
+        "Dodaj dwa kilogramy ziemniaków do spiżarni",
+        "Co mogę ugotować z tego, co mam?",
+        "Kończy mi się masło?",
+        "Które produkty niedługo się przeterminują?",
+    ],
+    'rag_search': [
+        "Opowiedz o dokumencie ABC.pdf",
+        "Co jest napisane w mojej umowie?",
+        "Streść przesłany raport",
+        "Jakie są wnioski z notatek, które wgrałem?",
+        "Znajdź w moich plikach informację o terminie",
+        "Co mówi instrukcja o konserwacji?",
+    ],
+    'general_conversation': [
+        "Jak się masz?",
+        "Dziękuję za pomoc",
+        "Opowiedz mi dowcip",
+        "Kim jesteś?",
+        "Co potrafisz?",
+        "Miłego dnia!",
+    ],
+}
+
+
+class IntentClassifier:
+    """Nearest-centroid classifier over message embeddings"""
+
+    def __init__(
+        self,
+        examples: Dict[str, Sequence[str]] = INTENT_EXAMPLES,
+        model: str = EMBEDDING_MODEL,
+        min_confidence: float = INTENT_MIN_CONFIDENCE,
+        min_margin: float = INTENT_MIN_MARGIN,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        health: Optional[OllamaHealth] = None,
+    ):
+        self.examples = examples
+        self.model = model
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self._embedding_cache = embedding_cache
+        self.health = health or get_ollama_health(DEFAULT_OLLAMA_URL)
+        self._labels: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._fit_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def embedding_cache(self) -> EmbeddingCache:
+        if self._embedding_cache is None:
+            self._embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+        return self._embedding_cache
+
+    @property
+    def is_fitted(self) -> bool:
+        return self._centroids is not None
+
+    async def _aembed(self, texts: List[str]) -> np.ndarray:
+        """Unit-length embeddings for texts, reusing cached vectors."""
+        found = await sync_to_async(self.embedding_cache.get_many, thread_sensitive=False)(self.model, texts)
+        vectors = {text: vector for text, vector in zip(texts, found) if vector is not None}
+        missing = [text for text in dict.fromkeys(texts) if text not in vectors]
+        if missing:
+            if not self.health.allow_request():
+                raise ConnectionError("Ollama circuit is open, skipping embedding request")
+            try:
+                embeddings = await aembed(missing, model=self.model)
+            except Exception as e:
+                # Client errors mean the server is up, as in OllamaAgent._record_ollama_error
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                    self.health.record_success()
+                else:
+                    self.health.record_failure()
+                raise
+            self.health.record_success()
+            await sync_to_async(self.embedding_cache.set_many, thread_sensitive=False)(self.model, missing, embeddings)
+            vectors.update(zip(missing, embeddings))
+        matrix = np.asarray([vectors[text] for text in texts], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    async def fit(self):
+        """Embed the labelled examples and compute one unit-length centroid per intent."""
+        labels = list(self.examples)
+        texts = [text for label in labels for text in self.examples[label]]
+        vectors = await self._aembed(texts)
+
+        centroids = []
+        offset = 0
+        for label in labels:
+            count = len(self.examples[label])
+            centroid = vectors[offset:offset + count].mean(axis=0)
+            centroids.append(centroid / max(np.linalg.norm(centroid), 1e-12))
+            offset += count
+        self._labels = labels
+        self._centroids = np.vstack(centroids)
+        logger.info(f"Intent classifier fitted on {len(texts)} examples for {len(labels)} intents")
+
+    async def ensure_fitted(self):
+        if self.is_fitted:
+            return
+        if self._fit_lock is None:
+            self._fit_lock = asyncio.Lock()
+        async with self._fit_lock:
+            if not self.is_fitted:
+                await self.fit()
+
+    async def classify(self, message: str) -> Optional[IntentData]:
+        """Return the closest intent, or None when the match is not confident enough."""
+        await self.ensure_fitted()
+        vector = (await self._aembed([message]))[0]
+        scores = self._centroids @ vector
+
+        ranked = np.argsort(scores)[::-1]
+        best = float(scores[ranked[0]])
+        runner_up = float(scores[ranked[1]]) if len(ranked) > 1 else -1.0
+        intent = self._labels[ranked[0]]
+        logger.debug(f"Intent scores for '{message}': best {intent}={best:.3f}, margin {best - runner_up:.3f}")
+
+        if best < self.min_confidence or best - runner_up < self.min_margin:
+            return None
+        return IntentData(
+            intent=intent,
+            confidence=best,
+            entities={'margin': best - runner_up},
+            raw_query=message,
+        )
+
+
+intent_classifier = IntentClassifier()
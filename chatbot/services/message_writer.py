@@ -0,0 +1,229 @@
+"""
+Optional write-behind batching for chat messages (``CHAT_WRITE_BEHIND``).
+
+With write-behind enabled, a chat turn's messages are queued in-process and the
+request returns without touching the ``Message`` table. The queue is flushed
+when it reaches ``CHAT_WRITE_BEHIND_BATCH_SIZE`` messages, when a flush is
+``CHAT_WRITE_BEHIND_INTERVAL`` seconds overdue, or on ASGI lifespan shutdown.
+A flush is one transaction: a single ``bulk_create`` for every queued message
+plus one counter ``UPDATE`` per conversation.
+
+Guarantees:
+
+* Ordering: messages are inserted in enqueue order, so ids, and therefore the
+  (created_at, id) order used for history, follow the order they were saved
+  in, within a conversation and across turns. ``created_at`` is the flush
+  time.
+* Visibility: queued messages are appended to the history buffer at enqueue
+  time and merged into history reads on a buffer miss, so the next turn sees
+  them before they reach the database. History API pages only show flushed
+  messages.
+* Durability: a flush that fails as a whole (e.g. the database is down) puts
+  its batch back at the head of the queue for the next flush. A message is
+  retried at most ``CHAT_WRITE_BEHIND_MAX_RETRIES`` times.
+* Poison messages: messages whose conversation was deleted while they were
+  queued are dropped before the insert. If the insert still hits an
+  integrity error, the batch is retried per conversation and then per
+  message, so one bad row cannot block the rest. Rows that cannot be written
+  are dropped and logged as errors.
+* Bounded memory: the queue never holds more than
+  ``CHAT_WRITE_BEHIND_MAX_QUEUE`` messages; beyond that the oldest are
+  dropped and logged.
+* Messages still queued when the process dies without a clean shutdown are
+  lost. Keep write-behind off where every message must survive a crash.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+
+from ..models import Conversation, Message
+from .history_buffer import history_buffer
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = getattr(settings, 'CHAT_WRITE_BEHIND', False)
+WRITE_BEHIND_BATCH_SIZE = getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 50)
+WRITE_BEHIND_INTERVAL = getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL', 0.5)
+WRITE_BEHIND_MAX_RETRIES = getattr(settings, 'CHAT_WRITE_BEHIND_MAX_RETRIES', 5)
+WRITE_BEHIND_MAX_QUEUE = getattr(settings, 'CHAT_WRITE_BEHIND_MAX_QUEUE', 5000)
+
+# Errors that retrying the same row can never fix
+PERMANENT_ERRORS = (IntegrityError, DataError)
+
+# (conversation_id, message, failed attempts)
+QueuedMessage = Tuple[int, Dict[str, Any], int]
+
+
+class MessageWriteBehind:
+    """In-process queue of unsaved messages flushed in batches"""
+
+    def __init__(self, enabled: bool = WRITE_BEHIND_ENABLED, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 interval: float = WRITE_BEHIND_INTERVAL, max_retries: int = WRITE_BEHIND_MAX_RETRIES,
+                 max_queue: int = WRITE_BEHIND_MAX_QUEUE, clock=time.monotonic):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+        self._clock = clock
+        self._queue: List[QueuedMessage] = []
+        self._oldest: Optional[float] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._timer: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def pending(self, conversation_id: int) -> List[Dict[str, str]]:
+        """Queued messages of one conversation, formatted like history buffer entries."""
+        return [
+            {'role': message['role'], 'content': message['content']}
+            for queued_id, message, _ in self._queue if queued_id == conversation_id
+        ]
+
+    async def enqueue(self, conversation_id: int, messages: List[Dict[str, Any]]):
+        if not messages:
+            return
+        if self._oldest is None:
+            self._oldest = self._clock()
+        self._queue.extend((conversation_id, message, 0) for message in messages)
+
+        if len(self._queue) >= self.batch_size or self._clock() - self._oldest >= self.interval:
+            await self.flush()
+        else:
+            self._schedule_timer()
+        self._drop_overflow()
+
+    def _drop_overflow(self):
+        overflow = len(self._queue) - self.max_queue
+        if overflow > 0:
+            self._dead_letter(self._queue[:overflow], "write-behind queue is full")
+            del self._queue[:overflow]
+
+    def _schedule_timer(self):
+        """Flush after the interval if this event loop lives that long (e.g. under an ASGI server)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._timer is not None and not self._timer.done() and self._timer.get_loop() is loop:
+            return
+        self._timer = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self) -> int:
+        """Write every queued message; returns how many were stored."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            # Moving messages from the queue to the table is a write as far as history readers can tell
+            started = {
+                conversation_id: await history_buffer.abegin_write(conversation_id)
+                for conversation_id in dict.fromkeys(queued_id for queued_id, _, _ in self._queue)
+            }
+            batch, self._queue = self._queue, []
+            self._oldest = None
+            if not batch:
+                return 0
+            try:
+                written, dead = await sync_to_async(self._write_isolating, thread_sensitive=True)(batch)
+            except Exception as e:
+                retry = [(conversation_id, message, attempts + 1) for conversation_id, message, attempts in batch]
+                exhausted = [item for item in retry if item[2] >= self.max_retries]
+                self._dead_letter(exhausted, f"flush failed {self.max_retries} times: {e}")
+                retry = [item for item in retry if item[2] < self.max_retries]
+                logger.error(f"Write-behind flush of {len(batch)} messages failed, requeued {len(retry)}: {e}")
+                self._queue[:0] = retry
+                self._oldest = self._clock() if self._queue else None
+                self._drop_overflow()
+                return 0
+            self._dead_letter(dead, "cannot be stored")
+            for conversation_id, generation in started.items():
+                # The buffer already holds these messages from enqueue time; only its generation moves on
+                await history_buffer.aappend(conversation_id, [], generation)
+            logger.debug(f"Write-behind flushed {written} messages")
+            return written
+
+    def _write_isolating(self, batch: List[QueuedMessage]) -> Tuple[int, List[QueuedMessage]]:
+        """
+        Write a batch, narrowing down to single conversations and then single
+        messages when it hits a permanent error. Returns the number written and
+        the messages that can never be written. Other errors propagate, so the
+        whole batch is retried.
+        """
+        existing = set(Conversation.objects.filter(
+            pk__in={conversation_id for conversation_id, _, _ in batch}
+        ).values_list('pk', flat=True))
+        dead = [item for item in batch if item[0] not in existing]
+        rows = [item for item in batch if item[0] in existing]
+        try:
+            self._write([(conversation_id, message) for conversation_id, message, _ in rows])
+            return len(rows), dead
+        except PERMANENT_ERRORS as e:
+            logger.warning(f"Write-behind batch hit {e!r}, retrying per conversation")
+
+        written = 0
+        by_conversation = defaultdict(list)
+        for item in rows:
+            by_conversation[item[0]].append(item)
+        for items in by_conversation.values():
+            try:
+                self._write([(conversation_id, message) for conversation_id, message, _ in items])
+                written += len(items)
+                continue
+            except PERMANENT_ERRORS:
+                pass
+            for conversation_id, message, attempts in items:
+                try:
+                    self._write([(conversation_id, message)])
+                    written += 1
+                except PERMANENT_ERRORS:
+                    dead.append((conversation_id, message, attempts))
+        return written, dead
+
+    @staticmethod
+    def _dead_letter(items: List[QueuedMessage], reason: str):
+        for conversation_id, message, attempts in items:
+            logger.error(
+                f"Write-behind dropped a {message['role']} message of conversation {conversation_id} "
+                f"({reason}, {attempts} failed attempts): {message['content'][:100]!r}"
+            )
+
+    @staticmethod
+    def _write(batch: List[Tuple[int, Dict[str, Any]]]):
+        with transaction.atomic():
+            created = Message.objects.bulk_create([
+                Message(
+                    conversation_id=conversation_id,
+                    role=message['role'],
+                    content=message['content'],
+                    metadata=message.get('metadata') or {}
+                )
+                for conversation_id, message in batch
+            ])
+            by_conversation = defaultdict(list)
+            for message in created:
+                by_conversation[message.conversation_id].append(message)
+            for conversation_id, messages in by_conversation.items():
+                Conversation.record_messages(conversation_id, messages)
+
+    async def aclose(self):
+        """Flush whatever is left; called on lifespan shutdown."""
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        self._timer = None
+        await self.flush()
+        if self._queue:
+            logger.error(f"Write-behind shutdown left {len(self._queue)} unsaved messages")
+
+
+message_write_behind = MessageWriteBehind()
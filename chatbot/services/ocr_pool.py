@@ -0,0 +1,225 @@
+"""
+Out-of-process OCR execution pool for receipt processing.
+
+EasyOCR is CPU-bound and its reader holds a few hundred MB of model weights.
+Running it inline blocks the calling worker for the whole receipt, and every
+web or Celery process that touches OCR ends up with its own copy of the model.
+Instead, OCR runs in a small ``spawn`` process pool shared by the host
+process. Each pool process loads the reader once, in its initializer. Callers
+send encoded image bytes or a decoded pixel array and get back the recognised
+lines with their bounding boxes. Throughput scales with ``OCR_POOL_WORKERS`` and memory does not grow
+with the number of web workers.
+
+Receipts are OCR'd by ``process_receipt_task``, which is routed to its own
+Celery queue (``OCR_CELERY_QUEUE``). Run one worker for that queue with a
+thread pool, e.g. ``celery -A core worker -Q ocr --pool threads
+--concurrency 4``: its task threads share this process's OCR pool, so the
+machine holds exactly ``OCR_POOL_WORKERS`` readers however many receipts are
+in flight. Other workers should consume only the default queue.
+
+``OCR_POOL_WORKERS = 0`` runs OCR inline in the calling process. Daemonic
+processes (Celery prefork children) may not start children of their own, so
+they fall back to inline OCR too, each loading its own reader; that fallback
+is logged as a warning because it means OCR reached a prefork worker.
+
+The compute device comes from ``OCR_DEVICE``: ``cpu``, ``gpu`` or ``auto``
+(CUDA if torch sees a device). It is resolved inside the OCR process, so the
+web process never imports torch. On CPU the reader uses EasyOCR's dynamically
+quantized models (``OCR_QUANTIZE``). Torch is limited to ``OCR_TORCH_THREADS``
+threads per OCR process; by default the cores are split evenly between pool
+processes so they do not oversubscribe the machine.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+
+from django.conf import settings
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+OCR_POOL_WORKERS = getattr(settings, 'OCR_POOL_WORKERS', min(2, os.cpu_count() or 1))
+OCR_POOL_MAX_PENDING = getattr(settings, 'OCR_POOL_MAX_PENDING', 16)
+OCR_TIMEOUT = getattr(settings, 'OCR_TIMEOUT', 120)
+OCR_LANGUAGES = getattr(settings, 'OCR_LANGUAGES', ['pl', 'en'])
+OCR_DEVICE = getattr(settings, 'OCR_DEVICE', 'auto')
+OCR_QUANTIZE = getattr(settings, 'OCR_QUANTIZE', True)
+OCR_TORCH_THREADS = getattr(settings, 'OCR_TORCH_THREADS', 0)  # 0 = cores / pool processes
+OCR_CANVAS_SIZE = getattr(settings, 'OCR_CANVAS_SIZE', 2560)  # longest side fed to the text detector
+OCR_CELERY_QUEUE = getattr(settings, 'OCR_CELERY_QUEUE', 'ocr')
+
+OCR_DEVICES = ('auto', 'cpu', 'gpu')
+
+# Arrays are pickled straight into the pool's pipe, so no disk I/O either way
+OCRImage = Union[bytes, 'np.ndarray']
+
+
+@dataclass(frozen=True)
+class OCRLine:
+    """One recognised text fragment with its quadrilateral bounding box"""
+    text: str
+    confidence: float
+    bbox: Tuple[Tuple[float, float], ...]
+
+
+@dataclass(frozen=True)
+class OCRConfig:
+    """Reader options sent to every OCR process"""
+    languages: Tuple[str, ...] = tuple(OCR_LANGUAGES)
+    device: str = OCR_DEVICE
+    quantize: bool = OCR_QUANTIZE
+    torch_threads: int = OCR_TORCH_THREADS
+    canvas_size: int = OCR_CANVAS_SIZE
+
+    def __post_init__(self):
+        if self.device not in OCR_DEVICES:
+            raise ValueError(f"OCR device must be one of {OCR_DEVICES}, got {self.device!r}")
+
+
+def resolve_device(device: str) -> str:
+    """Map 'auto'/'gpu' to the device actually usable in this process."""
+    if device == 'cpu':
+        return 'cpu'
+    import torch
+
+    if torch.cuda.is_available():
+        return 'gpu'
+    if device == 'gpu':
+        logger.warning("OCR_DEVICE is 'gpu' but CUDA is not available, using the CPU")
+    return 'cpu'
+
+
+# Per-process reader and readtext options, created by _init_worker in each pool process (or inline)
+_reader = None
+_readtext_options = {}
+
+
+def _init_worker(config: OCRConfig):
+    global _reader, _readtext_options
+    import easyocr  # pulls in torch; only OCR processes pay for it
+    import torch
+
+    device = resolve_device(config.device)
+    if config.torch_threads > 0:
+        torch.set_num_threads(config.torch_threads)
+    _reader = easyocr.Reader(
+        list(config.languages),
+        gpu=device == 'gpu',
+        quantize=config.quantize,
+        verbose=False,
+    )
+    _readtext_options = {'canvas_size': config.canvas_size}
+    logger.info(
+        f"OCR reader loaded in process {os.getpid()} on {device} "
+        f"({torch.get_num_threads()} torch threads, quantize={config.quantize})"
+    )
+
+
+def _read_image(image: OCRImage) -> List[Tuple[str, float, Tuple[Tuple[float, float], ...]]]:
+    """Run OCR on an encoded image or pixel array; plain tuples keep the result cheap to pickle."""
+    return [
+        (text, float(confidence), tuple((float(x), float(y)) for x, y in bbox))
+        for bbox, text, confidence in _reader.readtext(image, **_readtext_options)
+    ]
+
+
+class OCRPool:
+    """Bounded process pool with one EasyOCR reader per process"""
+
+    def __init__(self, workers: int = OCR_POOL_WORKERS, max_pending: int = OCR_POOL_MAX_PENDING,
+                 config: Optional[OCRConfig] = None):
+        self.workers = workers
+        self.config = config or OCRConfig()
+        if self.config.torch_threads <= 0:
+            # Split the cores between pool processes instead of letting each grab all of them
+            threads = max(1, (os.cpu_count() or 1) // max(workers, 1))
+            self.config = replace(self.config, torch_threads=threads)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Submissions beyond max_pending wait here instead of piling up in the executor queue
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._warned_daemon = False
+
+    @property
+    def inline(self) -> bool:
+        if self.workers <= 0:
+            return True
+        if multiprocessing.current_process().daemon:
+            if not self._warned_daemon:
+                self._warned_daemon = True
+                logger.warning(
+                    f"OCR runs inline in daemonic process {os.getpid()}, which loads a reader of its own; "
+                    f"route receipts to the '{OCR_CELERY_QUEUE}' queue served by a --pool threads worker"
+                )
+            return True
+        return False
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.config,),
+                )
+                logger.info(f"Started OCR pool with {self.workers} processes")
+            return self._executor
+
+    def submit(self, image: OCRImage) -> Future:
+        """
+        Queue an image (PNG/JPEG bytes or HxW / HxWxC uint8 array) and return a future
+        for its raw OCR tuples; pass it to result(). In inline mode the OCR runs
+        now and the returned future is already done. An array must stay valid
+        until its future is done, since it is pickled in the background.
+        """
+        if self.inline:
+            future = Future()
+            try:
+                with self._lock:
+                    if _reader is None:
+                        _init_worker(self.config)
+                    future.set_result(_read_image(image))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        self._slots.acquire()
+        try:
+            future = self._get_executor().submit(_read_image, image)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def result(self, future: Future, timeout: Optional[float] = OCR_TIMEOUT) -> List[OCRLine]:
+        """Wait for a submitted image and return its lines."""
+        try:
+            raw = future.result(timeout=timeout)
+        except BrokenProcessPool:
+            # A crashed process (e.g. OOM) breaks the executor; start a fresh one next time
+            logger.error("OCR pool broke, restarting it on the next request")
+            self.shutdown(wait=False)
+            raise
+        return [OCRLine(text=text, confidence=confidence, bbox=bbox) for text, confidence, bbox in raw]
+
+    def readtext(self, image: OCRImage, timeout: Optional[float] = OCR_TIMEOUT) -> List[OCRLine]:
+        """OCR one image in the pool (or inline) and wait for the result."""
+        return self.result(self.submit(image), timeout=timeout)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+ocr_pool = OCRPool()
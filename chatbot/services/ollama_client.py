@@ -0,0 +1,107 @@
+"""
+Process-wide, pooled HTTP client for the Ollama API.
+
+Every agent instance and the RAG retriever share one keep-alive connection
+pool per Ollama endpoint instead of opening a fresh ``httpx.AsyncClient``
+(and TCP connection) for every request. httpx connections belong to the event
+loop that opened them, so pools are kept per running loop; the ASGI lifespan
+handler closes them on shutdown via ``aclose_ollama_clients``.
+
+Pooling therefore only pays off with a long-lived event loop, i.e. when the
+app is served by an ASGI server (``uvicorn core.asgi:application``). Under
+``manage.py runserver`` or another WSGI server every async view runs in a
+fresh loop (asgiref's ``asyncio.run``), so a client lives for one request.
+Such clients are closed when their loop finishes, so sockets are not leaked,
+but connections are not reused between requests either.
+"""
+import asyncio
+import logging
+import weakref
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_URL = getattr(settings, 'OLLAMA_URL', 'http://localhost:11434')
+MAX_CONNECTIONS = getattr(settings, 'OLLAMA_HTTP_MAX_CONNECTIONS', 20)
+MAX_KEEPALIVE_CONNECTIONS = getattr(settings, 'OLLAMA_HTTP_MAX_KEEPALIVE_CONNECTIONS', 10)
+KEEPALIVE_EXPIRY = getattr(settings, 'OLLAMA_HTTP_KEEPALIVE_EXPIRY', 30.0)
+# Requests pass their own timeouts; this only bounds connection setup from the pool
+CONNECT_TIMEOUT = getattr(settings, 'OLLAMA_HTTP_CONNECT_TIMEOUT', 5.0)
+
+
+def _http2_available() -> bool:
+    if not getattr(settings, 'OLLAMA_HTTP2', True):
+        return False
+    try:
+        import h2  # noqa: F401  (optional dependency of httpx[http2])
+        return True
+    except ImportError:
+        return False
+
+
+HTTP2 = _http2_available()
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+# Loops with a task waiting to close their clients; the tasks themselves are kept alive here
+_watched_loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
+_closer_tasks = set()
+
+
+async def _close_clients_when_loop_stops():
+    """Sleep until cancelled; asyncio.run() cancels leftover tasks right before it closes the loop."""
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        await aclose_ollama_clients()
+
+
+def _watch_loop(loop: asyncio.AbstractEventLoop):
+    if loop in _watched_loops:
+        return
+    _watched_loops.add(loop)
+    task = loop.create_task(_close_clients_when_loop_stops())
+    _closer_tasks.add(task)
+    task.add_done_callback(_closer_tasks.discard)
+
+
+def get_ollama_client(base_url: Optional[str] = None) -> httpx.AsyncClient:
+    """Return the shared client for base_url on the running event loop, creating it on first use."""
+    base_url = (base_url or DEFAULT_OLLAMA_URL).rstrip('/')
+    loop = asyncio.get_running_loop()
+    loop_clients = _clients.setdefault(loop, {})
+    client = loop_clients.get(base_url)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            http2=HTTP2,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(60.0, connect=CONNECT_TIMEOUT),
+        )
+        loop_clients[base_url] = client
+        _watch_loop(loop)
+        logger.info(f"Opened pooled Ollama client for {base_url} (http2={HTTP2})")
+    return client
+
+
+async def aclose_ollama_clients():
+    """Close every pooled client that belongs to the running event loop."""
+    loop_clients = _clients.pop(asyncio.get_running_loop(), {})
+    for base_url, client in loop_clients.items():
+        await client.aclose()
+        logger.info(f"Closed pooled Ollama client for {base_url}")
+
+
+async def aembed(texts: Sequence[str], model: str, base_url: Optional[str] = None) -> List[List[float]]:
+    """Embed texts with Ollama's batch /api/embed endpoint over the shared pool."""
+    response = await get_ollama_client(base_url).post(
+        "/api/embed", json={"model": model, "input": list(texts)}, timeout=60.0
+    )
+    response.raise_for_status()
+    return response.json()['embeddings']
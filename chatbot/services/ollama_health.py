@@ -0,0 +1,132 @@
+"""
+Passive health tracking for Ollama endpoints with a circuit breaker.
+
+Instead of probing ``/api/tags`` before every LLM request, agents ask the
+breaker whether a request may go out and report how real requests ended:
+
+- CLOSED: requests flow; consecutive failures are counted.
+- OPEN: after ``failure_threshold`` failures requests are refused immediately
+  (callers use their fallback) until ``recovery_timeout`` has passed.
+- HALF_OPEN: a single trial request is let through; success closes the
+  circuit, failure opens it again.
+
+Explicit health probes are cached for ``health_ttl`` seconds and feed the
+same state.
+"""
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = getattr(settings, 'OLLAMA_CIRCUIT_FAILURE_THRESHOLD', 3)
+RECOVERY_TIMEOUT = getattr(settings, 'OLLAMA_CIRCUIT_RECOVERY_TIMEOUT', 30.0)
+HEALTH_TTL = getattr(settings, 'OLLAMA_HEALTH_TTL', 30.0)
+
+
+class CircuitState(Enum):
+    """Circuit breaker states"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class OllamaHealth:
+    """Circuit breaker and TTL-cached health state for one Ollama endpoint"""
+
+    def __init__(
+        self,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        recovery_timeout: float = RECOVERY_TIMEOUT,
+        health_ttl: float = HEALTH_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.health_ttl = health_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_started_at: Optional[float] = None
+        self.last_checked_at: Optional[float] = None
+        self.last_healthy: Optional[bool] = None
+
+    def allow_request(self) -> bool:
+        """Whether a request to Ollama should be attempted right now."""
+        with self._lock:
+            now = self._clock()
+            if self.state == CircuitState.CLOSED:
+                return True
+            if self.state == CircuitState.OPEN:
+                if now - self.opened_at < self.recovery_timeout:
+                    return False
+                self.state = CircuitState.HALF_OPEN
+                self.trial_started_at = now
+                logger.info("Ollama circuit half-open, letting a trial request through")
+                return True
+            # HALF_OPEN: one trial at a time; a trial that never reported back expires
+            if now - self.trial_started_at >= self.recovery_timeout:
+                self.trial_started_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CircuitState.CLOSED:
+                logger.info("Ollama is reachable again, closing circuit")
+            self.state = CircuitState.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.trial_started_at = None
+            self.last_checked_at = self._clock()
+            self.last_healthy = True
+
+    def record_failure(self):
+        with self._lock:
+            now = self._clock()
+            self.consecutive_failures += 1
+            self.last_checked_at = now
+            self.last_healthy = False
+            if self.state == CircuitState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != CircuitState.OPEN:
+                    logger.warning(
+                        f"Opening Ollama circuit after {self.consecutive_failures} consecutive failures"
+                    )
+                self.state = CircuitState.OPEN
+                self.opened_at = now
+                self.trial_started_at = None
+
+    def cached_health(self) -> Optional[bool]:
+        """Last known health if it is younger than health_ttl, otherwise None."""
+        with self._lock:
+            if self.last_checked_at is None or self._clock() - self.last_checked_at > self.health_ttl:
+                return None
+            return self.last_healthy
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self.state.value,
+                'consecutive_failures': self.consecutive_failures,
+                'last_healthy': self.last_healthy,
+            }
+
+
+_health_by_url: Dict[str, OllamaHealth] = {}
+_registry_lock = threading.Lock()
+
+
+def get_ollama_health(base_url: str) -> OllamaHealth:
+    """Process-wide health state for an Ollama endpoint."""
+    base_url = base_url.rstrip('/')
+    with _registry_lock:
+        health = _health_by_url.get(base_url)
+        if health is None:
+            health = _health_by_url[base_url] = OllamaHealth()
+        return health
@@ -0,0 +1,105 @@
+"""
+Cache of RouterAgent tool decisions keyed on normalized message text.
+
+LLM-based routing costs a full few-shot round-trip to Ollama, so decisions
+are remembered per (model, normalized message). A small in-process LRU sits
+in front of the shared Django cache: repeats within one worker never leave
+the process, and other workers still benefit through Redis. Both layers
+expire entries after ``ROUTER_CACHE_TTL`` seconds.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+ROUTER_CACHE_TTL = getattr(settings, 'ROUTER_CACHE_TTL', 3600)
+ROUTER_CACHE_MAX_ENTRIES = getattr(settings, 'ROUTER_CACHE_MAX_ENTRIES', 1000)
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(text: str) -> str:
+    """Case-fold, drop punctuation and collapse whitespace so near-identical queries share a key."""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = _PUNCTUATION.sub(' ', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class RoutingDecisionCache:
+    """Two-level (local LRU + Django cache) store of routing decisions"""
+
+    key_prefix = 'router_decision'
+
+    def __init__(
+        self,
+        max_entries: int = ROUTER_CACHE_MAX_ENTRIES,
+        ttl: float = ROUTER_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, message: str, model: str) -> str:
+        digest = hashlib.sha256(normalize_message(message).encode('utf-8')).hexdigest()[:32]
+        return f"{self.key_prefix}:{model}:{digest}"
+
+    def _get_local(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            tool, expires_at = entry
+            if self._clock() >= expires_at:
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return tool
+
+    def _set_local(self, key: str, tool: str):
+        with self._lock:
+            self._local[key] = (tool, self._clock() + self.ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    async def aget(self, message: str, model: str) -> Optional[str]:
+        key = self.make_key(message, model)
+        tool = self._get_local(key)
+        if tool is not None:
+            return tool
+        try:
+            tool = await cache.aget(key)
+        except Exception as e:
+            logger.warning(f"Routing cache lookup failed: {e}")
+            return None
+        if tool is not None:
+            self._set_local(key, tool)
+        return tool
+
+    async def aset(self, message: str, model: str, tool: str):
+        key = self.make_key(message, model)
+        self._set_local(key, tool)
+        try:
+            await cache.aset(key, tool, timeout=int(self.ttl))
+        except Exception as e:
+            logger.warning(f"Routing cache store failed: {e}")
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+
+routing_cache = RoutingDecisionCache()
@@ -0,0 +1,180 @@
+"""
+Compiled rule matcher for RouterAgent's regex routing tier.
+
+Almost every routing rule is a word-bounded list of literal keywords, e.g.
+``\b(pogoda|temperatur[ae]|deszcz)\b``. Those rules are expanded once into
+plain keywords, and a message is screened with C-level substring checks; the
+word-boundary regex only runs for keywords that actually occur. Python's
+``re`` cannot skip ahead on a pattern starting with ``\b(``, so this is much
+cheaper than searching every rule. Rules that are real regular expressions
+(``jaka.*pogoda``) stay precompiled regexes, screened the same way by the
+literal prefix of each alternative, and greetings keep their plain substring
+semantics.
+
+``match`` reports every tool whose rules fire, with a score, instead of
+stopping at the first hit. Compiled matchers are cached by their rules, so
+agents built per request from the same config share one compiled matcher.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+DEFAULT_ROUTING_PATTERNS: Dict[str, List[str]] = {
+    'weather_service': [
+        r'\b(pogoda|temperatur[ae]|deszcz|słońce|chłodno|ciepło|wiatr|śnieg)\b',
+        r'\b(jaka.*pogoda|jak.*pogoda|czy.*pada|czy.*świeci)\b'
+    ],
+    'web_search': [
+        r'\b(wyszukaj|znajdź|poszukaj|sprawdź w internecie|googluj)\b',
+        r'\b(najnowsze|aktualn[ey]|co nowego|informacj[ae])\b'
+    ],
+    'pantry_management': [
+        r'\b(spiżarni[ae]|lodówc[ae]|produkty|jedzeni[ae]|co mam)\b',
+        r'\b(ile mam|czy mam|lista produktów)\b'
+    ],
+    'rag_search': [
+        r'\b(dokument|plik|pdf|tekst|treść|przeczytaj)\b',
+        r'\b(co jest w|opowiedz o|znajdź w dokumencie)\b'
+    ]
+}
+
+DEFAULT_GREETINGS: List[str] = ['cześć', 'hej', 'witam', 'dzień dobry', 'hi', 'hello', 'jak się masz']
+
+GREETING_TOOL = 'general_conversation'
+
+
+@dataclass(frozen=True)
+class RouteMatch:
+    """A tool whose rules matched, with the share of its patterns that did"""
+    tool: str
+    score: float
+    matched_patterns: int
+
+
+_WORD = re.compile(r'\w+')
+_KEYWORD_RULE = re.compile(r'^\\b\(([^()]*)\)\\b$')
+_LITERAL_PART = re.compile(r'\[([\w]+)\]|([\w ]+)')
+
+
+def _expand_literal(alternative: str) -> Optional[List[str]]:
+    """Expand 'temperatur[ae]' into ['temperatura', 'temperature']; None if not a plain literal."""
+    if not alternative or not re.fullmatch(r'(?:\[\w+\]|[\w ])+', alternative):
+        return None
+    expansions = ['']
+    for char_class, text in _LITERAL_PART.findall(alternative):
+        options = list(char_class) if char_class else [text]
+        expansions = [prefix + option for prefix in expansions for option in options]
+    # \b on both sides only equals token boundaries when the keyword starts and ends with a word character
+    if any(not (_WORD.match(e[0]) and _WORD.match(e[-1])) for e in expansions):
+        return None
+    return expansions
+
+
+class RoutingMatcher:
+    """All routing rules compiled up front; tools are ranked by rule order"""
+
+    def __init__(self, patterns: Mapping[str, Sequence[str]], greetings: Sequence[str] = ()):
+        self.priority: List[str] = list(patterns)
+        self.greetings = [greeting.lower() for greeting in greetings]
+        if self.greetings and GREETING_TOOL not in self.priority:
+            self.priority.append(GREETING_TOOL)
+
+        self._pattern_counts: Dict[str, int] = {}
+        # (keyword, rule id, word-bounded regex for the keyword)
+        self._keywords: List[Tuple[str, int, 're.Pattern']] = []
+        # (rule id, regex, literal prefixes of which at least one must occur, or None)
+        self._regexes: List[Tuple[int, 're.Pattern', Optional[List[str]]]] = []
+        self._rule_tools: List[str] = []
+        for tool, tool_patterns in patterns.items():
+            for pattern in tool_patterns:
+                rule_id = len(self._rule_tools)
+                self._rule_tools.append(tool)
+                self._pattern_counts[tool] = self._pattern_counts.get(tool, 0) + 1
+                keywords = self._keyword_expansion(pattern)
+                if keywords is None:
+                    self._regexes.append((rule_id, re.compile(pattern), self._literal_prefixes(pattern)))
+                    continue
+                for keyword in keywords:
+                    self._keywords.append((keyword, rule_id, re.compile(rf'\b{re.escape(keyword)}\b')))
+        if self.greetings:
+            self._pattern_counts[GREETING_TOOL] = self._pattern_counts.get(GREETING_TOOL, 0) + 1
+
+    @staticmethod
+    def _keyword_expansion(pattern: str) -> Optional[List[str]]:
+        rule = _KEYWORD_RULE.match(pattern)
+        if not rule:
+            return None
+        keywords = []
+        for alternative in rule.group(1).split('|'):
+            expanded = _expand_literal(alternative)
+            if expanded is None:
+                return None
+            keywords.extend(expanded)
+        return keywords
+
+    @staticmethod
+    def _literal_prefixes(pattern: str) -> Optional[List[str]]:
+        """Leading literal text of every alternative of a keyword-style rule, if each has one."""
+        rule = _KEYWORD_RULE.match(pattern)
+        if not rule:
+            return None
+        prefixes = []
+        for alternative in rule.group(1).split('|'):
+            prefix = re.match(r'[\w ]*', alternative).group()
+            # A prefix followed by a quantifier is not actually required
+            if not prefix or alternative[len(prefix):len(prefix) + 1] in ('*', '?', '{'):
+                return None
+            prefixes.append(prefix)
+        return prefixes
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> 'RoutingMatcher':
+        """Matcher for an agent config's 'routing_patterns' / 'routing_greetings', else the defaults."""
+        patterns = config.get('routing_patterns') or DEFAULT_ROUTING_PATTERNS
+        greetings = config.get('routing_greetings')
+        if greetings is None:
+            greetings = DEFAULT_GREETINGS
+        return _compiled_matcher(
+            tuple((tool, tuple(tool_patterns)) for tool, tool_patterns in patterns.items()),
+            tuple(greetings),
+        )
+
+    def _matching_rules(self, text: str) -> set:
+        matched = set()
+        for keyword, rule_id, bounded in self._keywords:
+            if keyword in text and rule_id not in matched and bounded.search(text):
+                matched.add(rule_id)
+        for rule_id, regex, prefixes in self._regexes:
+            if prefixes is not None and not any(prefix in text for prefix in prefixes):
+                continue
+            if regex.search(text):
+                matched.add(rule_id)
+        return matched
+
+    def match(self, message: str) -> List[RouteMatch]:
+        """Every tool with at least one matching rule, in priority order."""
+        text = message.lower()
+        hits: Dict[str, int] = {}
+        for rule_id in self._matching_rules(text):
+            tool = self._rule_tools[rule_id]
+            hits[tool] = hits.get(tool, 0) + 1
+        # Greetings match as plain substrings, like the original keyword scan
+        for greeting in self.greetings:
+            if greeting in text:
+                hits[GREETING_TOOL] = hits.get(GREETING_TOOL, 0) + 1
+                break
+        return [
+            RouteMatch(tool=tool, score=hits[tool] / self._pattern_counts[tool], matched_patterns=hits[tool])
+            for tool in self.priority if tool in hits
+        ]
+
+    def best(self, message: str) -> Optional[str]:
+        """The highest-priority matching tool, or None."""
+        matches = self.match(message)
+        return matches[0].tool if matches else None
+
+
+@lru_cache(maxsize=32)
+def _compiled_matcher(patterns: Tuple[Tuple[str, Tuple[str, ...]], ...], greetings: Tuple[str, ...]) -> RoutingMatcher:
+    return RoutingMatcher(dict(patterns), greetings)
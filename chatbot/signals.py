@@ -0,0 +1,50 @@
+"""
+Signal handlers for the chatbot app.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Agent, Conversation, Message, messages_deleted
+
+
+@receiver(post_save, sender=Agent)
+@receiver(post_delete, sender=Agent)
+def invalidate_cached_agent(sender, instance, **kwargs):
+    """Make every worker rebuild the agent on its next message after a config change."""
+    from .services.agent_factory import agent_factory
+    # Bumping inside the transaction would let another worker cache the old row under the new version
+    transaction.on_commit(partial(agent_factory.invalidate_agent, instance.name, agent_pk=instance.pk))
+
+
+@receiver(post_save, sender=Message)
+def invalidate_history_buffer(sender, instance, created=False, **kwargs):
+    """Edited messages make the cached history tail stale; new ones are appended by the writers."""
+    if created:
+        return
+    from .services.history_buffer import history_buffer
+    history_buffer.delete(instance.conversation_id)
+
+
+@receiver(messages_deleted, sender=Message)
+def invalidate_history_buffers(sender, conversation_ids, **kwargs):
+    from .services.history_buffer import history_buffer
+    for conversation_id in conversation_ids:
+        history_buffer.delete(conversation_id)
+
+
+@receiver(post_delete, sender=Conversation)
+def drop_deleted_conversation_buffer(sender, instance, **kwargs):
+    """One buffer drop per conversation; its messages are fast-deleted without signals."""
+    from .services.history_buffer import history_buffer
+    history_buffer.delete(instance.pk)
+
+
+@receiver(post_save, sender=Message)
+def count_created_message(sender, instance, created=False, **kwargs):
+    """Single-message saves bump the conversation counters; bulk writers call record_messages themselves."""
+    if created:
+        Conversation.record_messages(instance.conversation_id, [instance])
+
@@ -1,7 +1,9 @@
 from celery import shared_task
 from .rag_processor import rag_processor
 from .receipt_processor import receipt_processor
-from .models import Document, ReceiptProcessing
+from .models import Conversation, Document, ReceiptProcessing
+from .services.context_builder import HISTORY_TOKEN_BUDGET, messages_to_summarize, summarize_messages
+from django.core.cache import cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,3 +27,32 @@ def process_receipt_task(receipt_id):
         logger.error(f"Error processing receipt {receipt_id} by Celery task: {e}", exc_info=True)
         # Optionally update receipt status to error
         ReceiptProcessing.objects.filter(id=receipt_id).update(status='error', error_message=str(e))
+
+@shared_task
+def summarize_conversation_task(conversation_id, history_budget=None):
+    """Fold the oldest unsummarized messages into Conversation.summary, keeping a recent tail in tokens."""
+    try:
+        conversation = Conversation.objects.select_related('agent').get(id=conversation_id)
+        unsummarized = list(
+            conversation.messages.after(conversation.summarized_through_at, conversation.summarized_through_id)
+            .order_by('created_at', 'id').values('id', 'created_at', 'role', 'content')
+        )
+        pending = messages_to_summarize(unsummarized, history_budget or HISTORY_TOKEN_BUDGET)
+        if pending <= 0:
+            return
+        messages = unsummarized[:pending]
+        agent_config = conversation.agent.config or {}
+        conversation.summary = summarize_messages(
+            conversation.summary, messages,
+            model=agent_config.get('model', 'llama3'),
+            base_url=agent_config.get('ollama_url'),
+        )
+        conversation.summarized_through_at = messages[-1]['created_at']
+        conversation.summarized_through_id = messages[-1]['id']
+        conversation.save(update_fields=['summary', 'summarized_through_at', 'summarized_through_id'])
+        logger.info(f"Summarized {len(messages)} messages of conversation {conversation_id} "
+                    f"({len(unsummarized) - len(messages)} newer messages left out of the summary).")
+    except Exception as e:
+        logger.error(f"Error summarizing conversation {conversation_id} by Celery task: {e}", exc_info=True)
+    finally:
+        cache.delete(f"conversation_summary_pending:{conversation_id}")
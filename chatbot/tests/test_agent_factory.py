@@ -0,0 +1,83 @@
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from chatbot.models import Agent
+from chatbot.services.agent_factory import AgentFactory, _version_key, agent_factory
+
+
+@pytest.mark.unit
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AgentInstanceCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = AgentFactory()
+        self.agent = Agent.objects.create(
+            name="Router Agent",
+            agent_type="router",
+            persona_prompt="You are a helpful router",
+            config={'model': 'llama3'},
+            is_active=True
+        )
+
+    async def save_and_commit(self, instance):
+        """Save and run the on_commit hooks, as a real (non-test) transaction would"""
+        def save():
+            with self.captureOnCommitCallbacks(execute=True):
+                instance.save()
+        await sync_to_async(save)()
+
+    def test_reuses_instance_without_queries(self):
+        """After the first turn, loading the agent does not touch the database"""
+        load = async_to_sync(self.factory.create_agent_from_db)
+        first = load("Router Agent")
+
+        with self.assertNumQueries(0):
+            second = load("Router Agent")
+
+        self.assertIs(first, second)
+
+    async def test_config_change_in_another_process_rebuilds_agent(self):
+        """A version bump in the shared cache is picked up by every factory"""
+        first = await self.factory.create_agent_from_db("Router Agent")
+
+        self.agent.config = {'model': 'mistral'}
+        await self.save_and_commit(self.agent)  # post_save bumps the shared version on commit
+        second = await self.factory.create_agent_from_db("Router Agent")
+
+        self.assertIsNot(first, second)
+        self.assertEqual(second.model, 'mistral')
+
+    async def test_post_save_drops_local_instance(self):
+        first = await agent_factory.create_agent_from_db("Router Agent")
+
+        self.agent.persona_prompt = "Changed"
+        await self.save_and_commit(self.agent)
+
+        self.assertNotIn("Router Agent", agent_factory._db_agents)
+        second = await agent_factory.create_agent_from_db("Router Agent")
+        self.assertIsNot(first, second)
+        self.assertEqual(second.persona_prompt, "Changed")
+
+    async def test_deactivated_agent_is_not_served_from_cache(self):
+        await self.factory.create_agent_from_db("Router Agent")
+
+        self.agent.is_active = False
+        await self.save_and_commit(self.agent)
+
+        with self.assertRaises(ValueError):
+            await self.factory.create_agent_from_db("Router Agent")
+
+    def test_version_is_bumped_after_commit(self):
+        """Until the save commits, other workers keep the old version (and the old row)"""
+        version = cache.get(_version_key("Router Agent"))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.agent.config = {'model': 'mistral'}
+            self.agent.save()
+            self.assertEqual(cache.get(_version_key("Router Agent")), version)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(cache.get(_version_key("Router Agent")), version)
@@ -0,0 +1,529 @@
+import asyncio
+import json
+import os
+import tempfile
+import httpx
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from chatbot.interfaces import IntentData
+from chatbot.models import PantryItem
+from chatbot.services.agents import OllamaAgent, RouterAgent
+from chatbot.services.async_services import AsyncPantryService, product_name_stems
+from chatbot.services.context_builder import trim_history
+from chatbot.services.intent_classifier import IntentClassifier
+from chatbot.services.ollama_client import aclose_ollama_clients, get_ollama_client
+from chatbot.services.ollama_health import CircuitState, OllamaHealth
+from chatbot.management.commands.benchmark_router import SAMPLE_MESSAGES, legacy_route
+from chatbot.services.routing_cache import RoutingDecisionCache, routing_cache
+from chatbot.services.routing_matcher import RoutingMatcher
+from chatbot.utils.embedding_cache import EmbeddingCache
+
+
+@pytest.mark.unit
+class OllamaClientPoolTest(TestCase):
+    async def test_agents_share_one_pooled_client(self):
+        """All agents talking to the same endpoint reuse one client"""
+        first = get_ollama_client('http://localhost:11434')
+        second = get_ollama_client('http://localhost:11434/')
+
+        self.assertIs(first, second)
+        await aclose_ollama_clients()
+        self.assertTrue(first.is_closed)
+
+    async def test_closed_clients_are_replaced(self):
+        """A client closed on shutdown is not handed out again"""
+        client = get_ollama_client('http://localhost:11434')
+        await aclose_ollama_clients()
+
+        replacement = get_ollama_client('http://localhost:11434')
+
+        self.assertIsNot(client, replacement)
+        await aclose_ollama_clients()
+
+    def test_clients_are_closed_when_their_loop_finishes(self):
+        """Under runserver each request runs in its own loop; its client must not outlive it"""
+        async def request():
+            return get_ollama_client('http://localhost:11434')
+
+        first = asyncio.run(request())
+        second = asyncio.run(request())
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+        self.assertTrue(second.is_closed)
+
+    async def test_lifespan_shutdown_closes_clients(self):
+        """The ASGI lifespan handler closes pooled clients on shutdown"""
+        from core.asgi import application
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        client = get_ollama_client('http://localhost:11434')
+        await application({'type': 'lifespan'}, receive, send)
+
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(client.is_closed)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.unit
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.health = OllamaHealth(failure_threshold=2, recovery_timeout=30, health_ttl=10, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        self.health.record_failure()
+        self.assertTrue(self.health.allow_request())
+        self.health.record_failure()
+
+        self.assertEqual(self.health.state, CircuitState.OPEN)
+        self.assertFalse(self.health.allow_request())
+
+    def test_half_open_lets_one_trial_through(self):
+        """After the recovery timeout a single trial request is allowed"""
+        self.health.record_failure()
+        self.health.record_failure()
+        self.clock.now += 31
+
+        self.assertTrue(self.health.allow_request())
+        self.assertEqual(self.health.state, CircuitState.HALF_OPEN)
+        self.assertFalse(self.health.allow_request())
+
+        self.health.record_success()
+        self.assertEqual(self.health.state, CircuitState.CLOSED)
+
+    def test_failed_trial_reopens_circuit(self):
+        self.health.record_failure()
+        self.health.record_failure()
+        self.clock.now += 31
+        self.health.allow_request()
+
+        self.health.record_failure()
+
+        self.assertEqual(self.health.state, CircuitState.OPEN)
+        self.assertFalse(self.health.allow_request())
+
+    def test_cached_health_expires_after_ttl(self):
+        self.health.record_success()
+        self.assertTrue(self.health.cached_health())
+        self.clock.now += 11
+        self.assertIsNone(self.health.cached_health())
+
+
+@pytest.mark.unit
+class OllamaAgentHealthTest(TestCase):
+    def make_agent(self):
+        agent = OllamaAgent(config={'model': 'test-model'})
+        agent.health = OllamaHealth(failure_threshold=1, recovery_timeout=30)
+        return agent
+
+    async def test_no_health_probe_before_requests(self):
+        """A healthy server costs exactly one request per LLM call"""
+        agent = self.make_agent()
+        client = MagicMock()
+        client.post = AsyncMock(return_value=MagicMock(
+            raise_for_status=MagicMock(), json=MagicMock(return_value={'message': {'content': 'Hej'}})
+        ))
+        client.get = AsyncMock()
+
+        with patch('chatbot.services.agents.get_ollama_client', return_value=client):
+            response = await agent.process({'message': 'hej', 'history': []})
+
+        self.assertEqual(response.data['response'], 'Hej')
+        client.get.assert_not_called()
+        self.assertEqual(client.post.await_count, 1)
+
+    async def test_open_circuit_falls_back_without_network(self):
+        """Once Ollama failed, the next call goes straight to the rule-based fallback"""
+        agent = self.make_agent()
+        client = MagicMock()
+        client.post = AsyncMock(side_effect=httpx.ConnectError("connection refused"))
+
+        with patch('chatbot.services.agents.get_ollama_client', return_value=client):
+            first = await agent.process({'message': 'hej', 'history': []})
+            second = await agent.process({'message': 'hej', 'history': []})
+
+        self.assertTrue(first.metadata['fallback_used'])
+        self.assertTrue(second.metadata['fallback_used'])
+        self.assertEqual(client.post.await_count, 1)
+
+
+def ndjson_client(lines, status_code=200):
+    """httpx client whose /api/chat answers with the given NDJSON lines"""
+    body = "\n".join(json.dumps(line) for line in lines).encode()
+
+    def handler(request):
+        return httpx.Response(status_code, content=body)
+
+    return httpx.AsyncClient(base_url='http://ollama.test', transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.unit
+class OllamaStreamingTest(TestCase):
+    def make_agent(self):
+        agent = OllamaAgent(config={'model': 'test-model'})
+        agent.health = OllamaHealth(failure_threshold=1, recovery_timeout=30)
+        return agent
+
+    async def collect(self, agent, input_data):
+        return [token async for token in agent.stream(input_data)]
+
+    async def test_yields_tokens_from_ndjson_stream(self):
+        """Each NDJSON chunk's content is yielded as soon as it arrives"""
+        agent = self.make_agent()
+        client = ndjson_client([
+            {'message': {'content': 'Dzień'}, 'done': False},
+            {'message': {'content': ' dobry'}, 'done': False},
+            {'message': {'content': ''}, 'done': True},
+        ])
+
+        with patch('chatbot.services.agents.get_ollama_client', return_value=client):
+            tokens = await self.collect(agent, {'message': 'hej', 'history': []})
+
+        self.assertEqual(tokens, ['Dzień', ' dobry'])
+        self.assertEqual(agent.health.state, CircuitState.CLOSED)
+
+    async def test_streams_fallback_when_ollama_is_down(self):
+        """A failure before the first token streams the rule-based answer instead"""
+        agent = self.make_agent()
+        client = ndjson_client([{'error': 'unavailable'}], status_code=503)
+
+        with patch('chatbot.services.agents.get_ollama_client', return_value=client):
+            tokens = await self.collect(agent, {'message': 'hej', 'history': []})
+
+        self.assertEqual(len(tokens), 1)
+        self.assertIn('niedostępny', tokens[0])
+        self.assertEqual(agent.health.state, CircuitState.OPEN)
+
+    async def test_router_streams_final_answer_after_tools(self):
+        """RouterAgent augments the prompt with tool output, then streams the answer"""
+        agent = RouterAgent(config={'model': 'test-model'})
+        agent.health = OllamaHealth()
+        sent = []
+
+        def handler(request):
+            sent.append(json.loads(request.content))
+            return httpx.Response(200, content=json.dumps({'message': {'content': 'Jasne'}, 'done': True}).encode())
+
+        client = httpx.AsyncClient(base_url='http://ollama.test', transport=httpx.MockTransport(handler))
+        with patch('chatbot.services.agents.get_ollama_client', return_value=client), \
+                patch('chatbot.services.agents.ddg_search', return_value='wyniki'):
+            tokens = [token async for token in agent.stream({'message': 'wyszukaj nowy telefon', 'history': []})]
+
+        self.assertEqual(tokens, ['Jasne'])
+        self.assertTrue(sent[-1]['stream'])
+        self.assertIn('wyniki', sent[-1]['messages'][-1]['content'])
+
+
+@pytest.mark.unit
+class PantryQueryParsingTest(TestCase):
+    def setUp(self):
+        self.agent = RouterAgent(config={'model': 'test-model'})
+        self.agent.health = OllamaHealth()
+
+    def test_rules_extract_product(self):
+        self.assertEqual(
+            self.agent._parse_pantry_query_rules('Czy mam mleko?'),
+            {'query_type': 'specific', 'product': 'mleko'}
+        )
+        self.assertEqual(
+            self.agent._parse_pantry_query_rules('Co mam w lodówce?'),
+            {'query_type': 'general', 'product': None}
+        )
+        self.assertIsNone(self.agent._parse_pantry_query_rules('Dodaj chleb do spiżarni'))
+
+    def test_rules_treat_pronouns_and_generic_words_as_general(self):
+        for message in ('czy jest coś w lodówce?', 'ile jest produktów w spiżarni?'):
+            self.assertEqual(
+                self.agent._parse_pantry_query_rules(message),
+                {'query_type': 'general', 'product': None}, message
+            )
+
+    def test_rules_drop_leading_determiners(self):
+        self.assertEqual(
+            self.agent._parse_pantry_query_rules('czy są jakieś jajka?'),
+            {'query_type': 'specific', 'product': 'jajka'}
+        )
+        self.assertEqual(
+            self.agent._parse_pantry_query_rules('czy jest jeszcze jakieś jedzenie?'),
+            {'query_type': 'general', 'product': None}
+        )
+
+    def test_rules_leave_phrases_to_llm(self):
+        for message in ('czy mam iść do sklepu?', 'czy mam kupić chleb?', 'ile mam mleka owsianego?'):
+            self.assertIsNone(self.agent._parse_pantry_query_rules(message), message)
+
+    async def test_rule_candidates_missing_from_pantry_go_to_llm(self):
+        """'czasu' or 'ciepło' are only guesses; without a matching item the LLM decides"""
+        reply = MagicMock(data={'response': '{"query_type": "general", "product": null}'})
+        for message in ('ile mam czasu?', 'czy jest ciepło w lodówce?'):
+            with patch.object(OllamaAgent, 'process', new=AsyncMock(return_value=reply)) as llm, \
+                    patch('chatbot.services.agents.AsyncPantryService.find_item_by_name',
+                          new=AsyncMock(return_value=None)):
+                parsed = await self.agent._parse_pantry_query(message)
+
+            self.assertEqual(parsed, {'query_type': 'general', 'product': None}, message)
+            self.assertEqual(llm.await_count, 1, message)
+
+    def test_rules_drop_quantities_and_units(self):
+        self.assertEqual(
+            self.agent._parse_pantry_query_rules('Czy mam 2 litry mleka?'),
+            {'query_type': 'specific', 'product': 'mleka'}
+        )
+        self.assertEqual(
+            self.agent._parse_pantry_query_rules('czy mam 1,5 kg ziemniaków'),
+            {'query_type': 'specific', 'product': 'ziemniaków'}
+        )
+
+    def test_rules_leave_multi_item_questions_to_llm(self):
+        self.assertIsNone(self.agent._parse_pantry_query_rules('ile mam jajek i mleka?'))
+        self.assertIsNone(self.agent._parse_pantry_query_rules('czy mam masło, chleb?'))
+
+    def test_product_stems_ignore_inflection(self):
+        self.assertEqual(product_name_stems('jajek'), ['jaj'])
+        self.assertEqual(product_name_stems('Mleka'), ['mlek'])
+        self.assertEqual(product_name_stems('ziemniaków'), ['ziemniak'])
+
+    async def test_find_item_matches_inflected_name(self):
+        """Asking about 'jajek' finds an item stored as 'Jajka'"""
+        await PantryItem.objects.acreate(name='Jajka', quantity=10, unit='szt.')
+        await PantryItem.objects.acreate(name='Mleko owsiane', quantity=1, unit='l')
+
+        self.assertEqual((await AsyncPantryService.find_item_by_name('jajek'))['name'], 'Jajka')
+        self.assertEqual((await AsyncPantryService.find_item_by_name('mleka'))['name'], 'Mleko owsiane')
+        self.assertIsNone(await AsyncPantryService.find_item_by_name('chleba'))
+
+    async def test_rule_match_skips_llm(self):
+        """A regex match answers the pantry question with only the final LLM call"""
+        with patch.object(OllamaAgent, 'process', new=AsyncMock()) as llm, \
+                patch('chatbot.services.agents.AsyncPantryService.find_item_by_name',
+                      new=AsyncMock(return_value={'name': 'mleko', 'quantity': 2, 'unit': 'l'})) as find_item:
+            prepared = await self.agent._execute_pantry_management({'message': 'czy mam mleko?', 'history': []})
+
+        llm.assert_not_called()
+        self.assertIn('2 l mleko', prepared['message'])
+        # The item found while parsing is reused for the answer
+        find_item.assert_awaited_once_with('mleko')
+
+    async def test_single_structured_call_when_rules_miss(self):
+        """Classification and extraction come back from one format=json call"""
+        reply = MagicMock(data={'response': '{"query_type": "specific", "product": "chleb"}'})
+        with patch.object(OllamaAgent, 'process', new=AsyncMock(return_value=reply)) as llm:
+            parsed = await self.agent._parse_pantry_query('Przypomnij mi, czy został chleb')
+
+        self.assertEqual(parsed, {'query_type': 'specific', 'product': 'chleb'})
+        self.assertEqual(llm.await_count, 1)
+        self.assertEqual(llm.await_args.args[0]['format'], 'json')
+
+    async def test_invalid_json_falls_back_to_general(self):
+        reply = MagicMock(data={'response': 'nie wiem'})
+        with patch.object(OllamaAgent, 'process', new=AsyncMock(return_value=reply)):
+            parsed = await self.agent._parse_pantry_query('Przypomnij mi, czy został chleb')
+
+        self.assertEqual(parsed, {'query_type': 'general', 'product': None})
+
+
+@pytest.mark.unit
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RoutingCacheTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = RoutingDecisionCache(max_entries=2, ttl=60, clock=self.clock)
+        cache.clear()
+
+    def test_normalization_merges_near_identical_messages(self):
+        self.assertEqual(
+            self.cache.make_key('Jak się  masz?', 'llama3'),
+            self.cache.make_key('jak się masz', 'llama3')
+        )
+        self.assertNotEqual(
+            self.cache.make_key('jak się masz', 'llama3'),
+            self.cache.make_key('jak się masz', 'other-model')
+        )
+
+    async def test_local_entries_expire_and_evict(self):
+        await self.cache.aset('a', 'm', 'web_search')
+        await self.cache.aset('b', 'm', 'rag_search')
+        await self.cache.aset('c', 'm', 'weather_service')
+
+        self.assertIsNone(self.cache._get_local(self.cache.make_key('a', 'm')))
+        self.assertEqual(self.cache._get_local(self.cache.make_key('c', 'm')), 'weather_service')
+        self.clock.now += 61
+        self.assertIsNone(self.cache._get_local(self.cache.make_key('c', 'm')))
+
+    async def test_shared_cache_backs_local_lru(self):
+        """Another worker (empty local LRU) still finds the decision"""
+        await self.cache.aset('opowiedz mi coś', 'm', 'general_conversation')
+        other_worker = RoutingDecisionCache()
+
+        self.assertEqual(await other_worker.aget('Opowiedz mi coś!', 'm'), 'general_conversation')
+
+    async def test_router_reuses_llm_decision(self):
+        """The second identical message is routed from the cache without an LLM call"""
+        agent = RouterAgent(config={'model': 'cache-test-model'})
+        agent.health = OllamaHealth()
+        agent.intent_classifier = None
+        decision = MagicMock(success=True, metadata={}, data={'response': 'web_search'})
+        answers = [MagicMock(success=True, metadata={}, data={'response': 'ok'}) for _ in range(2)]
+        routing_cache.clear_local()
+
+        with patch.object(OllamaAgent, 'process', new=AsyncMock(side_effect=[decision, *answers])) as llm, \
+                patch('chatbot.services.agents.ddg_search', return_value='wyniki'):
+            first = await agent.process({'message': 'Przypomnij mi ustalenia z umowy', 'history': []})
+            second = await agent.process({'message': 'przypomnij mi ustalenia z umowy', 'history': []})
+
+        self.assertEqual(first.metadata['routing'], {'tool': 'web_search', 'source': 'llm'})
+        self.assertEqual(second.metadata['routing'], {'tool': 'web_search', 'source': 'cache'})
+        self.assertEqual(llm.await_count, 3)
+
+
+def keyword_embed(texts, model):
+    """Fake embeddings: one axis per topic keyword"""
+    topics = ['pogod', 'wyszukaj', 'lodówk', 'dokument', 'dziękuj']
+    return [[1.0 if topic in text.lower() else 0.0 for topic in topics] + [0.1] for text in texts]
+
+
+@pytest.mark.unit
+class IntentClassifierTest(TestCase):
+    examples = {
+        'weather_service': ['pogoda w Krakowie', 'pogoda jutro'],
+        'web_search': ['wyszukaj telefon', 'wyszukaj film'],
+        'pantry_management': ['co w lodówkach', 'lodówka pusta'],
+        'rag_search': ['dokument ABC', 'mój dokument'],
+        'general_conversation': ['dziękuję', 'dziękuje bardzo'],
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = EmbeddingCache(os.path.join(self.tmpdir.name, 'cache.sqlite3'))
+        self.classifier = IntentClassifier(
+            examples=self.examples, model='test', embedding_cache=self.cache,
+            health=OllamaHealth(failure_threshold=1, recovery_timeout=30),
+        )
+
+    async def test_classifies_by_nearest_centroid(self):
+        with patch('chatbot.services.intent_classifier.aembed', new=AsyncMock(side_effect=keyword_embed)):
+            intent = await self.classifier.classify('Jaka będzie pogoda?')
+
+        self.assertEqual(intent.intent, 'weather_service')
+        self.assertGreater(intent.confidence, 0.9)
+
+    async def test_low_confidence_returns_none(self):
+        with patch('chatbot.services.intent_classifier.aembed', new=AsyncMock(side_effect=keyword_embed)):
+            self.assertIsNone(await self.classifier.classify('pogoda a dokument'))
+
+    async def test_examples_are_embedded_once(self):
+        """Fitting goes through the embedding cache, so a new classifier needs no Ollama calls"""
+        embed = AsyncMock(side_effect=keyword_embed)
+        with patch('chatbot.services.intent_classifier.aembed', new=embed):
+            await self.classifier.classify('pogoda')
+            other = IntentClassifier(examples=self.examples, model='test', embedding_cache=self.cache,
+                                     health=OllamaHealth())
+            await other.classify('pogoda')
+
+        self.assertEqual(embed.await_count, 2)
+
+    async def test_open_circuit_skips_embedding_requests(self):
+        """Once an embedding request failed, uncached messages fail fast without calling Ollama"""
+        embed = AsyncMock(side_effect=httpx.ConnectError("connection refused"))
+        with patch('chatbot.services.intent_classifier.aembed', new=embed):
+            with self.assertRaises(httpx.ConnectError):
+                await self.classifier.classify('pogoda')
+            with self.assertRaises(ConnectionError):
+                await self.classifier.classify('pogoda')
+
+        self.assertEqual(embed.await_count, 1)
+        self.assertEqual(self.classifier.health.state, CircuitState.OPEN)
+
+    async def test_router_skips_llm_on_confident_intent(self):
+        agent = RouterAgent(config={'model': 'test-model'})
+        agent.health = OllamaHealth()
+        agent.intent_classifier = MagicMock(classify=AsyncMock(return_value=IntentData(
+            intent='general_conversation', confidence=0.9, entities={}, raw_query='x'
+        )))
+        routing_cache.clear_local()
+
+        with patch('chatbot.services.agents.routing_cache.aget', new=AsyncMock(return_value=None)), \
+                patch.object(RouterAgent, '_llm_based_routing', new=AsyncMock()) as llm_routing:
+            tool, source = await agent._route('Opowiedz coś o sobie')
+
+        self.assertEqual((tool, source), ('general_conversation', 'embedding'))
+        llm_routing.assert_not_called()
+
+
+@pytest.mark.unit
+class RoutingMatcherTest(TestCase):
+    def test_same_routes_as_per_pattern_search(self):
+        matcher = RoutingMatcher.from_config({})
+        for message in SAMPLE_MESSAGES + ['Jaka jest dziś temperatura?', 'plik.PDF', 'cośtam produktywnego']:
+            self.assertEqual(matcher.best(message), legacy_route(message), message)
+
+    def test_reports_all_matching_tools_with_scores(self):
+        matches = RoutingMatcher.from_config({}).match('Jaka pogoda? Znajdź w dokumencie prognozę')
+
+        self.assertEqual([m.tool for m in matches], ['weather_service', 'web_search', 'rag_search'])
+        self.assertEqual(matches[0].score, 1.0)
+        self.assertEqual(matches[1].matched_patterns, 1)
+
+    def test_rules_come_from_agent_config(self):
+        agent = RouterAgent(config={
+            'routing_patterns': {'pantry_management': [r'\b(zakupy|koszyk)\b']},
+            'routing_greetings': [],
+        })
+
+        self.assertEqual(agent._rule_based_routing('Co w koszyku? koszyk'), 'pantry_management')
+        self.assertIsNone(agent._rule_based_routing('Jaka pogoda?'))
+
+    def test_compiled_matchers_are_shared(self):
+        self.assertIs(RoutingMatcher.from_config({}), RouterAgent().routing_matcher)
+
+
+@pytest.mark.unit
+class HistoryBudgetTest(TestCase):
+    def history(self, count, length=70):
+        return [
+            {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f"{i:02d}" + 'x' * (length - 2)}
+            for i in range(count)
+        ]
+
+    def test_keeps_newest_messages_within_budget(self):
+        history = self.history(10)  # 20 + 4 estimated tokens each
+
+        kept = trim_history(history, budget=100)
+
+        self.assertEqual(kept, history[-4:])
+        self.assertEqual(trim_history(history, budget=0), [])
+
+    def test_payload_includes_summary_and_trimmed_history(self):
+        agent = OllamaAgent(config={'model': 'test-model', 'history_token_budget': 100})
+
+        payload = agent._build_chat_payload({
+            'message': 'hej',
+            'history': self.history(10),
+            'conversation_summary': 'Użytkownik planuje wyjazd w góry.',
+        })
+
+        messages = payload['messages']
+        self.assertEqual(messages[0]['role'], 'system')
+        self.assertIn('wyjazd w góry', messages[0]['content'])
+        self.assertEqual(messages[-1], {'role': 'user', 'content': 'hej'})
+        self.assertEqual(messages[1]['content'][:2], '07')
+        self.assertEqual(len(messages), 5)
@@ -0,0 +1,467 @@
+from io import StringIO
+
+import pytest
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from chatbot.conversation_manager import conversation_manager
+from chatbot.models import Agent, Conversation, Message
+from chatbot.services.agents import OllamaAgent
+from chatbot.services.history_buffer import history_buffer
+from chatbot.services.message_writer import MessageWriteBehind
+from chatbot.tasks import summarize_conversation_task
+
+
+@pytest.mark.unit
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TurnContextTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.agent = Agent.objects.create(
+            name="Test Agent",
+            agent_type="router",
+            persona_prompt="You are a helpful test agent",
+            is_active=True
+        )
+        self.conversation = Conversation.objects.create(agent=self.agent, user_id="u1")
+        for i in range(12):
+            Message.objects.create(
+                conversation=self.conversation,
+                role='user' if i % 2 == 0 else 'assistant',
+                content=f"message {i}"
+            )
+
+    def test_loads_context_in_two_queries(self):
+        load = async_to_sync(conversation_manager.load_turn_context)
+
+        with self.assertNumQueries(2):
+            context = load(str(self.conversation.session_id), context_window=4)
+
+        self.assertEqual(context['conversation']['id'], self.conversation.pk)
+        self.assertEqual(context['conversation']['agent_name'], "Test Agent")
+        self.assertEqual(context['conversation']['message_count'], 12)
+        self.assertEqual(
+            [m['content'] for m in context['recent_messages']],
+            ["message 8", "message 9", "message 10", "message 11"]
+        )
+
+    def test_unknown_session_returns_empty_context(self):
+        load = async_to_sync(conversation_manager.load_turn_context)
+
+        self.assertEqual(load('00000000-0000-0000-0000-000000000000'), {})
+        self.assertEqual(load('not-a-uuid'), {})
+
+    def test_save_turn_keeps_message_order(self):
+        """Messages written in one bulk insert come back in turn order"""
+        save = async_to_sync(conversation_manager.save_turn)
+        save(self.conversation.pk, [
+            {'role': 'user', 'content': 'pytanie'},
+            {'role': 'assistant', 'content': 'odpowiedź', 'metadata': {'model': 'llama3'}},
+        ])
+
+        context = async_to_sync(conversation_manager.load_turn_context)(
+            str(self.conversation.session_id), context_window=2
+        )
+        self.assertEqual(
+            context['recent_messages'],
+            [{'role': 'user', 'content': 'pytanie'}, {'role': 'assistant', 'content': 'odpowiedź'}]
+        )
+        self.assertEqual(context['conversation']['message_count'], 14)
+
+    def test_warm_history_buffer_skips_message_query(self):
+        load = async_to_sync(conversation_manager.load_turn_context)
+        load(str(self.conversation.session_id), context_window=4)
+
+        with self.assertNumQueries(1):
+            context = load(str(self.conversation.session_id), context_window=4)
+
+        self.assertEqual(context['recent_messages'][-1]['content'], "message 11")
+
+    def test_writes_go_through_to_history_buffer(self):
+        """Messages added after the buffer was seeded are served from it"""
+        session_id = str(self.conversation.session_id)
+        async_to_sync(conversation_manager.get_conversation_context)(session_id, context_window=4)
+        async_to_sync(conversation_manager.add_message)(session_id, 'user', 'nowe pytanie')
+        async_to_sync(conversation_manager.save_turn)(self.conversation.pk, [
+            {'role': 'assistant', 'content': 'nowa odpowiedź'},
+        ])
+
+        buffered = async_to_sync(history_buffer.aget)(self.conversation.pk, 3)
+        self.assertEqual([m['content'] for m in buffered], ["message 11", "nowe pytanie", "nowa odpowiedź"])
+
+    def test_overlapping_writes_leave_buffer_stale_instead_of_losing_messages(self):
+        """Two turns writing at once must not leave a buffer missing one of them"""
+        session_id = str(self.conversation.session_id)
+        async_to_sync(conversation_manager.load_turn_context)(session_id)
+
+        async def overlapping_writes():
+            first = await history_buffer.abegin_write(self.conversation.pk)
+            second = await history_buffer.abegin_write(self.conversation.pk)
+            await Message.objects.acreate(conversation=self.conversation, role='user', content='pierwsze')
+            await Message.objects.acreate(conversation=self.conversation, role='user', content='drugie')
+            await history_buffer.aappend(self.conversation.pk, [{'role': 'user', 'content': 'drugie'}], second)
+            await history_buffer.aappend(self.conversation.pk, [{'role': 'user', 'content': 'pierwsze'}], first)
+        async_to_sync(overlapping_writes)()
+
+        self.assertIsNone(async_to_sync(history_buffer.aget)(self.conversation.pk, 4))
+        context = async_to_sync(conversation_manager.load_turn_context)(session_id, context_window=2)
+        self.assertEqual([m['content'] for m in context['recent_messages']], ['pierwsze', 'drugie'])
+
+    def test_seed_racing_with_a_write_is_not_served(self):
+        """A cache-miss read that loaded the tail before a write cannot seed the stale tail"""
+        async def racing_read_and_write():
+            generation = await history_buffer.ageneration(self.conversation.pk)
+            stale = [{'role': 'user', 'content': 'message 11'}]
+            await conversation_manager.save_turn(self.conversation.pk, [{'role': 'user', 'content': 'nowe'}])
+            await history_buffer.aset(self.conversation.pk, stale, generation)
+        async_to_sync(racing_read_and_write)()
+
+        self.assertIsNone(async_to_sync(history_buffer.aget)(self.conversation.pk, 1))
+        recent = async_to_sync(conversation_manager.get_recent_messages)(self.conversation.pk, 1)
+        self.assertEqual(recent, [{'role': 'user', 'content': 'nowe'}])
+
+    def test_deleting_a_message_drops_the_buffer(self):
+        async_to_sync(conversation_manager.load_turn_context)(str(self.conversation.session_id))
+
+        Message.objects.filter(conversation=self.conversation).last().delete()
+
+        self.assertIsNone(async_to_sync(history_buffer.aget)(self.conversation.pk, 4))
+
+    def test_deleting_a_conversation_fast_deletes_its_messages(self):
+        """No per-message signals: messages go in one DELETE and the buffer is dropped once"""
+        async_to_sync(conversation_manager.load_turn_context)(str(self.conversation.session_id))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.conversation.delete()
+
+        message_queries = [q['sql'] for q in queries.captured_queries if 'chatbot_message' in q['sql']]
+        self.assertEqual(len(message_queries), 1)
+        self.assertTrue(message_queries[0].startswith('DELETE'))
+        self.assertIsNone(async_to_sync(history_buffer.aget)(self.conversation.pk, 4))
+
+
+@pytest.mark.unit
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConversationSummaryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        agent = Agent.objects.create(name="Test Agent", agent_type="router", config={'model': 'test-model'})
+        self.conversation = Conversation.objects.create(agent=agent, user_id="u1")
+        messages = Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user', content=f"message {i}") for i in range(32)
+        ])
+        Conversation.record_messages(self.conversation.pk, messages)
+
+    def history(self, start, stop):
+        return [{'role': 'user', 'content': f"message {i}"} for i in range(start, stop)]
+
+    def test_schedules_once_unsummarized_messages_outgrow_the_budget(self):
+        """'message N' costs 7 estimated tokens; a 100-token budget triggers above 60"""
+        schedule = async_to_sync(conversation_manager.schedule_summary)
+        conversation = {'id': self.conversation.pk, 'message_count': 30, 'unsummarized_count': 4}
+        history, turn = self.history(26, 30), self.history(30, 32)
+
+        with patch('chatbot.tasks.summarize_conversation_task.delay') as delay:
+            self.assertFalse(schedule(conversation, history, turn, history_budget=100))
+            conversation['unsummarized_count'] = 8
+            history = self.history(22, 30)
+            self.assertTrue(schedule(conversation, history, turn, history_budget=100))
+            self.assertFalse(schedule(conversation, history, turn, history_budget=100))  # already pending
+
+        delay.assert_called_once_with(self.conversation.pk, history_budget=100)
+
+    def test_unsummarized_messages_outside_the_loaded_tail_trigger_a_summary(self):
+        conversation = {'id': self.conversation.pk, 'message_count': 30, 'metadata': {}}
+
+        with patch('chatbot.tasks.summarize_conversation_task.delay') as delay:
+            scheduled = async_to_sync(conversation_manager.schedule_summary)(
+                conversation, self.history(10, 30), self.history(30, 32)
+            )
+
+        self.assertTrue(scheduled)
+        delay.assert_called_once()
+
+    def test_task_folds_everything_but_the_recent_token_share(self):
+        """With a 100-token budget the newest 40 tokens (5 messages) stay out of the summary"""
+        cache.set(f"conversation_summary_pending:{self.conversation.pk}", True)
+
+        with patch('chatbot.tasks.summarize_messages', return_value='Nowe podsumowanie') as summarize:
+            summarize_conversation_task(self.conversation.pk, history_budget=100)
+
+        previous, messages = summarize.call_args.args
+        self.assertEqual(previous, '')
+        self.assertEqual([m['content'] for m in messages], [f"message {i}" for i in range(27)])
+        self.assertEqual(summarize.call_args.kwargs['model'], 'test-model')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, 'Nowe podsumowanie')
+        last = Message.objects.get(conversation=self.conversation, content="message 26")
+        self.assertEqual(
+            (self.conversation.summarized_through_at, self.conversation.summarized_through_id),
+            (last.created_at, last.pk)
+        )
+        self.assertIsNone(cache.get(f"conversation_summary_pending:{self.conversation.pk}"))
+
+    def load_and_build_prompt(self):
+        context = async_to_sync(conversation_manager.load_turn_context)(str(self.conversation.session_id))
+        agent = OllamaAgent(config={'model': 'test-model', 'history_token_budget': 100})
+        payload = agent._build_chat_payload({
+            'message': 'pytanie', 'history': context['recent_messages'],
+            'conversation_summary': context['conversation']['summary'],
+        })
+        return context, [m['content'] for m in payload['messages'][1:-1]]
+
+    def test_summarized_messages_are_not_sent_next_to_the_summary(self):
+        """After a summary the prompt holds the summary and exactly the messages it does not cover"""
+        with patch('chatbot.tasks.summarize_messages', return_value='x' * 35):
+            summarize_conversation_task(self.conversation.pk, history_budget=100)
+
+        context, history = self.load_and_build_prompt()
+
+        self.assertEqual(context['conversation']['unsummarized_count'], 5)
+        self.assertEqual(history, [f"message {i}" for i in range(27, 32)])
+
+    def test_deleting_summarized_messages_keeps_the_watermark(self):
+        with patch('chatbot.tasks.summarize_messages', return_value='x' * 35):
+            summarize_conversation_task(self.conversation.pk, history_budget=100)
+        Message.objects.filter(conversation=self.conversation, content__in=["message 0", "message 1"]).delete()
+        Message.objects.create(conversation=self.conversation, role='user', content="message 32")
+
+        _, history = self.load_and_build_prompt()
+
+        self.assertEqual(history, [f"message {i}" for i in range(27, 33)])
+
+
+@pytest.mark.unit
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConversationStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.agent = Agent.objects.create(name="Test Agent", agent_type="router")
+        self.conversation = Conversation.objects.create(agent=self.agent, user_id="u1")
+
+    def test_message_writes_maintain_counters(self):
+        session_id = str(self.conversation.session_id)
+        async_to_sync(conversation_manager.add_message)(session_id, 'user', 'pierwsze pytanie')
+        async_to_sync(conversation_manager.save_turn)(self.conversation.pk, [
+            {'role': 'user', 'content': 'drugie pytanie'},
+            {'role': 'assistant', 'content': 'odpowiedź ' * 40},
+        ])
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 3)
+        self.assertEqual(self.conversation.last_message_preview, ('odpowiedź ' * 40)[:200])
+        self.assertIsNotNone(self.conversation.last_message_at)
+
+        self.conversation.messages.first().delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+
+    def test_deleting_messages_recomputes_last_message(self):
+        first = Message.objects.create(conversation=self.conversation, role='user', content="pytanie")
+        Message.objects.create(conversation=self.conversation, role='assistant', content="odpowiedź")
+        Message.objects.create(conversation=self.conversation, role='user', content="dopytanie")
+
+        self.conversation.messages.order_by('-id').first().delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.message_count, self.conversation.last_message_preview), (2, "odpowiedź"))
+
+        Message.objects.filter(conversation=self.conversation, role='assistant').delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 1)
+        self.assertEqual(self.conversation.last_message_preview, "pytanie")
+        self.assertEqual(self.conversation.last_message_at, first.created_at)
+
+        first.delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.message_count, self.conversation.last_message_at), (0, None))
+        self.assertEqual(self.conversation.last_message_preview, '')
+
+    def test_listing_is_a_single_query(self):
+        for i in range(3):
+            conversation = Conversation.objects.create(agent=self.agent, user_id="u1")
+            Message.objects.create(conversation=conversation, role='user', content=f"rozmowa {i}")
+
+        with self.assertNumQueries(1):
+            conversations = async_to_sync(conversation_manager.list_user_conversations)("u1")
+
+        self.assertEqual(len(conversations), 4)
+        self.assertEqual(conversations[0]['last_message_preview'], "rozmowa 2")
+        self.assertEqual(conversations[0]['message_count'], 1)
+
+    def test_backfill_recomputes_stale_counters(self):
+        Message.objects.create(conversation=self.conversation, role='user', content="pytanie")
+        Message.objects.create(conversation=self.conversation, role='assistant', content="odpowiedź")
+        Conversation.objects.filter(pk=self.conversation.pk).update(
+            message_count=0, last_message_at=None, last_message_preview=''
+        )
+
+        call_command('backfill_conversation_stats', stdout=StringIO())
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(self.conversation.last_message_preview, "odpowiedź")
+
+
+@pytest.mark.unit
+class HistoryPaginationTest(TestCase):
+    def setUp(self):
+        agent = Agent.objects.create(name="Test Agent", agent_type="router")
+        self.conversation = Conversation.objects.create(agent=agent, user_id="u1")
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user', content=f"message {i}") for i in range(25)
+        ])
+        # Identical timestamps: only the id tie-breaker keeps pages apart
+        Message.objects.filter(conversation=self.conversation).update(created_at=timezone.now())
+        self.page = async_to_sync(conversation_manager.get_conversation_history_page)
+        self.session_id = str(self.conversation.session_id)
+
+    def contents(self, page):
+        return [m['content'] for m in page['messages']]
+
+    def test_pages_back_through_history(self):
+        first = self.page(self.session_id, limit=10)
+        self.assertEqual(self.contents(first), [f"message {i}" for i in range(15, 25)])
+        self.assertTrue(first['has_more'])
+
+        with self.assertNumQueries(2):
+            second = self.page(self.session_id, limit=10, before=first['before'])
+        third = self.page(self.session_id, limit=10, before=second['before'])
+
+        self.assertEqual(self.contents(second), [f"message {i}" for i in range(5, 15)])
+        self.assertEqual(self.contents(third), [f"message {i}" for i in range(5)])
+        self.assertFalse(third['has_more'])
+        self.assertIsNone(third['before'])
+
+    def test_after_cursor_returns_newer_messages(self):
+        older = self.page(self.session_id, limit=10, before=self.page(self.session_id, limit=10)['before'])
+
+        newer = self.page(self.session_id, limit=3, after=older['after'])
+
+        self.assertEqual(self.contents(newer), ["message 15", "message 16", "message 17"])
+        self.assertTrue(newer['has_more'])
+        self.assertIsNotNone(newer['before'])
+
+    def test_malformed_cursor_and_unknown_conversation(self):
+        with self.assertRaises(ValueError):
+            self.page(self.session_id, before='not-a-cursor')
+        self.assertIsNone(self.page('00000000-0000-0000-0000-000000000000'))
+
+
+@pytest.mark.unit
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class WriteBehindTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        agent = Agent.objects.create(name="Test Agent", agent_type="router")
+        self.conversation = Conversation.objects.create(agent=agent, user_id="u1")
+        self.writer = MessageWriteBehind(enabled=True, batch_size=4, interval=60)
+        for target in ('chatbot.services.async_services', 'chatbot.conversation_manager'):
+            patcher = patch(f'{target}.message_write_behind', self.writer)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def save(self, *contents):
+        async_to_sync(conversation_manager.save_turn)(self.conversation.pk, [
+            {'role': 'user', 'content': content} for content in contents
+        ])
+
+    def test_turns_are_flushed_in_order_once_the_batch_fills(self):
+        self.save('pierwsze', 'drugie')
+        self.assertEqual(Message.objects.count(), 0)
+
+        # Queued messages are already visible to the next turn
+        context = async_to_sync(conversation_manager.load_turn_context)(str(self.conversation.session_id))
+        self.assertEqual([m['content'] for m in context['recent_messages']], ['pierwsze', 'drugie'])
+
+        self.save('trzecie', 'czwarte')
+
+        self.assertEqual(
+            list(Message.objects.order_by('created_at', 'id').values_list('content', flat=True)),
+            ['pierwsze', 'drugie', 'trzecie', 'czwarte']
+        )
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 4)
+        self.assertEqual(len(self.writer), 0)
+
+    def test_failed_flush_keeps_messages_queued(self):
+        self.save('pierwsze')
+        with patch.object(MessageWriteBehind, '_write', side_effect=RuntimeError('database is locked')):
+            self.assertEqual(async_to_sync(self.writer.flush)(), 0)
+        self.save('drugie')
+
+        self.assertEqual(len(self.writer), 2)
+        self.assertEqual(async_to_sync(self.writer.flush)(), 2)
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('content', flat=True)), ['pierwsze', 'drugie']
+        )
+
+    def test_message_of_a_deleted_conversation_does_not_block_the_batch(self):
+        other = Conversation.objects.create(agent=self.conversation.agent, user_id="u2")
+        self.save('osierocone')
+        async_to_sync(conversation_manager.save_turn)(other.pk, [{'role': 'user', 'content': 'drugie'}])
+        Conversation.objects.filter(pk=self.conversation.pk).delete()
+
+        with self.assertLogs('chatbot.services.message_writer', level='ERROR') as logs:
+            self.assertEqual(async_to_sync(self.writer.flush)(), 1)
+
+        self.assertIn('osierocone', logs.output[0])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['drugie'])
+        self.assertEqual(len(self.writer), 0)
+
+    def test_rows_failing_an_integrity_check_are_isolated(self):
+        write = MessageWriteBehind._write
+
+        def reject_poison(batch):
+            if any(message['content'] == 'zatrute' for _, message in batch):
+                raise IntegrityError('CHECK constraint failed')
+            write(batch)
+
+        self.save('pierwsze', 'zatrute', 'trzecie')
+        with patch.object(MessageWriteBehind, '_write', side_effect=reject_poison), \
+                self.assertLogs('chatbot.services.message_writer', level='ERROR'):
+            self.assertEqual(async_to_sync(self.writer.flush)(), 2)
+
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('content', flat=True)), ['pierwsze', 'trzecie']
+        )
+        self.assertEqual(len(self.writer), 0)
+
+    def test_retries_and_queue_size_are_capped(self):
+        self.writer.max_retries = 2
+        self.writer.max_queue = 3
+        self.save('pierwsze')
+        with patch.object(MessageWriteBehind, '_write', side_effect=RuntimeError('database is locked')), \
+                self.assertLogs('chatbot.services.message_writer', level='ERROR'):
+            async_to_sync(self.writer.flush)()
+            self.assertEqual(len(self.writer), 1)
+            async_to_sync(self.writer.flush)()
+            self.assertEqual(len(self.writer), 0)
+
+        self.writer.batch_size = 10
+        with self.assertLogs('chatbot.services.message_writer', level='ERROR') as logs:
+            self.save('a', 'b', 'c', 'd')
+        self.assertEqual([m['content'] for m in self.writer.pending(self.conversation.pk)], ['b', 'c', 'd'])
+        self.assertIn("'a'", logs.output[0])
+
+    def test_lifespan_shutdown_flushes_queue(self):
+        from core.asgi import application
+
+        self.save('pierwsze')
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            pass
+
+        with patch('chatbot.services.message_writer.message_write_behind', self.writer):
+            async_to_sync(application)({'type': 'lifespan'}, receive, send)
+
+        self.assertEqual(Message.objects.count(), 1)
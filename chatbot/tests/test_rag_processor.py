@@ -0,0 +1,254 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from django.test import TestCase
+
+from chatbot.hybrid_retriever import BM25Index, reciprocal_rank_fusion, tokenize
+from chatbot.rag_processor import HYBRID_CANDIDATES, RagProcessor
+from chatbot.utils.embedding_cache import EmbeddingCache
+
+
+def make_temp_dir(testcase) -> Path:
+    """Temporary directory removed when the test finishes"""
+    path = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, path, ignore_errors=True)
+    return Path(path)
+
+
+def make_processor(testcase):
+    """Build a RagProcessor with Chroma and Ollama replaced by mocks"""
+    cache_dir = make_temp_dir(testcase)
+    with patch('chromadb.PersistentClient'), \
+            patch('ollama.Client'), \
+            patch('chatbot.rag_processor.EMBEDDING_CACHE_PATH', cache_dir / "cache.sqlite3"), \
+            patch('chatbot.rag_processor.LEXICAL_INDEX_PATH', cache_dir / "lexical.sqlite3"):
+        processor = RagProcessor()
+    processor.collection = MagicMock()
+    processor.ollama_client = MagicMock()
+    processor.ollama_client.embed.side_effect = lambda model, input: {
+        'embeddings': [[float(len(text))] for text in input]
+    }
+    return processor
+
+
+@pytest.mark.unit
+class BatchedIngestionTest(TestCase):
+    def test_sync_client_uses_configured_ollama_url(self):
+        """Ingestion talks to the same Ollama host as the async path"""
+        with patch('chromadb.PersistentClient'), patch('ollama.Client') as client, \
+                patch('chatbot.rag_processor.EMBEDDING_CACHE_PATH', make_temp_dir(self) / "cache.sqlite3"), \
+                patch('chatbot.rag_processor.LEXICAL_INDEX_PATH', make_temp_dir(self) / "lexical.sqlite3"), \
+                patch('chatbot.rag_processor.DEFAULT_OLLAMA_URL', 'http://ollama:11434'):
+            RagProcessor()
+
+        client.assert_called_once_with(host='http://ollama:11434')
+
+    def test_embeds_and_upserts_in_batches(self):
+        """Chunks are embedded and written in batches, not one by one"""
+        processor = make_processor(self)
+        texts = [f"chunk {i}" * (i + 1) for i in range(5)]
+        ids = [f"1_{i}" for i in range(5)]
+        metadatas = [{"document_id": 1} for _ in texts]
+
+        stats = processor._embed_and_store(ids, texts, metadatas, batch_size=2, concurrency=2)
+
+        self.assertEqual(stats['chunks'], 5)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(processor.ollama_client.embed.call_count, 3)
+        self.assertEqual(processor.collection.upsert.call_count, 3)
+
+        written_ids = [
+            chunk_id
+            for call in processor.collection.upsert.call_args_list
+            for chunk_id in call.kwargs['ids']
+        ]
+        self.assertEqual(written_ids, ids)
+
+    def test_embeddings_stay_aligned_with_ids(self):
+        """Concurrent batches keep embeddings paired with their chunks"""
+        processor = make_processor(self)
+        texts = ["a", "bb", "ccc", "dddd"]
+
+        processor._embed_and_store([str(i) for i in range(4)], texts, [{}] * 4, batch_size=1, concurrency=4)
+
+        for call in processor.collection.upsert.call_args_list:
+            self.assertEqual(call.kwargs['embeddings'], [[float(len(call.kwargs['documents'][0]))]])
+
+
+@pytest.mark.unit
+class EmbeddingCacheTest(TestCase):
+    def setUp(self):
+        self.cache = EmbeddingCache(make_temp_dir(self) / "cache.sqlite3", max_entries=2)
+
+    def test_hits_and_misses_are_counted(self):
+        """Cached texts are returned and counted as hits"""
+        self.cache.set("model", "mleko", [0.5, 1.0])
+
+        self.assertEqual(self.cache.get_many("model", ["mleko", "chleb"]), [[0.5, 1.0], None])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_entries_are_scoped_by_model(self):
+        """The same text embedded by another model is a miss"""
+        self.cache.set("model-a", "mleko", [1.0])
+        self.assertIsNone(self.cache.get("model-b", "mleko"))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """Going over max_entries drops the least recently used entry"""
+        self.cache.set("model", "a", [1.0])
+        self.cache.set("model", "b", [2.0])
+        self.cache.get("model", "a")
+        self.cache.set("model", "c", [3.0])
+
+        self.assertIsNotNone(self.cache.get("model", "a"))
+        self.assertIsNone(self.cache.get("model", "b"))
+        self.assertEqual(self.cache.stats()['entries'], 2)
+
+    def test_processor_only_embeds_cache_misses(self):
+        """RagProcessor sends only uncached texts to Ollama"""
+        processor = make_processor(self)
+        processor._embed_batch(["a", "bb"])
+        processor.ollama_client.embed.reset_mock()
+
+        embeddings = processor._embed_batch(["a", "bb", "ccc"])
+
+        self.assertEqual(embeddings, [[1.0], [2.0], [3.0]])
+        processor.ollama_client.embed.assert_called_once_with(model='mxbai-embed-large', input=["ccc"])
+
+
+@pytest.mark.unit
+class IncrementalReindexTest(TestCase):
+    def setUp(self):
+        import uuid
+        import chromadb
+        self.processor = make_processor(self)
+        self.processor.collection = chromadb.EphemeralClient().create_collection(f"test_{uuid.uuid4().hex}")
+
+    def stored_documents(self, document_id=1):
+        stored = self.processor.collection.get(where={"document_id": document_id})
+        ordered = sorted(zip(stored['metadatas'], stored['documents']), key=lambda item: item[0]['chunk_index'])
+        return [text for _, text in ordered]
+
+    def test_first_index_adds_every_chunk(self):
+        """A new document embeds all of its chunks"""
+        stats = self.processor.reindex_document(1, ["a", "b", "c"], source="doc.txt")
+
+        self.assertEqual(stats['added'], 3)
+        self.assertEqual(self.stored_documents(), ["a", "b", "c"])
+
+    def test_reindex_embeds_only_changed_chunks(self):
+        """Unchanged chunks are not re-embedded, stale chunks are deleted"""
+        self.processor.reindex_document(1, ["a", "b", "c"], source="doc.txt")
+        self.processor.ollama_client.embed.reset_mock()
+
+        stats = self.processor.reindex_document(1, ["a", "B"], source="doc.txt")
+
+        self.assertEqual((stats['added'], stats['removed'], stats['unchanged']), (1, 2, 1))
+        self.processor.ollama_client.embed.assert_called_once_with(model='mxbai-embed-large', input=["B"])
+        self.assertEqual(self.stored_documents(), ["a", "B"])
+
+    def test_moved_chunks_only_update_metadata(self):
+        """Inserting a chunk shifts the others without re-embedding them"""
+        self.processor.reindex_document(1, ["a", "b"], source="doc.txt")
+
+        stats = self.processor.reindex_document(1, ["new", "a", "b"], source="doc.txt")
+
+        self.assertEqual((stats['added'], stats['moved'], stats['removed']), (1, 2, 0))
+        self.assertEqual(self.stored_documents(), ["new", "a", "b"])
+
+    def test_other_documents_are_untouched(self):
+        """Re-indexing one document never deletes chunks of another"""
+        self.processor.reindex_document(1, ["a"], source="one.txt")
+        self.processor.reindex_document(2, ["a"], source="two.txt")
+
+        self.processor.reindex_document(1, [], source="one.txt")
+
+        self.assertEqual(self.stored_documents(1), [])
+        self.assertEqual(self.stored_documents(2), ["a"])
+
+
+@pytest.mark.unit
+class AsyncRetrievalTest(TestCase):
+    async def test_aretrieve_context_uses_async_client(self):
+        """aretrieve_context awaits the pooled Ollama client and queries Chroma"""
+        processor = make_processor(self)
+        processor.collection.query.return_value = {'ids': [["1_a"]], 'documents': [["kontekst"]]}
+
+        with patch('chatbot.rag_processor.aembed', AsyncMock(return_value=[[0.1, 0.2]])) as aembed:
+            context = await processor.aretrieve_context("pytanie", n_results=2)
+
+        self.assertEqual(context, ["kontekst"])
+        aembed.assert_awaited_once_with(["pytanie"], model='mxbai-embed-large')
+        processor.collection.query.assert_called_once_with(
+            query_embeddings=[[0.1, 0.2]], n_results=max(2, HYBRID_CANDIDATES)
+        )
+        processor.ollama_client.embed.assert_not_called()
+
+    async def test_aretrieve_context_serves_repeated_queries_from_cache(self):
+        """A repeated query does not reach Ollama again"""
+        processor = make_processor(self)
+        processor.collection.query.return_value = {'ids': [[]], 'documents': [[]]}
+
+        with patch('chatbot.rag_processor.aembed', AsyncMock(return_value=[[0.1]])) as aembed:
+            await processor.aretrieve_context("pytanie")
+            await processor.aretrieve_context("pytanie")
+
+        self.assertEqual(aembed.await_count, 1)
+
+
+@pytest.mark.unit
+class HybridRetrievalTest(TestCase):
+    def setUp(self):
+        self.index = BM25Index(make_temp_dir(self) / "lexical.sqlite3")
+
+    def test_tokenize_stems_polish_inflections(self):
+        """Inflected forms share a prefix stem"""
+        self.assertEqual(tokenize("Ziemniaki"), tokenize("ziemniaków"))
+        self.assertEqual(tokenize("pomidorowa pomidorowej"), ["pomido", "pomido"])
+
+    def test_bm25_ranks_exact_term_matches_first(self):
+        """Chunks containing the query terms rank above the rest"""
+        self.index.add_chunks(["1_a", "1_b", "1_c"], [
+            "Paragon z Biedronki: mleko, chleb, masło",
+            "Instrukcja obsługi pralki",
+            "Serek wiejski i mleko owsiane",
+        ], document_id=1)
+
+        results = self.index.search("masło z Biedronki")
+
+        self.assertEqual(results[0][0], "1_a")
+        self.assertNotIn("1_b", [chunk_id for chunk_id, _, _ in results])
+
+    def test_deleted_chunks_are_not_returned(self):
+        self.index.add_chunks(["1_a"], ["mleko"], document_id=1)
+        self.index.delete_chunks(["1_a"])
+        self.assertEqual(self.index.search("mleko"), [])
+
+    def test_reciprocal_rank_fusion_rewards_agreement(self):
+        """An id ranked by both retrievers beats ids ranked by only one"""
+        fused = reciprocal_rank_fusion([["a", "b"], ["c", "b"]])
+        self.assertEqual(fused[0], "b")
+
+    def test_retrieve_context_falls_back_to_lexical_index(self):
+        """When Ollama is down the BM25 index still answers"""
+        processor = make_processor(self)
+        processor.lexical_index.add_chunks(["1_a"], ["Faktura za prąd"], document_id=1)
+        processor.ollama_client.embed.side_effect = ConnectionError("Ollama down")
+
+        self.assertEqual(processor.retrieve_context("faktura"), ["Faktura za prąd"])
+
+    def test_reindex_keeps_lexical_index_in_sync(self):
+        """New chunks are indexed and orphaned chunks removed from BM25"""
+        import uuid
+        import chromadb
+        processor = make_processor(self)
+        processor.collection = chromadb.EphemeralClient().create_collection(f"test_{uuid.uuid4().hex}")
+
+        processor.reindex_document(1, ["stary paragon"], source="doc.txt")
+        processor.reindex_document(1, ["nowy rachunek"], source="doc.txt")
+
+        self.assertEqual(processor.lexical_index.search("paragon"), [])
+        self.assertEqual(len(processor.lexical_index.search("rachunek")), 1)
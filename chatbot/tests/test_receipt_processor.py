@@ -0,0 +1,244 @@
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import fitz
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+from django.test import TestCase
+
+from chatbot.image_preprocessing import preprocess_receipt, target_width
+from chatbot.receipt_processor import ReceiptProcessor, pixmap_to_array
+from chatbot.services.ocr_pool import OCRConfig, OCRLine, OCRPool, resolve_device
+
+
+class FakeReader:
+    def __init__(self):
+        self.images = []
+
+    def readtext(self, image, **options):
+        # Arrays borrow a pixmap's buffer, so keep a copy for assertions
+        self.images.append(np.array(image) if isinstance(image, np.ndarray) else image)
+        return [([[0, 0], [40, 0], [40, 10], [0, 10]], 'Mleko', 0.91), ([[0, 12], [30, 12], [30, 22], [0, 22]], '3,49', 0.8)]
+
+
+@pytest.mark.unit
+class OCRPoolTest(TestCase):
+    def test_inline_mode_returns_lines_with_boxes(self):
+        reader = FakeReader()
+        with patch('chatbot.services.ocr_pool._reader', reader):
+            lines = OCRPool(workers=0).readtext(b'png-bytes')
+
+        self.assertEqual(reader.images, [b'png-bytes'])
+        self.assertEqual([line.text for line in lines], ['Mleko', '3,49'])
+        self.assertEqual(lines[0].bbox[2], (40.0, 10.0))
+        self.assertIsInstance(lines[0].confidence, float)
+
+    def test_daemonic_processes_run_inline(self):
+        """Celery prefork children may not spawn processes, so OCR stays in-process there"""
+        pool = OCRPool(workers=2)
+        self.assertFalse(pool.inline)
+
+        with patch('chatbot.services.ocr_pool.multiprocessing.current_process', return_value=MagicMock(daemon=True)):
+            with self.assertLogs('chatbot.services.ocr_pool', level='WARNING') as logs:
+                self.assertTrue(pool.inline)
+                self.assertTrue(pool.inline)
+        # The fallback is reported once per process, not per receipt
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("'ocr' queue", logs.output[0])
+
+    def test_receipt_task_is_routed_to_the_ocr_queue(self):
+        from core.celery import app
+        from chatbot.tasks import process_receipt_task
+
+        self.assertEqual(app.amqp.router.route({}, process_receipt_task.name)['queue'].name, 'ocr')
+
+    def test_device_selection(self):
+        with patch('torch.cuda.is_available', return_value=False):
+            self.assertEqual(resolve_device('auto'), 'cpu')
+            self.assertEqual(resolve_device('gpu'), 'cpu')
+        with patch('torch.cuda.is_available', return_value=True):
+            self.assertEqual(resolve_device('auto'), 'gpu')
+            self.assertEqual(resolve_device('cpu'), 'cpu')
+        with self.assertRaises(ValueError):
+            OCRConfig(device='tpu')
+
+    def test_torch_threads_are_split_between_processes(self):
+        with patch('chatbot.services.ocr_pool.os.cpu_count', return_value=8):
+            self.assertEqual(OCRPool(workers=2).config.torch_threads, 4)
+            self.assertEqual(OCRPool(workers=2, config=OCRConfig(torch_threads=1)).config.torch_threads, 1)
+
+
+@pytest.mark.unit
+class ReceiptOCRTest(TestCase):
+    def test_image_text_comes_from_ocr_pool(self):
+        processor = ReceiptProcessor()
+        processor.ocr_pool = MagicMock()
+        processor.ocr_pool.readtext.return_value = [
+            OCRLine('Chleb', 0.9, ((0, 0), (1, 0), (1, 1), (0, 1))),
+            OCRLine('4,99', 0.8, ((0, 2), (1, 2), (1, 3), (0, 3))),
+        ]
+
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image:
+            image.write(b'jpeg-bytes')
+            image.flush()
+            text = processor._extract_text_from_image(image.name)
+
+        self.assertEqual(text, 'Chleb 4,99')
+        processor.ocr_pool.readtext.assert_called_once_with(b'jpeg-bytes')
+
+    def save_pdf(self, directory, pages):
+        """PDF with a text layer on pages given as strings and a scanned-looking box on pages given as None."""
+        document = fitz.open()
+        for text in pages:
+            page = document.new_page(width=100, height=60)
+            if text is None:
+                page.draw_rect(fitz.Rect(10, 10, 50, 30), fill=(0, 0, 0))
+            else:
+                page.insert_text((10, 20), text)
+        path = os.path.join(directory, 'receipt.pdf')
+        document.save(path)
+        return path
+
+    def test_scanned_pdf_pages_reach_ocr_as_arrays(self):
+        """Pages without a text layer are rasterized and passed to OCR in memory"""
+        processor = ReceiptProcessor()
+        processor.ocr_pool = OCRPool(workers=0)
+        reader = FakeReader()
+
+        with tempfile.TemporaryDirectory() as directory, \
+                patch('chatbot.services.ocr_pool._reader', reader), \
+                patch('tempfile.NamedTemporaryFile') as named_temporary_file:
+            text = processor._extract_text_from_pdf(self.save_pdf(directory, [None]))
+
+        self.assertEqual(text, 'Mleko 3,49')
+        named_temporary_file.assert_not_called()
+        image = reader.images[0]
+        self.assertEqual((image.shape, image.dtype), ((120, 200, 3), np.uint8))
+        self.assertEqual(image[40, 40].tolist(), [0, 0, 0])
+        self.assertEqual(image[5, 5].tolist(), [255, 255, 255])
+
+    def test_pages_keep_order_when_ocr_finishes_out_of_order(self):
+        class ReversedPool:
+            """Earlier pages take longer, so their futures complete last"""
+            def __init__(self):
+                self.executor = ThreadPoolExecutor(max_workers=4)
+                self.submitted = 0
+
+            def submit(self, image):
+                index, self.submitted = self.submitted, self.submitted + 1
+                delay = 0.05 * (3 - index)
+                return self.executor.submit(lambda: time.sleep(delay) or [OCRLine(f'skan {index}', 0.9, ())])
+
+            def result(self, future):
+                return future.result()
+
+        processor = ReceiptProcessor()
+        processor.ocr_pool = ReversedPool()
+
+        with tempfile.TemporaryDirectory() as directory:
+            pages = processor._extract_pdf_pages(self.save_pdf(directory, [None, 'Faktura strona 2', None, None]))
+
+        self.assertEqual([page.method for page in pages], ['ocr', 'text', 'ocr', 'ocr'])
+        self.assertEqual([page.text.strip() for page in pages], ['skan 0', 'Faktura strona 2', 'skan 1', 'skan 2'])
+        self.assertGreater(pages[0].seconds, pages[3].seconds)
+
+    def test_inline_ocr_pages_are_timed_one_by_one(self):
+        class InlinePool:
+            """OCR happens inside submit(), like OCRPool in inline mode"""
+            def submit(self, image):
+                future = Future()
+                time.sleep(0.05)
+                future.set_result([OCRLine('skan', 0.9, ())])
+                return future
+
+            def result(self, future):
+                return future.result()
+
+        processor = ReceiptProcessor()
+        processor.ocr_pool = InlinePool()
+
+        with tempfile.TemporaryDirectory() as directory:
+            pages = processor._extract_pdf_pages(self.save_pdf(directory, [None, None, None]))
+
+        # Each page counts only its own OCR, not the pages recognised before it
+        for page in pages:
+            self.assertGreaterEqual(page.seconds, 0.05)
+            self.assertLess(page.seconds, 0.1)
+
+    def test_pixmap_array_shares_the_pixmap_buffer(self):
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 4, 3), False)
+        pix.clear_with(200)
+
+        image = pixmap_to_array(pix)
+
+        self.assertEqual(image.shape, (3, 4, 3))
+        self.assertFalse(image.flags.owndata)
+        self.assertEqual(int(image[2, 3, 0]), 200)
+
+
+def receipt_photo(angle=0.0, size=(3000, 4000), table=70):
+    """JPEG of a light receipt with dark text lines on a (by default darker) table."""
+    receipt = Image.new('L', (1200, 2600), 245)
+    draw = ImageDraw.Draw(receipt)
+    for line in range(40):
+        draw.rectangle((60, 60 + line * 60, 60 + 300 + (line * 137) % 700, 90 + line * 60), fill=20)
+    if angle:
+        receipt = receipt.rotate(angle, expand=True, fillcolor=table)
+    photo = Image.new('L', size, table)
+    photo.paste(receipt, (900, 600))
+    buffer = io.BytesIO()
+    photo.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+@pytest.mark.unit
+class ImagePreprocessingTest(TestCase):
+    def test_crops_to_receipt_and_downscales_to_target_width(self):
+        prepared = preprocess_receipt(receipt_photo())
+
+        left, top, right, bottom = prepared.crop_box
+        self.assertTrue(800 <= left <= 900 and 500 <= top <= 600, prepared.crop_box)
+        self.assertTrue(2100 <= right <= 2200 and 3200 <= bottom <= 3300, prepared.crop_box)
+        self.assertEqual(prepared.pixels.ndim, 2)
+        self.assertEqual(prepared.size[0], target_width())
+        self.assertGreater(12_000_000 / prepared.pixels.size, 5)
+        self.assertEqual(set(prepared.timings), {'decode', 'crop', 'downscale', 'total'})
+
+    def test_uncropped_photo_is_capped_by_longest_side_not_receipt_width(self):
+        prepared = preprocess_receipt(receipt_photo(table=245), max_side=2560)
+
+        self.assertIsNone(prepared.crop_box)
+        self.assertEqual(prepared.size, (1920, 2560))
+
+    def test_small_images_are_not_upscaled(self):
+        prepared = preprocess_receipt(receipt_photo(), dpi=50)
+        self.assertEqual(prepared.size[0], target_width(dpi=50))
+
+        small = io.BytesIO()
+        Image.new('L', (400, 600), 240).save(small, format='PNG')
+        self.assertEqual(preprocess_receipt(small.getvalue()).size, (400, 600))
+
+    def test_deskew_straightens_rotated_receipt(self):
+        prepared = preprocess_receipt(receipt_photo(angle=3), deskew=True)
+
+        self.assertAlmostEqual(prepared.angle, -3, delta=1)
+        self.assertIn('deskew', prepared.timings)
+
+    def test_processor_sends_preprocessed_pixels_to_ocr(self):
+        processor = ReceiptProcessor()
+        processor.ocr_pool = MagicMock()
+        processor.ocr_pool.readtext.return_value = [OCRLine('Jogurt', 0.9, ())]
+
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image:
+            image.write(receipt_photo())
+            image.flush()
+            text = processor._extract_text_from_image(image.name)
+
+        self.assertEqual(text, 'Jogurt')
+        pixels = processor.ocr_pool.readtext.call_args.args[0]
+        self.assertEqual((pixels.ndim, pixels.shape[1]), (2, target_width()))
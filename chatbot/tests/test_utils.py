@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+from django.test import TestCase
+
+from chatbot.utils.lazy import LazyInstance
+
+
+@pytest.mark.unit
+class LazyInstanceTest(TestCase):
+    def test_instance_is_built_on_first_use(self):
+        """Nothing is constructed until an attribute is accessed"""
+        built = []
+
+        class Heavy:
+            def __init__(self):
+                built.append(self)
+                self.value = 42
+
+        proxy = LazyInstance(Heavy)
+        self.assertFalse(proxy.is_initialized)
+        self.assertEqual(built, [])
+
+        self.assertEqual(proxy.value, 42)
+        self.assertTrue(proxy.is_initialized)
+
+    def test_concurrent_access_builds_once(self):
+        """Threads racing on first access share a single instance"""
+        built = []
+        barrier = threading.Barrier(8)
+
+        def factory():
+            built.append(object())
+            return type('Service', (), {'ready': True})()
+
+        proxy = LazyInstance(factory)
+
+        def worker():
+            barrier.wait()
+            proxy.ready
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(built), 1)
+
+    def test_importing_processors_does_not_load_models(self):
+        """Importing the OCR and RAG modules leaves their singletons unbuilt"""
+        from chatbot.rag_processor import rag_processor
+        from chatbot.receipt_processor import receipt_processor
+
+        self.assertFalse(rag_processor.is_initialized)
+        self.assertFalse(receipt_processor.is_initialized)
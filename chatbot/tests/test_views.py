@@ -1,9 +1,14 @@
 import pytest
 import json
-from django.test import TestCase, Client
+from unittest.mock import AsyncMock, patch
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import TestCase, Client, AsyncClient, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
-from chatbot.models import Agent, Document, PantryItem, ReceiptProcessing
+from rest_framework.test import APIRequestFactory
+from chatbot.interfaces import AgentResponse
+from chatbot.models import Agent, Conversation, Document, Message, PantryItem, ReceiptProcessing
 
 
 @pytest.mark.unit
@@ -96,6 +101,132 @@ class APIViewTest(TestCase):
         self.assertNotIn("Inactive Agent", agent_names)
 
 
+@pytest.mark.unit
+class ChatStreamViewTest(TestCase):
+    class StreamingAgent:
+        async def stream(self, input_data):
+            for token in ['Dzień', ' dobry']:
+                yield token
+
+    async def test_streams_tokens_and_saves_reply(self):
+        """Tokens arrive as SSE events and the whole turn is persisted at the end"""
+        manager = AsyncMock()
+        manager.load_turn_context.return_value = {
+            'conversation': {'id': 7, 'agent_name': 'Test Agent', 'user_id': 'u1', 'summary': ''},
+            'recent_messages': [],
+        }
+        factory = AsyncMock()
+        factory.create_agent_from_db.return_value = self.StreamingAgent()
+
+        with patch('chatbot.api.views.conversation_manager', manager), \
+                patch('chatbot.api.views.agent_factory', factory):
+            response = await AsyncClient().post(
+                '/api/chat/stream/',
+                data=json.dumps({'session_id': 's1', 'message': 'hej'}),
+                content_type='application/json'
+            )
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertLess(body.index('Dzień'), body.index('event: done'))
+        conversation_id, (user, assistant) = manager.save_turn.await_args.args
+        self.assertEqual(conversation_id, 7)
+        self.assertEqual((user['role'], user['content']), ('user', 'hej'))
+        self.assertEqual(assistant['content'], 'Dzień dobry')
+        self.assertIsNotNone(assistant['metadata']['time_to_first_token_ms'])
+
+    async def test_requires_session_and_message(self):
+        response = await AsyncClient().post(
+            '/api/chat/stream/', data=json.dumps({'message': 'hej'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@pytest.mark.unit
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ChatMessageViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        agent = Agent.objects.create(name="Test Agent", agent_type="router")
+        self.conversation = Conversation.objects.create(agent=agent, user_id="u1")
+
+    def test_turn_is_saved_and_summary_scheduled(self):
+        from chatbot.api.drf_views import ChatMessageAPIView
+
+        agent = AsyncMock(history_token_budget=100)
+        agent.safe_process.return_value = AgentResponse(success=True, data={'response': 'Dzień dobry'})
+        factory = AsyncMock()
+        factory.create_agent_from_db.return_value = agent
+        view = ChatMessageAPIView()
+        # APIView.dispatch does not await async handlers, so the handler is driven directly
+        request = view.initialize_request(APIRequestFactory().post(
+            '/api/chat/message/', {'session_id': str(self.conversation.session_id), 'message': 'hej'}, format='json'
+        ))
+
+        with patch('chatbot.api.drf_views.agent_factory', factory), \
+                patch('chatbot.tasks.summarize_conversation_task.delay') as delay:
+            response = async_to_sync(view.post)(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['response'], 'Dzień dobry')
+        self.assertEqual(
+            list(self.conversation.messages.order_by('id').values_list('role', 'content')),
+            [('user', 'hej'), ('assistant', 'Dzień dobry')]
+        )
+        # Two short messages stay far below the summary trigger
+        delay.assert_not_called()
+
+    async def test_agent_gets_only_messages_the_summary_does_not_cover(self):
+        messages = [
+            await Message.objects.acreate(conversation=self.conversation, role='user', content=f"message {i}")
+            for i in range(4)
+        ]
+        self.conversation.summary = 'Podsumowanie'
+        self.conversation.summarized_through_at = messages[1].created_at
+        self.conversation.summarized_through_id = messages[1].pk
+        await self.conversation.asave()
+        agent = AsyncMock(history_token_budget=100)
+        agent.safe_process.return_value = AgentResponse(success=True, data={'response': 'ok'})
+        factory = AsyncMock()
+        factory.create_agent_from_db.return_value = agent
+
+        with patch('chatbot.api.views.agent_factory', factory):
+            response = await AsyncClient().post(
+                '/api/chat/message/',
+                data=json.dumps({'session_id': str(self.conversation.session_id), 'message': 'hej'}),
+                content_type='application/json'
+            )
+
+        self.assertTrue(response.json()['success'])
+        agent_input = agent.safe_process.await_args.args[0]
+        self.assertEqual(agent_input['conversation_summary'], 'Podsumowanie')
+        self.assertEqual([m['content'] for m in agent_input['history']], ["message 2", "message 3"])
+
+
+@pytest.mark.unit
+class ConversationHistoryViewTest(TestCase):
+    def setUp(self):
+        agent = Agent.objects.create(name="Test Agent", agent_type="router")
+        self.conversation = Conversation.objects.create(agent=agent)
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, role='user', content=f"message {i}")
+
+    async def test_returns_page_with_cursors(self):
+        url = f'/api/conversations/{self.conversation.session_id}/history/'
+        first = await AsyncClient().get(url, {'limit': 2})
+        older = await AsyncClient().get(url, {'limit': 2, 'before': first.json()['cursors']['before']})
+
+        self.assertEqual([m['content'] for m in first.json()['history']], ['message 1', 'message 2'])
+        self.assertEqual([m['content'] for m in older.json()['history']], ['message 0'])
+        self.assertFalse(older.json()['has_more'])
+
+    async def test_rejects_malformed_cursor(self):
+        response = await AsyncClient().get(
+            f'/api/conversations/{self.conversation.session_id}/history/', {'before': 'garbage'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
 @pytest.mark.unit
 class DocumentViewTest(TestCase):
     def setUp(self):
@@ -0,0 +1,44 @@
+"""
+Lazily constructed module-level singletons.
+
+Heavy service objects (OCR readers, vector store clients) are exposed through
+``LazyInstance`` so importing the module that defines them costs nothing; the
+object is built on first use, exactly once, even under concurrent access.
+"""
+import threading
+from typing import Any, Callable
+
+
+class LazyInstance:
+    """Thread-safe proxy that builds the wrapped object on first attribute access"""
+
+    def __init__(self, factory: Callable[[], Any]):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def get_instance(self) -> Any:
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    instance = self._factory()
+                    object.__setattr__(self, '_instance', instance)
+        return instance
+
+    @property
+    def is_initialized(self) -> bool:
+        return self._instance is not None
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not found on the proxy itself
+        return getattr(self.get_instance(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self.get_instance(), name, value)
+
+    def __repr__(self) -> str:
+        if self.is_initialized:
+            return f"<LazyInstance: {self._instance!r}>"
+        return f"<LazyInstance: {getattr(self._factory, '__name__', self._factory)} (not initialized)>"
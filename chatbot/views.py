@@ -27,8 +27,6 @@ from .services.agent_factory import agent_factory
 from .services.pantry_service import PantryService
 from .services.receipt_service import ReceiptService
 from .conversation_manager import conversation_manager
-from .rag_processor import rag_processor
-from .receipt_processor import receipt_processor
 from .utils.cache_utils import get_agent_statistics, CachedViewMixin 
 
 logger = logging.getLogger(__name__)
@@ -282,13 +280,7 @@ class ChatMessageView(View):
             message = data.get('message')
             if not session_id or not message:
                 return JsonResponse({'success': False, 'error': 'Session ID and message are required'}, status=400)
-            await conversation_manager.add_message(
-                session_id=session_id,
-                role='user',
-                content=message,
-                metadata={'timestamp': 'auto'}
-            )
-            context = await conversation_manager.get_conversation_context(session_id)
+            context = await conversation_manager.load_turn_context(session_id)
             if not context:
                 return JsonResponse({'success': False, 'error': 'Conversation not found'}, status=404)
             agent_name = context['conversation']['agent_name']
@@ -300,33 +292,48 @@ class ChatMessageView(View):
                 'history': context['recent_messages'],
                 'session_id': session_id,
                 'user_id': context['conversation']['user_id'],
+                'conversation_summary': context['conversation']['summary'],
                 'current_datetime': current_datetime_str
             }
             response = await agent.safe_process(agent_input)
+            # User and assistant messages of the turn are written together
+            user_message = {'role': 'user', 'content': message, 'metadata': {'timestamp': 'auto'}}
             if response.success:
                 agent_message = response.data.get('response', 'No response generated')
-                await conversation_manager.add_message(
-                    session_id=session_id,
-                    role='assistant',
-                    content=agent_message,
-                    metadata=response.metadata or {}
+                turn = [user_message, {'role': 'assistant', 'content': agent_message, 'metadata': response.metadata or {}}]
+                await conversation_manager.save_turn(context['conversation']['id'], turn)
+                await conversation_manager.schedule_summary(
+                    context['conversation'], context['recent_messages'], turn,
+                    history_budget=getattr(agent, 'history_token_budget', None)
                 )
                 return JsonResponse({'success': True, 'response': agent_message, 'agent': agent_name, 'metadata': response.metadata})
             else:
+                await conversation_manager.save_turn(context['conversation']['id'], [user_message])
                 return JsonResponse({'success': False, 'error': response.error, 'agent': agent_name})
         except Exception as e:
             logger.error(f"Error processing chat message: {str(e)}")
             return JsonResponse({'success': False, 'error': 'Internal server error'}, status=500)
 
 class ConversationHistoryView(View):
-    """API view for getting conversation history"""
+    """API view for paging through conversation history with before/after cursors"""
     async def get(self, request: HttpRequest, session_id: str):
         try:
-            history = await conversation_manager.get_conversation_history(
+            page = await conversation_manager.get_conversation_history_page(
                 session_id=session_id,
-                limit=int(request.GET.get('limit', 50))
+                limit=int(request.GET.get('limit', 50)),
+                before=request.GET.get('before'),
+                after=request.GET.get('after')
             )
-            return JsonResponse({'success': True, 'history': history})
+            if page is None:
+                return JsonResponse({'success': False, 'error': 'Conversation not found'}, status=404)
+            return JsonResponse({
+                'success': True,
+                'history': page['messages'],
+                'has_more': page['has_more'],
+                'cursors': {'before': page['before'], 'after': page['after']}
+            })
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
         except Exception as e:
             logger.error(f"Error getting conversation history: {str(e)}")
             return JsonResponse({'success': False, 'error': 'Internal server error'}, status=500)
@@ -13,4 +13,29 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    """
+    Django only speaks ASGI HTTP, so lifespan events are handled here to
+    release process-wide resources on shutdown: queued write-behind messages
+    are flushed, pooled Ollama connections closed and OCR processes stopped.
+    """
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+
+    from chatbot.services.message_writer import message_write_behind
+    from chatbot.services.ocr_pool import ocr_pool
+    from chatbot.services.ollama_client import aclose_ollama_clients
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await message_write_behind.aclose()
+            await aclose_ollama_clients()
+            ocr_pool.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
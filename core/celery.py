@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_shutdown
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
@@ -15,6 +16,13 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
 
+
+@worker_shutdown.connect
+def stop_ocr_pool(**kwargs):
+    """Stop the OCR processes owned by a worker serving the OCR queue."""
+    from chatbot.services.ocr_pool import ocr_pool
+    ocr_pool.shutdown(wait=False)
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
@@ -135,11 +135,66 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # OpenWeatherMap API Key
 OPENWEATHERMAP_API_KEY = env('OPENWEATHERMAP_API_KEY')
 
+# RAG ingestion: chunks per embedding request and concurrent embedding requests
+RAG_EMBEDDING_BATCH_SIZE = 32
+RAG_EMBEDDING_CONCURRENCY = 2
+
+# Ollama endpoint and the shared keep-alive connection pool used by all agents
+OLLAMA_URL = 'http://localhost:11434'
+OLLAMA_HTTP_MAX_CONNECTIONS = 20
+OLLAMA_HTTP_MAX_KEEPALIVE_CONNECTIONS = 10
+# Circuit breaker: failures before falling back, seconds before a trial request
+OLLAMA_CIRCUIT_FAILURE_THRESHOLD = 3
+OLLAMA_CIRCUIT_RECOVERY_TIMEOUT = 30
+
+# Router: cached LLM routing decisions (seconds to live, in-process LRU size)
+ROUTER_CACHE_TTL = 3600
+ROUTER_CACHE_MAX_ENTRIES = 1000
+# Embedding intent classifier between the regex and LLM routing tiers
+ROUTER_INTENT_CLASSIFIER = True
+ROUTER_INTENT_MIN_CONFIDENCE = 0.6
+ROUTER_INTENT_MIN_MARGIN = 0.03
+
+# Per-conversation cache of the latest messages (count, seconds to live)
+CHAT_HISTORY_BUFFER_SIZE = 20
+CHAT_HISTORY_BUFFER_TTL = 3600
+
+# Prompt history budget in estimated tokens; older turns are folded into Conversation.summary
+CHAT_HISTORY_TOKEN_BUDGET = 2048
+CHAT_CHARS_PER_TOKEN = 3.5
+CHAT_SUMMARY_KEEP_RATIO = 0.4
+CHAT_SUMMARY_TRIGGER_RATIO = 0.6
+CHAT_SUMMARY_MAX_BATCH = 50
+
+# Queue chat messages in-process and write them in batches (may lose queued messages on a crash)
+CHAT_WRITE_BEHIND = False
+CHAT_WRITE_BEHIND_BATCH_SIZE = 50
+CHAT_WRITE_BEHIND_INTERVAL = 0.5
+CHAT_WRITE_BEHIND_MAX_RETRIES = 5
+CHAT_WRITE_BEHIND_MAX_QUEUE = 5000
+
+# OCR process pool for receipts (0 runs OCR inline in the calling process)
+OCR_POOL_WORKERS = 1
+OCR_POOL_MAX_PENDING = 16
+OCR_TIMEOUT = 120
+OCR_DEVICE = 'auto'  # cpu, gpu or auto
+OCR_QUANTIZE = True
+OCR_TORCH_THREADS = 0  # 0 splits the cores between OCR processes
+OCR_CELERY_QUEUE = 'ocr'  # served by one --pool threads worker that owns the OCR pool
+
+# Receipt photo preprocessing before OCR: scale the receipt to this DPI across an 80 mm roll
+OCR_PREPROCESS = True
+OCR_TARGET_DPI = 300
+OCR_RECEIPT_WIDTH_MM = 80
+OCR_DESKEW = False
+OCR_MAX_SIDE = 2560  # longest side of photos where no receipt was found to crop
+
 # Celery Configuration
 # Note: If Redis is not available, Celery tasks will fail gracefully
 # and the application will fallback to synchronous processing
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+CELERY_TASK_ROUTES = {'chatbot.tasks.process_receipt_task': {'queue': OCR_CELERY_QUEUE}}
 CELERY_TASK_ALWAYS_EAGER = False  # Set to True to run tasks synchronously when debugging
 
 # Django REST Framework Configuration
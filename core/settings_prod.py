@@ -131,9 +131,64 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # OpenWeatherMap API Key
 OPENWEATHERMAP_API_KEY = env('OPENWEATHERMAP_API_KEY')
 
+# RAG ingestion: chunks per embedding request and concurrent embedding requests
+RAG_EMBEDDING_BATCH_SIZE = env.int('RAG_EMBEDDING_BATCH_SIZE', default=64)
+RAG_EMBEDDING_CONCURRENCY = env.int('RAG_EMBEDDING_CONCURRENCY', default=4)
+
+# Ollama endpoint and the shared keep-alive connection pool used by all agents
+OLLAMA_URL = env('OLLAMA_URL', default='http://localhost:11434')
+OLLAMA_HTTP_MAX_CONNECTIONS = env.int('OLLAMA_HTTP_MAX_CONNECTIONS', default=50)
+OLLAMA_HTTP_MAX_KEEPALIVE_CONNECTIONS = env.int('OLLAMA_HTTP_MAX_KEEPALIVE_CONNECTIONS', default=20)
+# Circuit breaker: failures before falling back, seconds before a trial request
+OLLAMA_CIRCUIT_FAILURE_THRESHOLD = env.int('OLLAMA_CIRCUIT_FAILURE_THRESHOLD', default=3)
+OLLAMA_CIRCUIT_RECOVERY_TIMEOUT = env.int('OLLAMA_CIRCUIT_RECOVERY_TIMEOUT', default=30)
+
+# Router: cached LLM routing decisions (seconds to live, in-process LRU size)
+ROUTER_CACHE_TTL = env.int('ROUTER_CACHE_TTL', default=86400)
+ROUTER_CACHE_MAX_ENTRIES = env.int('ROUTER_CACHE_MAX_ENTRIES', default=5000)
+# Embedding intent classifier between the regex and LLM routing tiers
+ROUTER_INTENT_CLASSIFIER = env.bool('ROUTER_INTENT_CLASSIFIER', default=True)
+ROUTER_INTENT_MIN_CONFIDENCE = env.float('ROUTER_INTENT_MIN_CONFIDENCE', default=0.6)
+ROUTER_INTENT_MIN_MARGIN = env.float('ROUTER_INTENT_MIN_MARGIN', default=0.03)
+
+# Per-conversation cache of the latest messages (count, seconds to live)
+CHAT_HISTORY_BUFFER_SIZE = env.int('CHAT_HISTORY_BUFFER_SIZE', default=20)
+CHAT_HISTORY_BUFFER_TTL = env.int('CHAT_HISTORY_BUFFER_TTL', default=3600)
+
+# Prompt history budget in estimated tokens; older turns are folded into Conversation.summary
+CHAT_HISTORY_TOKEN_BUDGET = env.int('CHAT_HISTORY_TOKEN_BUDGET', default=2048)
+CHAT_CHARS_PER_TOKEN = env.float('CHAT_CHARS_PER_TOKEN', default=3.5)
+CHAT_SUMMARY_KEEP_RATIO = env.float('CHAT_SUMMARY_KEEP_RATIO', default=0.4)
+CHAT_SUMMARY_TRIGGER_RATIO = env.float('CHAT_SUMMARY_TRIGGER_RATIO', default=0.6)
+CHAT_SUMMARY_MAX_BATCH = env.int('CHAT_SUMMARY_MAX_BATCH', default=50)
+
+# Queue chat messages in-process and write them in batches (may lose queued messages on a crash)
+CHAT_WRITE_BEHIND = env.bool('CHAT_WRITE_BEHIND', default=False)
+CHAT_WRITE_BEHIND_BATCH_SIZE = env.int('CHAT_WRITE_BEHIND_BATCH_SIZE', default=50)
+CHAT_WRITE_BEHIND_INTERVAL = env.float('CHAT_WRITE_BEHIND_INTERVAL', default=0.5)
+CHAT_WRITE_BEHIND_MAX_RETRIES = env.int('CHAT_WRITE_BEHIND_MAX_RETRIES', default=5)
+CHAT_WRITE_BEHIND_MAX_QUEUE = env.int('CHAT_WRITE_BEHIND_MAX_QUEUE', default=5000)
+
+# OCR process pool for receipts (0 runs OCR inline in the calling process)
+OCR_POOL_WORKERS = env.int('OCR_POOL_WORKERS', default=2)
+OCR_POOL_MAX_PENDING = env.int('OCR_POOL_MAX_PENDING', default=16)
+OCR_TIMEOUT = env.int('OCR_TIMEOUT', default=120)
+OCR_DEVICE = env('OCR_DEVICE', default='cpu')  # cpu, gpu or auto
+OCR_QUANTIZE = env.bool('OCR_QUANTIZE', default=True)
+OCR_TORCH_THREADS = env.int('OCR_TORCH_THREADS', default=0)  # 0 splits the cores between OCR processes
+OCR_CELERY_QUEUE = env('OCR_CELERY_QUEUE', default='ocr')  # served by one --pool threads worker that owns the OCR pool
+
+# Receipt photo preprocessing before OCR: scale the receipt to this DPI across an 80 mm roll
+OCR_PREPROCESS = env.bool('OCR_PREPROCESS', default=True)
+OCR_TARGET_DPI = env.int('OCR_TARGET_DPI', default=300)
+OCR_RECEIPT_WIDTH_MM = env.int('OCR_RECEIPT_WIDTH_MM', default=80)
+OCR_DESKEW = env.bool('OCR_DESKEW', default=False)
+OCR_MAX_SIDE = env.int('OCR_MAX_SIDE', default=2560)  # longest side of photos where no receipt was found to crop
+
 # Celery Configuration
 CELERY_BROKER_URL = env('CELERY_BROKER_URL', default='redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = env('CELERY_RESULT_BACKEND', default='redis://localhost:6379/0')
+CELERY_TASK_ROUTES = {'chatbot.tasks.process_receipt_task': {'queue': OCR_CELERY_QUEUE}}
 
 # Security settings for production
 SECURE_SSL_REDIRECT = env.bool('SECURE_SSL_REDIRECT', default=True)